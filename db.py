@@ -0,0 +1,24 @@
+"""
+db.py
+Shared Supabase client. Built once per process on first use, so modules that
+import each other (listener, telegram_ext) share one client and its HTTP pool.
+"""
+
+from __future__ import annotations
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+from supabase import create_client, Client
+
+load_dotenv()
+
+
+@lru_cache(maxsize=1)
+def get_supabase_client() -> Client:
+    url = os.getenv("SUPABASE_URL")
+    key = (os.getenv("SUPABASE_KEY")
+           or os.getenv("SUPABASE_SERVICE_KEY")
+           or os.getenv("SUPABASE_ANON_KEY"))
+    if not url or not key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_{SERVICE|ANON}_KEY")
+    return create_client(url, key)
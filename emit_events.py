@@ -1,11 +1,12 @@
 import argparse, json, os, sys, inspect
+from functools import lru_cache
 from dotenv import load_dotenv
 from tronpy import Tron
 from tronpy.providers import HTTPProvider
 from tronpy.keys import PrivateKey
 import time
 
-def load_env():
+def _read_env():
     load_dotenv()
     node_url = os.getenv("TRON_NODE_URL", "https://api.nileex.io")
     pk = os.getenv("TRON_PRIVATE_KEY")
@@ -13,9 +14,9 @@ def load_env():
     abi_str = os.getenv("NILE_TRC20_ABI")  # optional; only needed for wrapper path
 
     if not pk:
-        print("[ERR] TRON_PRIVATE_KEY missing in .env", file=sys.stderr); sys.exit(1)
+        raise RuntimeError("TRON_PRIVATE_KEY missing in .env")
     if not addr:
-        print("[ERR] NILE_CONTRACT_ADDRESS missing in .env", file=sys.stderr); sys.exit(1)
+        raise RuntimeError("NILE_CONTRACT_ADDRESS missing in .env")
 
     abi = None
     if abi_str:
@@ -26,6 +27,12 @@ def load_env():
 
     return node_url, pk, addr, abi
 
+def load_env():
+    try:
+        return _read_env()
+    except RuntimeError as e:
+        print(f"[ERR] {e}", file=sys.stderr); sys.exit(1)
+
 def get_contract_any(client: Tron, address: str, abi):
     """Try all known wrappers; return None if unsupported by this tronpy build."""
     try:
@@ -118,10 +125,57 @@ def submit_tx(client, tx_builder, privkey_hex, fee_limit=100_000_000, timeout=90
 
 
 
-def main():
-    node_url, private_key, contract_address, abi = load_env()
+# ---- in-process API (used by telegram_bot / telegram_ext) ----
+@lru_cache(maxsize=1)
+def _ctx():
+    """Client + contract built once per process and reused for every emit."""
+    node_url, private_key, contract_address, abi = _read_env()
     client = Tron(HTTPProvider(node_url))
     c = get_contract_any(client, contract_address, abi)  # may be None on some tronpy versions
+    return client, private_key, contract_address, c
+
+def _res_txid(res):
+    if isinstance(res, dict):
+        return res.get("id") or res.get("txid")
+    return None
+
+def emit_open(token_address: str, token_symbol: str, strategy: str, action: str,
+              entry_price: int, amount: int) -> str | None:
+    """Emit TradeOpen via logTradeOpen; returns the tx id."""
+    client, private_key, contract_address, c = _ctx()
+    if c is not None and hasattr(c, "functions"):
+        txb = c.functions.logTradeOpen(
+            token_address, token_symbol, strategy, action, entry_price, amount
+        )
+        res = submit_tx(client, txb, private_key)
+    else:
+        res = send_function_tx(
+            client, private_key, contract_address,
+            "logTradeOpen(address,string,string,string,uint256,uint256)",
+            [token_address, token_symbol, strategy, action, entry_price, amount],
+        )
+    return _res_txid(res)
+
+def emit_close(trade_id: int, token_address: str, token_symbol: str,
+               exit_price: int, pnl: int, sell_amount: int) -> str | None:
+    """Emit TradeClosed via logTradeClosed (sell_amount allows partial closes); returns the tx id."""
+    client, private_key, contract_address, c = _ctx()
+    if c is not None and hasattr(c, "functions"):
+        txb = c.functions.logTradeClosed(
+            trade_id, token_address, token_symbol, exit_price, pnl, sell_amount
+        )
+        res = submit_tx(client, txb, private_key)
+    else:
+        res = send_function_tx(
+            client, private_key, contract_address,
+            "logTradeClosed(uint256,address,string,uint256,int256,uint256)",
+            [trade_id, token_address, token_symbol, exit_price, pnl, sell_amount],
+        )
+    return _res_txid(res)
+
+
+def main():
+    load_env()  # exit early with a clear message if .env is incomplete
 
     parser = argparse.ArgumentParser()
     sub = parser.add_subparsers(dest="cmd", required=True)
@@ -145,51 +199,11 @@ def main():
     args = parser.parse_args()
 
     if args.cmd == "open":
-        if c is not None and hasattr(c, "functions"):
-            txb = c.functions.logTradeOpen(
-                args.token_address,
-                args.token_symbol, 
-                args.strategy, 
-                args.action, 
-                args.entry_price, 
-                args.amount
-            )
-            submit_tx(client, txb, private_key)
-
-        else:
-            send_function_tx(
-                client, private_key, contract_address,
-                "logTradeOpen(address,string,string,string,uint256,uint256)",
-                [args.token_address,
-                 args.token_symbol, 
-                 args.strategy, 
-                 args.action, 
-                 args.entry_price, 
-                 args.amount],
-            )
-
+        emit_open(args.token_address, args.token_symbol, args.strategy,
+                  args.action, args.entry_price, args.amount)
     elif args.cmd == "close":
-        if c is not None and hasattr(c, "functions"):
-            txb = c.functions.logTradeClosed(
-                args.trade_id, 
-                args.token_address,
-                args.token_symbol, 
-                args.exit_price, 
-                args.pnl, 
-                args.sell_amount
-            )
-            submit_tx(client, txb, private_key)
-        else:
-            send_function_tx(
-                client, private_key, contract_address,
-                "logTradeClosed(uint256,address,string,uint256,int256,uint256)",
-                [args.trade_id, 
-                 args.token_address, 
-                 args.token_symbol,
-                 args.exit_price, 
-                 args.pnl, 
-                 args.sell_amount],
-            )
+        emit_close(args.trade_id, args.token_address, args.token_symbol,
+                   args.exit_price, args.pnl, args.sell_amount)
 
 if __name__ == "__main__":
     main()
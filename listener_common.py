@@ -0,0 +1,37 @@
+"""
+listener_common.py
+Helpers shared by the block-range listeners (tron_listener / tron_listener2).
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+# decimals RPCs and price HTTP calls are independent per token: run a range's worth at once
+_LOOKUP_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="lookup")
+
+def event_price_missing(e: dict) -> bool:
+    """Same test process_trade_event uses before falling back to the price APIs."""
+    raw = e.get("price") or e.get("entryPrice") or e.get("exitPrice")
+    if raw is None:
+        return True
+    try:
+        return Decimal(str(raw)) == 0
+    except InvalidOperation:
+        return False  # process_trade_event will fail on it before any API call
+
+def prefetch_token_info(events: list[dict], get_price, get_decimals=None, deployer_lc: str = ""):
+    """Warm the listener's decimals/price caches for every token in the range concurrently.
+    Events from other traders are skipped (process_trade_event drops them); get_decimals=None
+    skips the decimals lookups (amounts already carry a fixed scale)."""
+    tokens, need_px = set(), set()
+    for e in events:
+        if deployer_lc and str(e.get("trader")).lower() != deployer_lc:
+            continue
+        t = str(e["tokenAddress"]).lower()
+        tokens.add(t)
+        if event_price_missing(e):
+            need_px.add(t)
+    jobs = [] if get_decimals is None else [_LOOKUP_POOL.submit(get_decimals, t) for t in tokens]
+    jobs += [_LOOKUP_POOL.submit(get_price, t) for t in need_px]
+    for j in jobs:
+        j.result()  # the listeners' helpers swallow their own errors
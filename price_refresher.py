@@ -7,6 +7,7 @@ Run on cron / Task Scheduler (e.g., every 1–5 minutes).
 
 from __future__ import annotations
 import os, sys, asyncio
+from functools import lru_cache
 from decimal import Decimal
 from datetime import datetime, timezone
 from os import getenv
@@ -34,23 +35,31 @@ load_dotenv()
 
 SB_URL = os.getenv("SUPABASE_URL")
 SB_KEY = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY")
-if not (SB_URL and SB_KEY):
-    print("❌ Supabase creds missing")
-    sys.exit(1)
-sb = create_client(SB_URL, SB_KEY)
-
 EX_NAME = os.getenv("MARKET_EXCHANGE", "binance")
-ex = getattr(ccxt, EX_NAME)({"enableRateLimit": True, "timeout": 20000})
-try:
-    ex.load_markets()
-except Exception:
-    pass
+
+# Client + exchange are created on first use (not at import) so the bot can
+# import this module and call refresh_once() in-process.
+@lru_cache(maxsize=1)
+def _sb():
+    if not (SB_URL and SB_KEY):
+        raise RuntimeError("Supabase creds missing")
+    return create_client(SB_URL, SB_KEY)
+
+@lru_cache(maxsize=1)
+def _ex():
+    ex = getattr(ccxt, EX_NAME)({"enableRateLimit": True, "timeout": 20000})
+    try:
+        ex.load_markets()
+    except Exception:
+        pass
+    return ex
 
 def ccxt_symbol(symbol: str) -> str:
     return f"{symbol.upper()}/USDT"
 
 def has_ccxt_market(symbol: str) -> bool:
     sym = ccxt_symbol(symbol)
+    ex = _ex()
     return hasattr(ex, "markets") and sym in ex.markets
 
 def now_iso():
@@ -58,26 +67,27 @@ def now_iso():
 
 async def fetch_ccxt_price(symbol: str) -> Decimal | None:
     def _fetch():
-        t = ex.fetch_ticker(ccxt_symbol(symbol))
+        t = _ex().fetch_ticker(ccxt_symbol(symbol))
         return Decimal(str(t["last"]))
     try:
         return await asyncio.to_thread(_fetch)
     except Exception:
         return None
 
-async def refresh_once():
-
+async def refresh_once() -> str:
+    """Refresh prices_latest once; returns the summary line (also printed)."""
     try:
         SYMBOLS_MAP = json.loads(getenv("TOKEN_SYMBOLS_MAP", "{}"))
     except Exception:
         SYMBOLS_MAP = {}
+    sb = _sb()
     # 1) load open positions
     resp = (sb.table("open_trades")
               .select("token_symbol, token_address, avg_entry_price, amount")
               .execute())
     rows = getattr(resp, "data", None) or []
     if not rows:
-        print("[prices] no open_trades"); return
+        print("[prices] no open_trades"); return "[prices] no open_trades"
 
     updates = []
     for r in rows:
@@ -126,12 +136,22 @@ async def refresh_once():
     # 4) upsert in one go (small batches OK)
     if updates:
         sb.table("prices_latest").upsert(updates, on_conflict="token_address").execute()
-        print(f"[prices] upserted {len(updates)} row(s)")
+        msg = f"[prices] upserted {len(updates)} row(s)"
     else:
-        print("[prices] nothing to update")
+        msg = "[prices] nothing to update"
+    print(msg)
+    return msg
+
+def refresh_blocking() -> str:
+    """Run one refresh on a private event loop; meant for asyncio.to_thread from the bot."""
+    return asyncio.run(refresh_once())
 
 def main():
-    asyncio.run(refresh_once())
+    try:
+        refresh_blocking()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
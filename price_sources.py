@@ -6,6 +6,7 @@ from decimal import Decimal
 from typing import Optional, List, Tuple
 from urllib.parse import quote
 import hashlib  # add
+from functools import lru_cache
 
 
 DEXSCREENER_BASE = os.getenv("DEXSCREENER_BASE", "https://api.dexscreener.com")
@@ -139,6 +140,7 @@ def guess_network_for_address(addr: str) -> Optional[str]:
         return None
 
 
+@lru_cache(maxsize=4096)  # same handful of addresses get checked on every command
 def is_token_address(s: str) -> bool:
    if not s: 
        return False
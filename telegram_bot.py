@@ -3,9 +3,11 @@
 
 from __future__ import annotations
 from synthetic_addr import make_synth_hex41
+from emit_events import emit_open, emit_close
+import price_refresher
 from price_sources import is_token_address, fetch_onchain_price_and_meta, guess_network_for_address
-import os, sys, json, re, asyncio, logging, hashlib, subprocess
-from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+import os, sys, json, re, asyncio, logging, hashlib, socket
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP, localcontext
 from secrets import token_urlsafe
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
@@ -24,8 +26,18 @@ from supabase import create_client
 import ccxt
 import logging
 from datetime import datetime, timezone
+from functools import lru_cache
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 # --- SQL agent (optional /ask) ---
-from agent import ask_db
+# imported at boot so the first /ask doesn't pay for LLM/SQLAlchemy imports on the loop;
+# a broken config only disables /ask instead of killing the bot.
+try:
+    from agent import ask_db
+    _ask_import_err = None
+except Exception as e:
+    ask_db = None
+    _ask_import_err = e
 
 
 # ---------- env ----------
@@ -35,16 +47,46 @@ SB_URL = os.getenv("SUPABASE_URL")
 SB_KEY = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY")
 sb = create_client(SB_URL, SB_KEY) if (SB_URL and SB_KEY) else None
 
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-EMITTER_PATH = os.getenv("EMIT_SCRIPT_PATH", "emit_events.py")
+# supabase-py is sync; UI callbacks run its .execute() on this pool so a slow
+# PostgREST round-trip doesn't stall every other chat on the event loop.
+_SB_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="sb")
 
+async def sb_execute(q):
+    return await asyncio.get_running_loop().run_in_executor(_SB_POOL, q.execute)
+
+async def sb_call(fn, *args):
+    """Run a sync helper that talks to Supabase on _SB_POOL."""
+    return await asyncio.get_running_loop().run_in_executor(_SB_POOL, fn, *args)
+
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Webhook mode (optional): if WEBHOOK_URL is set, Telegram pushes updates to us
+# instead of us long-polling getUpdates. WEBHOOK_URL must be the public https
+# base, e.g. https://bot.example.com ; path is appended.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+
+# enough digits for 18-dec amounts times PRICE_SCALE; set per calculation via localcontext()
+DEC_PREC = 40
+
+def _dec(v) -> Decimal:
+    """Decimal from a PostgREST value: numerics come back as str/int, only floats need the str() hop."""
+    if isinstance(v, Decimal):
+        return v
+    if isinstance(v, float):
+        return Decimal(str(v))
+    return Decimal(v)
 
 PRICE_SCALE = Decimal(os.getenv("PRICE_SCALE", "1000000"))
 DEC_DEFAULT = int(os.getenv("TOKEN_DECIMALS_DEFAULT", "6"))
 # SYMBOL to base58 address, e.g. {"TUSDT":"TXYZopYRdj2D9XRtbG411XZZ3kM5VkAeBf"}
-SYMBOLS_MAP = json.loads(os.getenv("TOKEN_SYMBOLS_MAP", "{}"))
-# SYMBOL to decimals, e.g. {"TUSDT":6}
-DECIMALS_MAP = json.loads(os.getenv("TOKEN_DECIMALS_MAP", "{}"))
+# keys normalized once here so lookups don't have to re-case every call
+SYMBOLS_MAP = {k.upper(): v for k, v in json.loads(os.getenv("TOKEN_SYMBOLS_MAP", "{}")).items()}
+# SYMBOL (or address) to decimals, e.g. {"TUSDT":6}; keys stored lowercase
+DECIMALS_MAP = {k.lower(): v for k, v in json.loads(os.getenv("TOKEN_DECIMALS_MAP", "{}")).items()}
 STRATEGY_NAME = os.getenv("STRATEGY_NAME", "MANUAL")
 ADDR_HEX = os.getenv("TOKEN_ADDR_HEX", "1") != "0"  # if your DB stores 41.. hex
 
@@ -52,8 +94,6 @@ if not BOT_TOKEN:
     print("[ERR] TELEGRAM_BOT_TOKEN missing in .env")
     sys.exit(1)
 
-PY = sys.executable
-
 # --- Strategy memory (per chat) ---
 LAST_STRAT: dict[int, str] = {}
 
@@ -87,6 +127,10 @@ def _py_exe() -> str:
     """Current interpreter (venv-safe) for subprocess calls."""
     return sys.executable
 
+# child env for the listener: copied once at boot (env doesn't change at runtime),
+# UTF-8 so its ✅/emoji output survives Windows consoles
+_SUBPROC_ENV = {**os.environ, "PYTHONIOENCODING": "utf-8"}
+
 def _safe_delete_all(table: str, filter_col: str = None):
     """
     Delete all rows from a table. If PostgREST requires a filter, we use a broad 'neq' on a known column.
@@ -121,11 +165,11 @@ for noisy in (
     "gotrue",
     "storage3",
 ):
-    logging.getLogger(noisy).setLevel(logging.WARNING)
-
-# (optional) if you want *no* library chatter at all:
-# for n in (...):
-#     logging.getLogger(n).setLevel(logging.ERROR)
+    _lg = logging.getLogger(noisy)
+    _lg.setLevel(logging.ERROR)
+    _lg.propagate = False   # errors still reach stderr via logging.lastResort
+# httpx logs every supabase request; disabled skips building the record at all
+logging.getLogger("httpx").disabled = True
 
 
 # ---- Signals: parsing & normalization ----
@@ -142,14 +186,6 @@ def ccxt_symbol(symbol: str) -> str:
     """'trx' -> 'TRX/USDT'"""
     return f"{symbol.upper()}/USDT"
 
-def _money(x):
-    try:
-        f = float(Decimal(str(x)))
-        return f"${f:,.2f}"
-    except Exception:
-        return str(x)
-
-
 async def get_market_price(symbol: str) -> Decimal:
     """Fetch last price from exchange for BASE/USDT."""
     def _fetch():
@@ -157,16 +193,47 @@ async def get_market_price(symbol: str) -> Decimal:
         return Decimal(str(t["last"]))
     return await asyncio.to_thread(_fetch)
 
-# ---- token address/decimals helpers ----
-def token_address_for_symbol(sym: str) -> str | None:
-    s = (sym or "").upper()
-    # try direct key, or tolerate 'TRXUSDT' style
-    return SYMBOLS_MAP.get(s) or (SYMBOLS_MAP.get(s[:-4]) if s.endswith("USDT") else None)
+# ---- on-chain price: short TTL + single-flight ----
+# Dexscreener/Ave lookups are slow and bursty (everyone buys the same token at
+# once). Results are reused for a few seconds and concurrent misses for the same
+# address wait on one upstream call instead of each making their own.
+ONCHAIN_PRICE_TTL_S = float(os.getenv("ONCHAIN_PRICE_TTL_S", "3"))
+_ONCHAIN_CACHE: dict[str, tuple[float, tuple]] = {}
+_ONCHAIN_LOCKS: dict[str, asyncio.Lock] = {}
+
+def _onchain_key(addr: str) -> str:
+    a = (addr or "").strip()
+    return a if a[:1] in ("T", "t") else a.lower()  # base58 is case-sensitive, hex isn't
+
+async def _onchain_price_meta(addr: str):
+    """Cached fetch_onchain_price_and_meta(addr) -> (price, symbol, norm_addr)."""
+    k = _onchain_key(addr)
+    hit = _ONCHAIN_CACHE.get(k)
+    if hit and time.monotonic() - hit[0] < ONCHAIN_PRICE_TTL_S:
+        return hit[1]
+    lock = _ONCHAIN_LOCKS.setdefault(k, asyncio.Lock())
+    async with lock:
+        hit = _ONCHAIN_CACHE.get(k)
+        now = time.monotonic()
+        if hit and now - hit[0] < ONCHAIN_PRICE_TTL_S:
+            return hit[1]
+        res = await asyncio.to_thread(fetch_onchain_price_and_meta, addr)
+        if len(_ONCHAIN_CACHE) > 1000:
+            for old in [x for x, (t, _) in _ONCHAIN_CACHE.items() if now - t >= ONCHAIN_PRICE_TTL_S]:
+                del _ONCHAIN_CACHE[old]
+                if old != k and not _ONCHAIN_LOCKS.get(old, lock).locked():
+                    _ONCHAIN_LOCKS.pop(old, None)
+        _ONCHAIN_CACHE[k] = (time.monotonic(), res)
+        return res
 
+# ---- token address/decimals helpers ----
+@lru_cache(maxsize=4096)  # DECIMALS_MAP is fixed after import
 def token_decimals_for_address(addr: str) -> int:
     if not addr:
         return DEC_DEFAULT
-    return int(DECIMALS_MAP.get(addr) or DECIMALS_MAP.get(addr.lower()) or DEC_DEFAULT)
+    if (v := DECIMALS_MAP.get(addr.lower())) is not None:
+        return int(v)                  # 0 is a valid decimals value, don't let `or` eat it
+    return DEC_DEFAULT
 
 def token_address_for_symbol(symbol: str) -> str:
     """
@@ -184,8 +251,30 @@ def token_address_for_symbol(symbol: str) -> str:
 import time
 # ...
 PENDING_SELLS: dict[int, dict] = {}
-# Track which chats have requested /rebuild and await confirmation
-PENDING_REBUILD = set()
+
+# Per-chat UI/wizard state lives in plain dicts; a long-running bot sees plenty of
+# chats that start a flow and never finish it. Entries older than STATE_TTL_S are
+# treated as gone on read, and the dicts are swept once they grow past a size.
+STATE_TTL_S = int(os.getenv("STATE_TTL_S", "1800"))
+_STATE_SWEEP_AT = 1000
+
+def _sweep_expired(d: dict, ts=lambda v: v["ts"]):
+    if len(d) < _STATE_SWEEP_AT:
+        return
+    cutoff = time.monotonic() - STATE_TTL_S
+    for k in [k for k, v in d.items() if ts(v) < cutoff]:
+        del d[k]
+
+# Track which chats have requested /rebuild and await confirmation: chat_id -> monotonic ts
+PENDING_REBUILD: dict[str, float] = {}
+
+def _rebuild_request(chat_id: str):
+    _sweep_expired(PENDING_REBUILD, ts=lambda v: v)
+    PENDING_REBUILD[chat_id] = time.monotonic()
+
+def _rebuild_pending(chat_id: str) -> bool:
+    t = PENDING_REBUILD.get(chat_id)
+    return t is not None and time.monotonic() - t < STATE_TTL_S
 
 SELL_CONFIRM_TIMEOUT_S = int(os.getenv("SELL_CONFIRM_TIMEOUT", "180"))
 
@@ -224,6 +313,55 @@ def quant_amount(units: Decimal, decimals: int) -> Decimal:
     step = Decimal(1) / (Decimal(10) ** decimals)
     return units.quantize(step, rounding=ROUND_HALF_UP)
 
+# ---------- schema probe ----------
+# Older deployments don't have every column (e.g. signal_*.strategy). Probe once
+# with a zero-row select and remember the answer instead of try/except-retrying
+# every write.
+_COL_CACHE: dict[tuple[str, str], bool] = {}
+
+def _has_column(table: str, col: str) -> bool:
+    key = (table, col)
+    if key in _COL_CACHE:
+        return _COL_CACHE[key]
+    if not sb:
+        return False
+    try:
+        sb.table(table).select(col).limit(0).execute()
+        ok = True
+    except APIError:
+        ok = False
+    # anything else (network blip) propagates uncached: the answer is unknown, probe again next time
+    _COL_CACHE[key] = ok
+    return ok
+
+# every probe the bot makes; warmed at startup so handlers normally hit the cache
+_SCHEMA_PROBES = (
+    ("signal_subscriptions", "strategy"),
+    ("signal_alerts", "strategy"),
+    ("signal_alerts_fmt", "line"),
+    ("watcher_state", "last_id"),
+)
+
+async def _has_column_async(table: str, col: str) -> bool:
+    """_has_column for handlers: cached answer, else the probe runs on _SB_POOL, not the loop."""
+    key = (table, col)
+    if key in _COL_CACHE:
+        return _COL_CACHE[key]
+    return await sb_call(_has_column, table, col)
+
+async def warm_schema_cache():
+    # a probe that fails now is simply retried on first use
+    await asyncio.gather(*(_has_column_async(t, c) for t, c in _SCHEMA_PROBES), return_exceptions=True)
+
+def classify_token(raw: str) -> str:
+    """'evm' | 'tron' | 'ticker' from the raw user token, one lower() and no indexing on ''."""
+    low = raw.lower()
+    if len(low) == 42 and low.startswith("0x"):
+        return "evm"
+    if low and (low[0] == "t" or (len(low) == 42 and low.startswith("41"))):
+        return "tron"
+    return "ticker"
+
 # ---------- alias helpers ----------
 def save_alias(alias: str, canonical: str):
     if not sb or not alias or not canonical:
@@ -233,6 +371,19 @@ def save_alias(alias: str, canonical: str):
         {"alias": a, "canonical_address": canonical}
     ).execute()
 
+# 41.. addresses whose legacy 20-byte alias rows were already repointed this run
+_ALIAS_MIGRATED: set[str] = set()
+
+def save_aliases(aliases, canonical: str):
+    """One upsert for several aliases of the same canonical address."""
+    if not sb or not canonical:
+        return
+    # dedupe on the normalized alias: PostgREST rejects a batch that hits the same key twice
+    rows = {a.strip().lower(): {"alias": a.strip().lower(), "canonical_address": canonical}
+            for a in aliases if a and a.strip()}
+    if rows:
+        sb.table("token_aliases").upsert(list(rows.values()), on_conflict="alias").execute()
+
 def resolve_alias(token_or_addr: str) -> str | None:
     if not sb or not token_or_addr:
         return None
@@ -296,18 +447,19 @@ def _b58decode_check(s: str) -> bytes:
 
 
 async def fetch_open_row_by_symbol(symbol: str):
-    resp = (sb.table("open_trades")
-              .select("token_symbol, token_address, trade_id_onchain, amount, avg_entry_price")
-              .eq("token_symbol", symbol.upper())
-              .limit(1)
-              .execute())
+    resp = await sb_execute(
+        sb.table("open_trades")
+          .select("token_symbol, token_address, trade_id_onchain, amount, avg_entry_price")
+          .eq("token_symbol", symbol.upper())
+          .limit(1))
     data = getattr(resp, "data", None) or []
     return data[0] if data else None
 
 
 def token_decimals(symbol: str) -> int:
-    return int(DECIMALS_MAP.get(symbol.upper(), DEC_DEFAULT))
+    return int(DECIMALS_MAP.get(symbol.lower(), DEC_DEFAULT))
 
+@lru_cache(maxsize=4096)
 def normalize_tron_addr(a: str) -> str:
     """
     Accepts base58 T..., hex 41..., or bare 20-byte hex.
@@ -415,19 +567,37 @@ def _mk(builder_rows):
 
 def _money(x):
     try:
-        f = float(Decimal(str(x)))
-        return f"${f:,.2f}"
+        return f"${float(x):,.2f}"
     except Exception:
         return str(x)
 
 def _pct(p):
     try:
-        f = float(Decimal(str(p)))
+        f = float(p)
         sign = "" if f < 0 else "+"
         return f"{sign}{f:.2f}%"
     except Exception:
         return str(p)
 
+# Keyboards are built once here and the same markup object is reused on every
+# edit_text; aiogram still serializes on send, but we skip rebuilding/validating
+# the buttons per keystroke.
+CANCEL_KB = _mk([[("❌ Cancel", "ui:cancel")]])
+BACK_HOME_KB = _mk([[("⬅️ Back", "ui:home")]])
+BACK_AI_KB = _mk([[("⬅️ Back", "ui:ai")]])
+BACK_SIGNALS_KB = _mk([[("⬅️ Back", "ui:signals")]])
+POSITIONS_KB = _mk([[("🔄 Refresh", "pos:refresh"), ("⬅️ Back", "ui:home")]])
+ALERTS_KB = _mk([[("🔄 Refresh", "sig:alerts"), ("⬅️ Back", "ui:signals")]])
+REBUILD_KB = _mk([
+    [("⚠️ Confirm Rebuild", "rebuild:go")],
+    [("⬅️ Back", "ui:home")]
+])
+WIZ_STRATEGY_KB = _mk([
+    [("SMA", "wiz:strategy:sma"), ("RSI", "wiz:strategy:rsi")],
+    [("Blank", "wiz:strategy:blank")],
+    [("❌ Cancel", "ui:cancel")]
+])
+
 # ========= UI: HOME =========
 HOME_KB = _mk([
     [("🟢 Buy", "ui:buy"), ("🔴 Sell", "ui:sell")],
@@ -496,13 +666,21 @@ async def ui_sell(c: CallbackQuery):
 _UI_STATE = {}  # chat_id -> dict
 
 def _set_state(chat_id: int, **kw):
-    _UI_STATE[chat_id] = {"t": asyncio.get_event_loop().time(), **kw}
+    _sweep_expired(_UI_STATE, ts=lambda v: v["t"])
+    _UI_STATE[chat_id] = {"t": time.monotonic(), **kw}
+
+def _get_state(chat_id: int):
+    s = _UI_STATE.get(chat_id)
+    if s and time.monotonic() - s["t"] >= STATE_TTL_S:
+        _UI_STATE.pop(chat_id, None)
+        return None
+    return s
 
 def _pop_state(chat_id: int):
     return _UI_STATE.pop(chat_id, None)
 
 def _has_state(chat_id: int, kind: str):
-    s = _UI_STATE.get(chat_id)
+    s = _get_state(chat_id)
     return s and s.get("kind") == kind
 
 # ====== Quick Buy/Sell presets: ask token next, then dispatch to /buy or /sell ======
@@ -516,7 +694,7 @@ async def ui_preset_amount(c: CallbackQuery):
     await c.message.edit_text(
         f"{'Buy' if mode=='buy' else 'Sell'} preset selected: ${usd}\n"
         "Now send the token (symbol or address), e.g. `TRX` or `41...`.",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     )
     await c.answer()
@@ -526,7 +704,7 @@ async def ui_buy_units(c: CallbackQuery):
     _set_state(c.message.chat.id, kind="buy_units")
     await c.message.edit_text(
         "Send **token and units** to buy, e.g. `TRX 123.45`",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -535,7 +713,7 @@ async def ui_buy_usd(c: CallbackQuery):
     _set_state(c.message.chat.id, kind="buy_usd")
     await c.message.edit_text(
         "Send **token and $ amount**, e.g. `TRX $200`",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -544,7 +722,7 @@ async def ui_sell_units(c: CallbackQuery):
     _set_state(c.message.chat.id, kind="sell_units")
     await c.message.edit_text(
         "Send **token and units** to sell, e.g. `TRX 10`",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -553,7 +731,7 @@ async def ui_sell_usd(c: CallbackQuery):
     _set_state(c.message.chat.id, kind="sell_usd")
     await c.message.edit_text(
         "Send **token and $ amount**, e.g. `TRX $500`",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -562,7 +740,7 @@ async def ui_sell_pct(c: CallbackQuery):
     _set_state(c.message.chat.id, kind="sell_pct")
     await c.message.edit_text(
         "Send **token and percent**, e.g. `TRX 50%` or `TRX 50`",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -576,7 +754,7 @@ async def ui_free_text_router(m: types.Message):
     if (m.text or "").startswith("/"):
         return
 
-    st = _UI_STATE.get(m.chat.id)
+    st = _get_state(m.chat.id)
 
         # --- Signals wizard states ---
     wiz = _wiz_get(m.chat.id)
@@ -597,12 +775,7 @@ async def ui_free_text_router(m: types.Message):
                     net = None
                 data["network"] = net
             _wiz_set(m.chat.id, "strategy", **data)
-            kb = _mk([
-                [("SMA", "wiz:strategy:sma"), ("RSI", "wiz:strategy:rsi")],
-                [("Blank", "wiz:strategy:blank")],
-                [("❌ Cancel", "ui:cancel")]
-            ])
-            await m.reply("Step 2/5 — Choose strategy:", reply_markup=kb)
+            await m.reply("Step 2/5 — Choose strategy:", reply_markup=WIZ_STRATEGY_KB)
             return
 
         # Step 3: fast/slow (we accept "10 30" or just "10,30")
@@ -667,13 +840,9 @@ async def ui_free_text_router(m: types.Message):
             return
         usd = Decimal(st["usd"])
         if kind == "buy_preset":
-            cmd = f"/buy {raw} ${usd}"
-            m2 = m.model_copy(update={"text": cmd})
-            await handle_buy(m2)
+            await _do_buy(m, f"/buy {raw} ${usd}")
         else:
-            cmd = f"/sell {raw} ${usd}"
-            m2 = m.model_copy(update={"text": cmd})
-            await handle_sell(m2)
+            await _do_sell(m, f"/sell {raw} ${usd}")
         _pop_state(m.chat.id)
         return
 
@@ -684,8 +853,7 @@ async def ui_free_text_router(m: types.Message):
             await m.reply("Format: `SYMBOL UNITS` e.g. `TRX 123.45`", parse_mode="Markdown")
             return
         sym, units = parts
-        cmd = f"/buy {sym} {units}"
-        await handle_buy(m.model_copy(update={"text": cmd}))
+        await _do_buy(m, f"/buy {sym} {units}")
         _pop_state(m.chat.id)
         return
 
@@ -697,8 +865,7 @@ async def ui_free_text_router(m: types.Message):
             await m.reply("Format: `SYMBOL $AMOUNT` e.g. `TRX $200`")
             return
         sym, usd = mt.group(1), mt.group(2)
-        cmd = f"/buy {sym} ${usd}"
-        await handle_buy(m.model_copy(update={"text": cmd}))
+        await _do_buy(m, f"/buy {sym} ${usd}")
         _pop_state(m.chat.id)
         return
 
@@ -709,8 +876,7 @@ async def ui_free_text_router(m: types.Message):
             await m.reply("Format: `SYMBOL UNITS` e.g. `TRX 10`", parse_mode="Markdown")
             return
         sym, units = parts
-        cmd = f"/sell {sym} {units}"
-        await handle_sell(m.model_copy(update={"text": cmd}))
+        await _do_sell(m, f"/sell {sym} {units}")
         _pop_state(m.chat.id)
         return
 
@@ -722,8 +888,7 @@ async def ui_free_text_router(m: types.Message):
             await m.reply("Format: `SYMBOL $AMOUNT` e.g. `TRX $500`")
             return
         sym, usd = mt.group(1), mt.group(2)
-        cmd = f"/sell {sym} ${usd}"
-        await handle_sell(m.model_copy(update={"text": cmd}))
+        await _do_sell(m, f"/sell {sym} ${usd}")
         _pop_state(m.chat.id)
         return
 
@@ -739,8 +904,7 @@ async def ui_free_text_router(m: types.Message):
         if pct <= 0 or pct > 100:
             await m.reply("Percent must be between 0 and 100.")
             return
-        cmd = f"/sell {sym} {pct}%"
-        await handle_sell(m.model_copy(update={"text": cmd}))
+        await _do_sell(m, f"/sell {sym} {pct}%")
         _pop_state(m.chat.id)
         return
 
@@ -749,10 +913,15 @@ async def ui_free_text_router(m: types.Message):
 _WIZ = {}  # chat_id -> {"step": str, "data": dict, "ts": float}
 
 def _wiz_set(chat_id: int, step: str, **data):
-    _WIZ[chat_id] = {"step": step, "data": {**data}, "ts": asyncio.get_event_loop().time()}
+    _sweep_expired(_WIZ)
+    _WIZ[chat_id] = {"step": step, "data": {**data}, "ts": time.monotonic()}
 
 def _wiz_get(chat_id: int):
-    return _WIZ.get(chat_id)
+    w = _WIZ.get(chat_id)
+    if w and time.monotonic() - w["ts"] >= STATE_TTL_S:
+        _WIZ.pop(chat_id, None)  # abandoned wizard -> "Session expired"
+        return None
+    return w
 
 def _wiz_pop(chat_id: int):
     return _WIZ.pop(chat_id, None)
@@ -764,23 +933,20 @@ NET_CHOICES = ["eth","bsc","polygon","arbitrum","optimism","base","avax","fantom
 
 
 # ========= UI: POSITIONS (styled card + refresh) =========
-def _positions_kb():
-    return _mk([
-        [("🔄 Refresh", "pos:refresh"), ("⬅️ Back", "ui:home")]
-    ])
-
 async def _load_positions():
     try:
-        resp = (sb.table("open_trades")
+        resp = await sb_execute(sb.table("open_trades")
                   .select("token_symbol, token_address, amount, avg_entry_price")
-                  .limit(20).execute())
+                  .limit(20))
         rows = getattr(resp, "data", None) or []
-        # join with latest prices if available
-        px = (sb.table("prices_latest")
+        addrs = [r["token_address"] for r in rows]
+        if not addrs:
+            return rows
+        # join with latest prices if available (raw values; formatter converts)
+        px = (await sb_execute(sb.table("prices_latest")
                 .select("token_address, last_price")
-                .in_("token_address", [r["token_address"] for r in rows] or [""])
-                .execute()).data or []
-        px_map = {p["token_address"]: Decimal(str(p["last_price"])) for p in px}
+                .in_("token_address", addrs))).data or []
+        px_map = {p["token_address"]: p["last_price"] for p in px}
         for r in rows:
             r["_last_price"] = px_map.get(r["token_address"])
         return rows
@@ -790,19 +956,21 @@ async def _load_positions():
 def _fmt_position_row(r):
     sym = (r.get("token_symbol") or "UNKNOWN").upper()
     addr = r.get("token_address") or ""
-    amt  = Decimal(str(r.get("amount") or 0))
-    avg  = Decimal(str(r.get("avg_entry_price") or 0))
-    last = r.get("_last_price")
+    # display-only math: everything ends up as :.2f, so float is plenty
+    bal  = r.get("amount") or 0
+    amt  = float(bal)
+    avg  = float(r.get("avg_entry_price") or 0)
+    last = float(r.get("_last_price") or 0)
     line1 = f"{sym} — {addr}"
-    if last and last > 0:
+    if last > 0:
         value = last * amt
-        pnl_pct = (last - avg) / avg * 100 if avg and avg > 0 else Decimal(0)
+        pnl_pct = (last - avg) / avg * 100 if avg > 0 else 0.0
         pnl_val = (last - avg) * amt
         pnl_emoji = "🟩" if pnl_pct >= 0 else "🟥"
         details = (
             f"• 💰 Price: {_money(last)}\n"
             f"• 📊 Avg Entry: {_money(avg)}\n"
-            f"• 🔢 Balance: {amt}\n"
+            f"• 🔢 Balance: {bal}\n"
             f"• 💵 Balance Value: {_money(value)}\n"
             f"• 📈 PnL Value: {_money(pnl_val)}\n"
             f"• 📉 PnL: {_pct(pnl_pct)} {pnl_emoji}"
@@ -810,14 +978,14 @@ def _fmt_position_row(r):
     else:
         details = (
             f"• 📊 Avg Entry: {_money(avg)}\n"
-            f"• 🔢 Balance: {amt}\n"
+            f"• 🔢 Balance: {bal}\n"
             f"(No live price yet — tap Refresh)"
         )
     return line1 + "\n" + details
 
 @dp.callback_query(F.data.startswith("wiz:strategy:"))
 async def wiz_pick_strategy(c: CallbackQuery):
-    strat = c.data.split(":")[-1].lower()  # "sma" | "rsi" | "blank"
+    strat = c.data.rpartition(":")[2].lower()  # "sma" | "rsi" | "blank"
     data = (_wiz_get(c.message.chat.id) or {}).get("data", {})
 
     # Ensure your choices list is lowercase: STRAT_CHOICES = ["sma","rsi","blank"]
@@ -833,7 +1001,7 @@ async def wiz_pick_strategy(c: CallbackQuery):
         _wiz_set(c.message.chat.id, "rsi_period", **{**data, "strategy": "rsi"})
         await c.message.edit_text(
             "Step 3/5 — Send **period** (integer), e.g. `14`",
-            reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+            reply_markup=CANCEL_KB,
             parse_mode="Markdown",
         )
     elif strat == "sma":
@@ -841,14 +1009,14 @@ async def wiz_pick_strategy(c: CallbackQuery):
         _wiz_set(c.message.chat.id, "fastslow", **{**data, "strategy": "sma"})
         await c.message.edit_text(
             "Step 3/5 — Send `fast slow` integers.\nExample: `10 30`",
-            reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+            reply_markup=CANCEL_KB,
         )
     else:
         # Placeholder for future strategy "blank"
         _wiz_set(c.message.chat.id, "fastslow", **{**data, "strategy": "blank"})
         await c.message.edit_text(
             "Step 3/5 — Send parameters (TBD). For now, use SMA or RSI.",
-            reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+            reply_markup=CANCEL_KB,
         )
 
     await c.answer()
@@ -857,7 +1025,7 @@ async def wiz_pick_strategy(c: CallbackQuery):
 
 @dp.callback_query(F.data.startswith("wiz:tf:"))
 async def wiz_pick_timeframe(c: CallbackQuery):
-    tf = c.data.split(":")[-1]
+    tf = c.data.rpartition(":")[2]
     if tf not in TF_CHOICES:
         await c.answer("Bad timeframe"); return
     wiz = _wiz_get(c.message.chat.id)
@@ -882,7 +1050,7 @@ async def wiz_pick_timeframe(c: CallbackQuery):
 
 @dp.callback_query(F.data.startswith("wiz:net:"))
 async def wiz_pick_network(c: CallbackQuery):
-    net = c.data.split(":")[-1]
+    net = c.data.rpartition(":")[2]
     wiz = _wiz_get(c.message.chat.id)
     if not wiz:
         await c.answer("Session expired"); return
@@ -904,7 +1072,7 @@ async def _wiz_confirm_and_save(msg: types.Message, data: dict):
     if is_token_address(token_like):
         ds_address = token_like
         try:
-            _, scraped, _ = fetch_onchain_price_and_meta(ds_address)
+            _, scraped, _ = await _onchain_price_meta(ds_address)
             token_symbol = (scraped or "UNKNOWN").upper()
         except Exception:
             token_symbol = "UNKNOWN"
@@ -934,12 +1102,10 @@ async def _wiz_confirm_and_save(msg: types.Message, data: dict):
         "tg_chat_id": chat_id,
         "strategy": strat,
     }
-    try:
-        # If your table lacks 'strategy', fall back without it
-        sb.table("signal_subscriptions").upsert(row, on_conflict=on_conf).execute()
-    except Exception:
+    if not await _has_column_async("signal_subscriptions", "strategy"):
         row.pop("strategy", None)
-        sb.table("signal_subscriptions").upsert(row, on_conflict=on_conf).execute()
+    await sb_execute(sb.table("signal_subscriptions").upsert(row, on_conflict=on_conf))
+    _subs_invalidate(chat_id)
 
     _wiz_pop(msg.chat.id)
     label = ds_address or token_symbol
@@ -955,28 +1121,27 @@ async def _wiz_confirm_and_save(msg: types.Message, data: dict):
 async def ui_positions(c: CallbackQuery):
     rows = await _load_positions()
     if not rows:
-        await c.message.edit_text("No open positions.", reply_markup=_mk([[("⬅️ Back", "ui:home")]]))
+        await c.message.edit_text("No open positions.", reply_markup=BACK_HOME_KB)
         await c.answer(); return
     card = "Open Positions:\n\n" + "\n\n".join(_fmt_position_row(r) for r in rows)
-    await c.message.edit_text(card, reply_markup=_positions_kb())
+    await c.message.edit_text(card, reply_markup=POSITIONS_KB)
     await c.answer()
 
 @dp.callback_query(F.data == "pos:refresh")
 async def ui_positions_refresh(c: CallbackQuery):
     # trigger your refresher script (reuses existing /refresh_prices path) 
     try:
-        m2 = c.message.model_copy(update={"text": "/refresh_prices"})
-        await refresh_prices_cmd(m2)
+        await refresh_prices_cmd(c.message)  # doesn't read .text, no need for a copy
 
     except Exception:
         pass
     # Re-render
     rows = await _load_positions()
     if not rows:
-        await c.message.edit_text("No open positions.", reply_markup=_mk([[("⬅️ Back", "ui:home")]]))
+        await c.message.edit_text("No open positions.", reply_markup=BACK_HOME_KB)
     else:
         card = "Open Positions:\n\n" + "\n\n".join(_fmt_position_row(r) for r in rows)
-        await c.message.edit_text(card, reply_markup=_positions_kb())
+        await c.message.edit_text(card, reply_markup=POSITIONS_KB)
     await c.answer("Prices refreshed")
 
 # ========= UI: SIGNALS HUB (Part 1 shell) =========
@@ -1001,60 +1166,104 @@ async def ui_signals(c: CallbackQuery):
         reply_markup=SIGNALS_KB
     ); await c.answer()
 
-@dp.callback_query(F.data == "sig:subs")
-async def ui_sig_subs(c: CallbackQuery):
+# Per-chat cache of the Subscriptions list: people tap in/out of this screen a
+# lot, no need to hit PostgREST each time. Any write path for a chat's
+# subscriptions calls _subs_invalidate().
+_SUBS_CACHE: dict[str, tuple[float, list[dict]]] = {}
+SUBS_CACHE_TTL_S = 10.0
+
+def _subs_invalidate(chat_id=None):
+    if chat_id is None:
+        _SUBS_CACHE.clear()
+    else:
+        _SUBS_CACHE.pop(str(chat_id), None)
+
+def _sub_label(r: dict) -> str:
+    return r.get("ds_address") or (r.get("token_symbol") or "").upper()
+
+def _fmt_sub_line(r: dict, label: str) -> str:
+    net = r.get("network")
+    net = f" {net}" if net else ""
+    slow = r.get("slow") or 0
+    # If strategy missing, infer: slow!=0 -> SMA, else RSI
+    strat = r.get("strategy") or ("sma" if slow != 0 else "rsi")
+    if strat.lower() == "rsi":
+        return f"• {label}{net} — RSI{r['fast']} {r['timeframe']}"
+    return f"• {label}{net} — SMA{r['fast']}/{r['slow']} {r['timeframe']}"
+
+async def _load_subs(chat_id: str) -> list[dict]:
+    now = time.monotonic()
+    cached = _SUBS_CACHE.get(chat_id)
+    if cached and now - cached[0] < SUBS_CACHE_TTL_S:
+        return cached[1]
     # Always fetch id so delete buttons work
+    cols = "id, token_symbol, ds_address, fast, slow, timeframe, network"
     try:
-        resp = (
+        if await _has_column_async("signal_subscriptions", "strategy"):
+            cols += ", strategy"
+        resp = await sb_execute(
             sb.table("signal_subscriptions")
-              .select("id, token_symbol, ds_address, fast, slow, timeframe, network, strategy")
+              .select(cols)
               .eq("is_enabled", True)
-              .eq("tg_chat_id", str(c.message.chat.id))
+              .eq("tg_chat_id", chat_id)
               .order("token_symbol", desc=False)
               .limit(100)
-              .execute()
         )
         rows = getattr(resp, "data", None) or []
     except Exception:
-        rows = []
+        return []
+    if len(_SUBS_CACHE) > 1000:
+        for k in [k for k, (t, _) in _SUBS_CACHE.items() if now - t >= SUBS_CACHE_TTL_S]:
+            del _SUBS_CACHE[k]
+    _SUBS_CACHE[chat_id] = (now, rows)
+    return rows
 
+async def _render_subs(msg: types.Message, rows: list[dict]):
     if not rows:
         txt = "No active subscriptions."
-        kb = _mk([[("⬅️ Back", "ui:signals")]])
+        kb = BACK_SIGNALS_KB
     else:
-        lines = []
         b = InlineKeyboardBuilder()
+        parts = ["Subscriptions:"]
         for r in rows:
-            label = r.get("ds_address") or (r.get("token_symbol") or "").upper()
-            net   = f" {r.get('network')}" if r.get("network") else ""
-            # If strategy missing, infer: slow!=0 -> SMA, else RSI
-            strat = (r.get("strategy") or ("sma" if (r.get("slow") or 0) != 0 else "rsi")).lower()
-            if strat == "rsi":
-                lines.append(f"• {label}{net} — RSI{r['fast']} {r['timeframe']}")
-            else:
-                lines.append(f"• {label}{net} — SMA{r['fast']}/{r['slow']} {r['timeframe']}")
+            label = _sub_label(r)
+            parts.append(_fmt_sub_line(r, label))
             rid = r.get("id")
             if rid is not None:
                 b.button(text=f"🗑️ {label}", callback_data=f"sig:rm:{rid}")
         b.button(text="⬅️ Back", callback_data="ui:signals")
         b.adjust(1)
         kb = b.as_markup()
-        txt = "Subscriptions:\n" + "\n".join(lines)
+        txt = "\n".join(parts)
+
+    await msg.edit_text(txt, reply_markup=kb)
 
-    await c.message.edit_text(txt, reply_markup=kb)
+@dp.callback_query(F.data == "sig:subs")
+async def ui_sig_subs(c: CallbackQuery):
+    await _render_subs(c.message, await _load_subs(str(c.message.chat.id)))
     await c.answer()
 
 
 @dp.callback_query(F.data.startswith("sig:rm:"))
 async def ui_sig_rm(c: CallbackQuery):
-    sub_id = c.data.split(":")[-1]
+    sub_id = c.data.rpartition(":")[2]
+    chat_id = str(c.message.chat.id)
     try:
-        sb.table("signal_subscriptions").update({"is_enabled": False}).eq("id", int(sub_id)).execute()
+        await sb_execute(sb.table("signal_subscriptions").update({"is_enabled": False}).eq("id", int(sub_id)))
         await c.answer("Removed.", show_alert=False)
     except Exception as e:
         await c.answer(f"Remove failed: {e}", show_alert=True)
-    # Refresh list
-    await ui_sig_subs(c)
+        _subs_invalidate(chat_id)
+        await _render_subs(c.message, await _load_subs(chat_id))
+        return
+    # patch the cached list instead of re-selecting it
+    cached = _SUBS_CACHE.get(chat_id)
+    if cached:
+        rows = [r for r in cached[1] if str(r.get("id")) != sub_id]
+        _SUBS_CACHE[chat_id] = (cached[0], rows)
+    else:
+        rows = await _load_subs(chat_id)
+    await _render_subs(c.message, rows)
 
 @dp.callback_query(F.data == "sig:make")
 async def ui_sig_make(c: CallbackQuery):
@@ -1066,30 +1275,75 @@ async def ui_sig_make(c: CallbackQuery):
         "• `ADA`\n"
         "• `0x...` (EVM)\n"
         "• `T...` or `41...` (TRON)\n",
-        reply_markup=_mk([[("❌ Cancel", "ui:cancel")]]),
+        reply_markup=CANCEL_KB,
         parse_mode="Markdown"
     )
     await c.answer()
 
 
+_DAY_BOUNDS_CACHE: tuple[tuple[int, int, int], tuple[str, str]] | None = None
+
 def _today_bounds_utc():
+    # the bounds only change at UTC midnight; reuse the strings until then
+    global _DAY_BOUNDS_CACHE
     now = datetime.now(timezone.utc)
+    key = (now.year, now.month, now.day)
+    if _DAY_BOUNDS_CACHE and _DAY_BOUNDS_CACHE[0] == key:
+        return _DAY_BOUNDS_CACHE[1]
     start = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
     end = start.replace(hour=23, minute=59, second=59, microsecond=999000)
-    return start.isoformat(), end.isoformat()
-
+    _DAY_BOUNDS_CACHE = (key, (start.isoformat(), end.isoformat()))
+    return _DAY_BOUNDS_CACHE[1]
+
+# Optional server-side formatting for the Alerts screen. If this view exists the
+# bot selects one pre-rendered text line per alert instead of 10 columns:
+#
+#   create or replace view signal_alerts_fmt as
+#   select tg_chat_id, sent_at,
+#          '• ' || signal || ' — ' || coalesce(ds_address, token_address, upper(token_symbol))
+#          || ' SMA' || fast || '/' || slow || ' ' || timeframe
+#          || ' @ ' || price || ' (' || sent_at || ')' as line
+#   from signal_alerts;
+#
+# Without it we fall back to formatting the rows here.
 @dp.callback_query(F.data == "sig:alerts")
 async def ui_sig_alerts(c: CallbackQuery):
     start_iso, end_iso = _today_bounds_utc()
+    chat_id = str(c.message.chat.id)
     try:
-        res = (sb.table("signal_alerts")
-                 .select("ds_address, token_address, token_symbol, fast, slow, timeframe, signal, price, crossed_at, sent_at")
-                 .eq("tg_chat_id", str(c.message.chat.id))
-                 .gte("sent_at", start_iso)
-                 .lte("sent_at", end_iso)
-                 .order("sent_at", desc=True)
-                 .limit(50)
-                 .execute())
+        has_view = await _has_column_async("signal_alerts_fmt", "line")
+    except Exception:
+        has_view = False  # probe failed: use the row path this time
+    if has_view:
+        try:
+            res = await sb_execute(
+                sb.table("signal_alerts_fmt")
+                  .select("line")
+                  .eq("tg_chat_id", chat_id)
+                  .gte("sent_at", start_iso)
+                  .lte("sent_at", end_iso)
+                  .order("sent_at", desc=True)
+                  .limit(50))
+        except Exception as e:
+            # view unavailable right now: format the raw rows below instead
+            print("[alerts] signal_alerts_fmt failed:", type(e).__name__, e)
+        else:
+            # the view concatenates with ||, so a NULL field makes the whole line NULL
+            lines = [r["line"] for r in (getattr(res, "data", None) or []) if r.get("line")]
+            txt = ("Alerts (today):\n" + "\n".join(lines)) if lines else "No alerts today."
+            await c.message.edit_text(txt, reply_markup=ALERTS_KB)
+            await c.answer()
+            return
+
+    try:
+        res = await sb_execute(
+            sb.table("signal_alerts")
+              .select("ds_address, token_address, token_symbol, fast, slow, timeframe, signal, price, crossed_at, sent_at")
+              .eq("tg_chat_id", chat_id)
+              .gte("sent_at", start_iso)
+              .lte("sent_at", end_iso)
+              .order("sent_at", desc=True)
+              .limit(50))
         rows = getattr(res, "data", None) or []
     except Exception:
         rows = []
@@ -1102,8 +1356,7 @@ async def ui_sig_alerts(c: CallbackQuery):
             lines.append(f"• {r['signal']} — {label} SMA{r['fast']}/{r['slow']} {r['timeframe']} @ {r['price']} ({r['sent_at']})")
         txt = "Alerts (today):\n" + "\n".join(lines[:50])
 
-    kb = _mk([[("🔄 Refresh", "sig:alerts"), ("⬅️ Back", "ui:signals")]])
-    await c.message.edit_text(txt, reply_markup=kb)
+    await c.message.edit_text(txt, reply_markup=ALERTS_KB)
     await c.answer()
 
 
@@ -1129,7 +1382,7 @@ async def ui_ai_ask(c: CallbackQuery):
         "Examples:\n"
         "• `/ask Last 5 trades`\n"
         "• `/ask open positions`",
-        reply_markup=_mk([[("⬅️ Back", "ui:ai")]]),
+        reply_markup=BACK_AI_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -1141,7 +1394,7 @@ async def ui_ai_search(c: CallbackQuery):
         "• `/search price TRX`\n"
         "• `/search what is rsi`\n"
         "• `/search strategies for sma/rsi`",
-        reply_markup=_mk([[("⬅️ Back", "ui:ai")]]),
+        reply_markup=BACK_AI_KB,
         parse_mode="Markdown"
     ); await c.answer()
 
@@ -1151,18 +1404,14 @@ async def ui_rebuild(c: CallbackQuery):
     await c.message.edit_text(
         "This will wipe cached tables and rebuild from on‑chain events.\n\n"
         "Tap to proceed:",
-        reply_markup=_mk([
-            [("⚠️ Confirm Rebuild", "rebuild:go")],
-            [("⬅️ Back", "ui:home")]
-        ])
+        reply_markup=REBUILD_KB
     ); await c.answer()
 
 @dp.callback_query(F.data == "rebuild:go")
 async def ui_rebuild_go(c: CallbackQuery):
     # Prime the confirmation set for this chat, then reuse the confirm path
-    PENDING_REBUILD.add(str(c.message.chat.id))
-    m2 = c.message.model_copy(update={"text": "/rebuild_confirm"})
-    await rebuild_confirm_cmd(m2)
+    _rebuild_request(str(c.message.chat.id))
+    await rebuild_confirm_cmd(c.message)  # doesn't read .text, no need for a copy
     await c.answer()
 
 
@@ -1174,28 +1423,26 @@ async def ui_help(c: CallbackQuery):
         "• Use the home buttons for quick actions.\n"
         "• Or try commands:\n"
         "  /buy  /sell  /positions  /refresh_prices  /cs  /ls  /rm  /ask  /search",
-        reply_markup=_mk([[("⬅️ Back", "ui:home")]])
+        reply_markup=BACK_HOME_KB
     ); await c.answer()
 
 @dp.callback_query(F.data == "ui:settings")
 async def ui_settings(c: CallbackQuery):
     await c.message.edit_text(
         "Settings (coming soon).",
-        reply_markup=_mk([[("⬅️ Back", "ui:home")]])
+        reply_markup=BACK_HOME_KB
     ); await c.answer()
 
 
-@dp.callback_query(F.data.startswith("deep:/") | F.data.startswith("deep:/buy") | F.data.startswith("deep:/sell") | F.data.startswith("deep:/"))
+@dp.callback_query(F.data.startswith("deep:/"))
 async def deep_router(c: CallbackQuery):
     # Example callback_data: "deep:/buy TRX $100"
     cmd = c.data[len("deep:"):]
     await c.answer()
-    # Create a faux message for handlers that expect Message.text
-    m2 = c.message.model_copy(update={"text": cmd})
     if cmd.startswith("/buy"):
-        await handle_buy(m2)
+        await _do_buy(c.message, cmd)
     elif cmd.startswith("/sell"):
-        await handle_sell(m2)
+        await _do_sell(c.message, cmd)
     else:
         # Fallback: just echo command text so we see it
         await c.message.answer(cmd)
@@ -1224,11 +1471,49 @@ _BUY_USAGE = (
     "• /buy TRX $100 @ market  (explicit market)\n"
 )
 
+def _tokenize_trade(parts: list[str]):
+    """
+    One left-to-right pass over a /buy or /sell command (parts[0] is the command).
+    Pulls out an optional "@ <price|market|mkt>" pair, drops a bare "market"/"mkt",
+    and returns (body_tokens, price:Decimal|None, price_mode in {'default','market','manual'}).
+    """
+    out_parts = []
+    price = None
+    price_mode = "default"
+    i, n = 1, len(parts)
+    while i < n:
+        tok = parts[i]
+        low = tok.lower()
+        if low == "@":
+            if i + 1 >= n:
+                raise ValueError("missing price after @")
+            nxt = parts[i + 1].lower()
+            if nxt in ("mkt", "market"):
+                price_mode, price = "market", None
+            else:
+                price_mode, price = "manual", Decimal(nxt)
+            i += 2
+            continue
+        if low == "market" or low == "mkt":
+            price_mode = "market"
+        else:
+            out_parts.append(tok)
+        i += 1
+    return out_parts, price, price_mode
+
 @dp.message(Command("buy"))
 async def handle_buy(m: Message):
+    await _do_buy(m, m.text or "")
+
+async def _do_buy(m: Message, text: str):
+    """/buy body; UI paths call this with their own text instead of copying the Message."""
     try:
-        parts = m.text.strip().split()
-        if len(parts) < 3:
+        parts = text.strip().split()
+        try:
+            body, manual_px, _ = _tokenize_trade(parts)
+        except ValueError:
+            await m.reply(_BUY_USAGE); return
+        if len(body) < 2:
             await m.reply(_BUY_USAGE); return
 
         # Parse basic pieces
@@ -1243,7 +1528,7 @@ async def handle_buy(m: Message):
         # Supported:
         #   /buy SYMBOL 100
         #   /buy SYMBOL $100
-        chunk = parts[2].replace(",", "")
+        chunk = body[1].replace(",", "")
         try:
             if chunk.startswith("$"):
                 spend_usd = Decimal(chunk[1:])
@@ -1261,19 +1546,18 @@ async def handle_buy(m: Message):
 
 
         # Resolve address vs ticker and pick the price source
-        raw = parts[1].strip()
+        raw = body[0].strip()
 
         if is_token_address(raw):
             # On-chain path: Dexscreener → Ave.ai fallback
-            px, scraped_symbol, norm_addr = fetch_onchain_price_and_meta(raw)
+            px, scraped_symbol, norm_addr = await _onchain_price_meta(raw)
             symbol = scraped_symbol           # e.g., 'USDT'
             addr   = norm_addr                # normalized token address (41.. or base58)
 
             # --- INSERT SYNTHETIC FALLBACK RIGHT HERE ---
             # If user passed a non-TRON address (0x...) and you want to still emit on TRON,
             # synthesize a 41... address for logging when SYNTHETIC_FOR_NONTRON=1
-            non_tron = not (raw.startswith("T") or raw[:2].lower() == "41")
-            if non_tron:
+            if classify_token(raw) != "tron":
                 addr = make_synth_hex41(symbol) 
                 # store original `raw` somewhere if you want
             # --- END INSERT ---
@@ -1292,32 +1576,23 @@ async def handle_buy(m: Message):
 
 
         # Optional @ price override (keep whatever px we already chose unless user overrides)
-        if "@" in parts:
-            at_idx = parts.index("@")
-            if at_idx + 1 >= len(parts):
-                await m.reply(_BUY_USAGE); return
-            price_arg = parts[at_idx + 1].lower()
-            if price_arg in ("mkt", "market"):
-                pass  # keep px from above
-            else:
-                px = Decimal(price_arg)
-        else:
-            pass  # keep px from above
+        if manual_px is not None:
+            px = manual_px
 
         # Do NOT overwrite addr later; now get decimals using the resolved addr
         addr = normalize_tron_addr(addr)
-        save_alias(symbol.upper(), addr)           # ticker → canonical
-        save_alias(addr, addr)                     # canonical → canonical
-        save_alias(parts[1].strip(), addr)  
+        # ticker → canonical, canonical → canonical, raw input → canonical (one round-trip)
+        await sb_call(save_aliases, [symbol.upper(), addr, raw], addr)
         try:
-            if addr and addr.startswith("41") and len(addr) == 42:
-                # auto-migrate old alias rows pointing to bare 20-byte
-                sb.table("token_aliases") \
-                .update({"canonical_address": addr}) \
-                .eq("canonical_address", addr[2:]) \
-                .execute()
-                # ensure canonical→canonical exists
-                save_alias(addr, addr)
+            if addr and addr.startswith("41") and len(addr) == 42 and addr not in _ALIAS_MIGRATED:
+                # auto-migrate old alias rows pointing to bare 20-byte (once per address;
+                # canonical→canonical is already in the batch above)
+                await sb_execute(
+                    sb.table("token_aliases")
+                      .update({"canonical_address": addr})
+                      .eq("canonical_address", addr[2:])
+                )
+                _ALIAS_MIGRATED.add(addr)
         except Exception:
             pass
 
@@ -1350,29 +1625,16 @@ async def handle_buy(m: Message):
         )
         await m.reply(pretty)
 
-        # call emitter (blocking in thread so we don't freeze the loop)
-        def _emit_open():
-                strategy = strategy_for_chat(m.chat.id)
-                return subprocess.run(
-                    [PY, EMITTER_PATH, "open",
-                    "--token-address", addr,         # real or synthetic 41…
-                    "--token-symbol", symbol.upper(),# <-- NEW: pass ticker
-                    "--strategy", strategy,
-                    "--action", "BUY",
-                    "--entry-price", str(entry_price_int),
-                    "--amount", str(amount_int)],
-                    check=True, capture_output=True, text=True
-            )
-
-        res = await asyncio.to_thread(_emit_open)
-
-        # try to surface tx id
-        txid = None
-        for tok in (res.stdout, res.stderr):
-            if tok:
-                m_ = re.search(r"\b([0-9a-f]{64})\b", tok, re.I)
-                if m_:
-                    txid = m_.group(1); break
+        # call emitter in-process (blocking tronpy calls run in a thread so we don't freeze the loop)
+        txid = await asyncio.to_thread(
+            emit_open,
+            token_address=addr,                  # real or synthetic 41…
+            token_symbol=symbol.upper(),
+            strategy=strategy_for_chat(m.chat.id),
+            action="BUY",
+            entry_price=entry_price_int,
+            amount=amount_int,
+        )
         await m.answer(f"✅ Submitted.\nTX: {txid or '(see logs)'}")
 
     except Exception as e:
@@ -1399,33 +1661,22 @@ def parse_sell_args(words: list[str]):
     if len(words) < 3:
         raise ValueError("not enough args")
 
-    # find optional "@ price"
-    manual_px = None
-    if "@" in words:
-        i = words.index("@")
-        if i + 1 >= len(words):
-            raise ValueError("missing price after @")
-        p = words[i + 1].lower()
-        manual_px = None if p in ("mkt", "market") else Decimal(p)
-
-    # body without command and '@' parts
-    body = [w for w in words[1:] if w != "@" and w.lower() not in ("market", "mkt")]
+    # optional "@ price" and bare market words handled in the same pass that collects the body
+    body, manual_px, _ = _tokenize_trade(words)
     if len(body) < 2:
         raise ValueError("need symbol and amount/percent/$")
 
-    # choose symbol + chunk (order-agnostic)
+    # choose symbol + chunk (order-agnostic); SYMBOLS_MAP keys are uppercased at import
     s0, s1 = body[0], body[1]
-    cand0 = s0.upper()
-    cand1 = s1.upper()
-    if cand0 in SYMBOLS_MAP:
+    if s0.upper() in SYMBOLS_MAP:
         symbol, chunk = s0, s1
-    elif cand1 in SYMBOLS_MAP:
+    elif s1.upper() in SYMBOLS_MAP:
         symbol, chunk = s1, s0
     else:
         # assume first is symbol; second is chunk
         symbol, chunk = s0, s1
 
-    c = chunk.strip().upper()
+    c = chunk.strip()  # '%' / '$' have no case, Decimal() doesn't care either
 
     # percent?
     if c.endswith("%"):
@@ -1452,15 +1703,19 @@ from price_sources import is_token_address, fetch_onchain_price_and_meta
 
 @dp.message(Command("sell"))
 async def handle_sell(m: Message):
+    await _do_sell(m, m.text or "")
+
+async def _do_sell(m: Message, text: str):
     try:
-        parts = m.text.strip().split()
+        parts = text.strip().split()
         if len(parts) < 3:
             await m.reply(_SELL_USAGE); return
 
         token_like, mode, val, manual_px = parse_sell_args(parts)
         raw = token_like.strip()
-        is_evm  = raw.lower().startswith("0x") and len(raw) == 42
-        is_tron = (raw[0] in ("T","t")) or (raw.lower().startswith("41") and len(raw) == 42)
+        kind = classify_token(raw)
+        is_evm  = kind == "evm"
+        is_tron = kind == "tron"
 
         # We will set these in exactly one path, then fall through to SHARED SELL LOGIC
         row = None; addr = None; symbol_for_emit = None; px = None
@@ -1473,7 +1728,7 @@ async def handle_sell(m: Message):
 
             # 1) Price + symbol from DEX
             try:
-                px, scraped_symbol, _ = fetch_onchain_price_and_meta(evm_addr)
+                px, scraped_symbol, _ = await _onchain_price_meta(evm_addr)
             except Exception:
                 if manual_px is None:
                     await m.reply("Couldn’t fetch DEX price for that 0x address. Add @ <price> to your /sell."); return
@@ -1486,7 +1741,7 @@ async def handle_sell(m: Message):
 
             symbol_for_emit = scraped_symbol.upper()
             # fetch rows by symbol
-            candidates = fetch_open_rows_by_symbol(symbol_for_emit)
+            candidates = await sb_call(fetch_open_rows_by_symbol, symbol_for_emit)
             if len(candidates) == 0:
                 await m.reply(f"No open position for {symbol_for_emit}."); return
             if len(candidates) > 1:
@@ -1510,13 +1765,13 @@ async def handle_sell(m: Message):
         # ---------------- TRON ADDRESS PATH ----------------
         elif is_tron:
             addr = normalize_tron_addr(raw)
-            row = fetch_open_row_by_address(addr)
+            row = await sb_call(fetch_open_row_by_address, addr)
             if not row:
                 await m.reply("No open position for that TRON address."); return
             symbol_for_emit = row["token_symbol"]
             if manual_px is None:
                 try:
-                    px, _, _ = fetch_onchain_price_and_meta(addr)
+                    px, _, _ = await _onchain_price_meta(addr)
                 except Exception:
                     await m.reply("Couldn’t fetch market price on-chain. Add @ <price> to your /sell."); return
             else:
@@ -1529,17 +1784,17 @@ async def handle_sell(m: Message):
             symbol = raw.upper()
 
             # Try alias→address or env map first
-            addr = resolve_alias(symbol) or SYMBOLS_MAP.get(symbol)
+            addr = await sb_call(resolve_alias, symbol) or SYMBOLS_MAP.get(symbol)
             if addr:
-                row = fetch_open_row_by_address(addr)
+                row = await sb_call(fetch_open_row_by_address, addr)
 
             if not row:
                 # Fallback: look up open_trades by symbol
-                candidates = fetch_open_rows_by_symbol(symbol)
+                candidates = await sb_call(fetch_open_rows_by_symbol, symbol)
                 if len(candidates) == 1:
                     row = candidates[0]
                     addr = row["token_address"]
-                    save_alias(symbol, addr)  # seed for next time
+                    await sb_call(save_alias, symbol, addr)  # seed for next time
                 elif len(candidates) > 1:
                     await m.reply(
                         f"Multiple open positions for {symbol}. "
@@ -1553,8 +1808,8 @@ async def handle_sell(m: Message):
             addr = normalize_tron_addr(addr)
 
             # Pull core fields now (we may stage or sell immediately)
-            open_amt  = Decimal(str(row["amount"]))
-            avg_entry = Decimal(str(row["avg_entry_price"]))
+            open_amt  = _dec(row["amount"])
+            avg_entry = _dec(row["avg_entry_price"])
             trade_id  = int(row["trade_id_onchain"])
             decs      = token_decimals_for_address(addr)
 
@@ -1571,7 +1826,7 @@ async def handle_sell(m: Message):
             # If CCXT failed, try on-chain price by TRON address before asking for confirm
             if not ((px is not None) and (px > 0)):
                 try:
-                    px_tron, _, _ = fetch_onchain_price_and_meta(addr)  # TRON base58 or 41.. works
+                    px_tron, _, _ = await _onchain_price_meta(addr)  # TRON base58 or 41.. works
                     if px_tron and px_tron > 0:
                         px = px_tron  # fall through to shared SELL logic and emit now
                 except Exception:
@@ -1603,8 +1858,8 @@ async def handle_sell(m: Message):
                 return
 
         # ---------- SHARED SELL LOGIC ----------
-        open_amt  = Decimal(str(row["amount"]))
-        avg_entry = Decimal(str(row["avg_entry_price"]))
+        open_amt  = _dec(row["amount"])
+        avg_entry = _dec(row["avg_entry_price"])
         trade_id  = int(row["trade_id_onchain"])
         decs      = token_decimals_for_address(addr)
 
@@ -1624,10 +1879,12 @@ async def handle_sell(m: Message):
             await m.reply("Sell size rounds to zero; increase percentage/amount."); return
 
         # PnL & scaling
-        realized       = (px - avg_entry) * sell_units
-        exit_price_int = scale_price(px)
-        sell_amount_int= scale_amount(sell_units, decs)
-        pnl_int        = int((realized * PRICE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
+        with localcontext() as ctx:
+            ctx.prec = DEC_PREC
+            realized       = (px - avg_entry) * sell_units
+            exit_price_int = scale_price(px)
+            sell_amount_int= scale_amount(sell_units, decs)
+            pnl_int        = int((realized * PRICE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
 
         # Preview
         await m.reply(
@@ -1638,32 +1895,18 @@ async def handle_sell(m: Message):
             f"• Amount: {sell_units} ({sell_amount_int})\n"
         )
 
-        # Emit on-chain
-        def _emit_close():
-            return subprocess.run(
-                [PY, EMITTER_PATH, "close",
-                "--trade-id", str(trade_id),
-                "--token-address", addr,
-                "--token-symbol", symbol_for_emit,
-                "--exit-price", str(exit_price_int),
-                "--pnl", str(pnl_int),
-                "--sell-amount", str(sell_amount_int)],
-                check=True, capture_output=True, text=True
-            )
-
-        res = await asyncio.to_thread(_emit_close)
-
-        # Surface TX id (same as BUY)
-        txid = None
-        for tok in (res.stdout, res.stderr):
-            if tok:
-                m_ = re.search(r"\b([0-9a-f]{64})\b", tok, re.I)
-                if m_:
-                    txid = m_.group(1); break
+        # Emit on-chain (in-process, same as BUY)
+        txid = await asyncio.to_thread(
+            emit_close,
+            trade_id=trade_id,
+            token_address=addr,
+            token_symbol=symbol_for_emit,
+            exit_price=exit_price_int,
+            pnl=pnl_int,
+            sell_amount=sell_amount_int,
+        )
         await m.answer(f"✅ Submitted.\nTX: {txid or '(see logs)'}")
 
-    except subprocess.CalledProcessError as e:
-        await m.reply(f"❌ SELL error: {e.returncode}\n{e.stderr or e.stdout}")
     except Exception as e:
         await m.reply(f"❌ SELL error: {type(e).__name__}: {e}")
 
@@ -1672,6 +1915,45 @@ async def asktest_cmd(m: types.Message):
     await m.reply("asktest OK")
 
 
+# /ask answers: same question from the same chat within ASK_CACHE_TTL_S is served
+# from memory, and concurrent identical questions share one LLM+DB call.
+ASK_CACHE_TTL_S = 60.0
+ASK_CACHE_MAX = 256
+ASK_TIMEOUT_S = 45
+_ask_cache: "OrderedDict[tuple[str, str], tuple[float, str]]" = OrderedDict()
+# key -> [lock, callers holding or waiting on it]; dropped when the last one leaves
+_ask_locks: dict[tuple[str, str], list] = {}
+
+def _ask_cache_get(key):
+    hit = _ask_cache.get(key)
+    if hit and time.monotonic() - hit[0] < ASK_CACHE_TTL_S:
+        _ask_cache.move_to_end(key)
+        return hit[1]
+    return None
+
+async def _ask_cached(question: str, chat_id: str) -> str:
+    key = (" ".join(question.lower().split()), chat_id)
+    answer = _ask_cache_get(key)
+    if answer is not None:
+        return answer
+    entry = _ask_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            answer = _ask_cache_get(key)  # filled while we waited?
+            if answer is not None:
+                return answer
+            answer = await asyncio.wait_for(asyncio.to_thread(ask_db, question, chat_id), timeout=ASK_TIMEOUT_S)
+            _ask_cache[key] = (time.monotonic(), answer)
+            _ask_cache.move_to_end(key)
+            while len(_ask_cache) > ASK_CACHE_MAX:
+                _ask_cache.popitem(last=False)
+            return answer
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _ask_locks.pop(key, None)
+
 @dp.message(Command("ask"))
 async def ask_cmd(m: types.Message):
     print("[/ask] handler entered for chat", m.chat.id, "text=", (m.text or ""))
@@ -1680,30 +1962,24 @@ async def ask_cmd(m: types.Message):
         await m.reply("Usage: /ask <question>\nExample: /ask Which day had the highest total PnL?")
         return
 
+    if ask_db is None:
+        await m.reply(f"❌ /ask unavailable: {type(_ask_import_err).__name__}: {_ask_import_err}")
+        return
+
     question = parts[1].strip()
     await m.reply("🧠 Thinking…")
 
-    # keep the UI responsive: show typing every 4s until done
-    stop = asyncio.Event()
+    # keep the UI responsive: show typing every 4s until cancelled below
     async def _typing():
-        try:
-            while not stop.is_set():
-                await m.bot.send_chat_action(m.chat.id, ChatAction.TYPING)
-                await asyncio.wait_for(stop.wait(), timeout=4.0)
-        except asyncio.TimeoutError:
-            pass
+        while True:
+            await m.bot.send_chat_action(m.chat.id, ChatAction.TYPING)
+            await asyncio.sleep(4)
 
     typer = asyncio.create_task(_typing())
 
     try:
-        # import here to surface config errors as messages, not crashes
-        from agent import ask_db  # uses OPENAI_API_KEY + DB_URI under the hood. :contentReference[oaicite:1]{index=1}
-
-        def _run():
-            return ask_db(question, str(m.chat.id))
-
-        # make sure we don’t hang forever if the LLM/db is slow
-        answer = await asyncio.wait_for(asyncio.to_thread(_run), timeout=45)
+        # make sure we don’t hang forever if the LLM/db is slow (timeout inside)
+        answer = await _ask_cached(question, str(m.chat.id))
         if answer.strip().startswith("```"):
             await m.reply(answer[:4096], parse_mode="Markdown")
         else:
@@ -1715,13 +1991,64 @@ async def ask_cmd(m: types.Message):
     except Exception as e:
         await m.reply(f"❌ Query error: {type(e).__name__}: {e}")
     finally:
-        stop.set()
-        try:
-            await typer
-        except Exception:
-            pass
+        typer.cancel()
+        await asyncio.gather(typer, return_exceptions=True)
 
 
+# ---- /search routes ----
+async def _search_price(m: types.Message, qtxt: str, qlow: str):
+    token = qtxt.split(maxsplit=1)[1].strip()
+    try:
+        res = await get_token_price(token)
+        if res.get("ok"):
+            sym, px, src = res["symbol"], res["price"], res["source"]
+            await m.reply(f"Price — {sym}: ${float(px):,.6f} (source: {src})")
+        else:
+            await m.reply("Couldn’t fetch price. If it’s on‑chain only, send the token address (0x… or T…/41…).")
+    except Exception as e:
+        await m.reply(f"❌ Price error: {e}")
+
+async def _search_indicator(m: types.Message, qtxt: str, qlow: str):
+    term = qlow.split()[-1]
+    await m.reply(explain_indicator(term))
+
+async def _search_tron_volume(m: types.Message, qtxt: str, qlow: str):
+    data = tron_dex_volume_24h()
+    if data.get("ok"):
+        await m.reply(f"TRON DEX 24h Volume: ${data['usd_24h']:,.0f} (source: {data['source']})")
+    else:
+        await m.reply("Couldn’t fetch TRON volume right now.")
+
+async def _search_strategies(m: types.Message, qtxt: str, qlow: str):
+    try:
+        ans = research_strategies(qtxt)
+    except Exception:
+        ans = research_strategies()  # fallback template
+    await m.reply(ans[:4096])
+
+async def _search_general(m: types.Message, qtxt: str, qlow: str):
+    try:
+        ans = research_general(qtxt)
+    except Exception:
+        ans = "Task: Answer the user’s question concisely\nI couldn’t fetch web results right now."
+    await m.reply(ans[:4096])
+
+# One anchored match picks the route; alternatives are in priority order
+# (price > indicator > tron volume > strategies), anything else -> general.
+_SEARCH_DISPATCH = re.compile(
+    r"(?P<price>price )"
+    r"|(?P<indicator>what is (?:rsi|sma|ema|macd))"
+    r"|(?P<tron>(?=.*tron)(?=.*(?:volume|dex)))"
+    r"|(?P<strategy>(?=.*strateg(?:y|ies)))",
+    re.S,
+)
+_SEARCH_ROUTES = {
+    "price": _search_price,
+    "indicator": _search_indicator,
+    "tron": _search_tron_volume,
+    "strategy": _search_strategies,
+}
+
 @dp.message(Command("search"))
 async def search_cmd(m: types.Message):
     qtxt = ((m.text or "").split(maxsplit=1) + [""])[1].strip()
@@ -1737,68 +2064,20 @@ async def search_cmd(m: types.Message):
         return
 
     qlow = qtxt.lower().strip()
-
-    # 1) Price
-    if qlow.startswith("price "):
-        token = qtxt.split(maxsplit=1)[1].strip()
-        try:
-            res = await get_token_price(token)
-            if res.get("ok"):
-                sym, px, src = res["symbol"], res["price"], res["source"]
-                await m.reply(f"Price — {sym}: ${float(px):,.6f} (source: {src})")
-            else:
-                await m.reply("Couldn’t fetch price. If it’s on‑chain only, send the token address (0x… or T…/41…).")
-        except Exception as e:
-            await m.reply(f"❌ Price error: {e}")
-        return
-
-    # 2) Indicator explainers
-    if any(qlow.startswith(f"what is {t}") for t in ("rsi","sma","ema","macd")):
-        term = qlow.split()[-1]
-        await m.reply(explain_indicator(term)); return
-
-    # 3) TRON volume
-    if "tron" in qlow and ("volume" in qlow or "dex" in qlow):
-        data = tron_dex_volume_24h()
-        if data.get("ok"):
-            await m.reply(f"TRON DEX 24h Volume: ${data['usd_24h']:,.0f} (source: {data['source']})")
-        else:
-            await m.reply("Couldn’t fetch TRON volume right now.")
-        return
-
-# inside /search handler:
-    if "strategy" in qlow or "strategies" in qlow:
-        try:
-            ans = research_strategies(qtxt)
-        except Exception as e:
-            ans = research_strategies()  # fallback template
-        await m.reply(ans[:4096]); return
-
-    # general fallback:
-    try:
-        ans = research_general(qtxt)
-    except Exception:
-        ans = "Task: Answer the user’s question concisely\nI couldn’t fetch web results right now."
-    await m.reply(ans[:4096])
-
+    mt = _SEARCH_DISPATCH.match(qlow)
+    route = _SEARCH_ROUTES.get(mt.lastgroup) if mt else None
+    await (route or _search_general)(m, qtxt, qlow)
 
 
 @dp.message(Command("refresh_prices"))
 async def refresh_prices_cmd(m: types.Message):
     await m.reply("⏳ Refreshing prices…")
-    def _run():
-        # run the same interpreter so venv/site‑packages are consistent
-        return subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "price_refresher.py")],
-                      check=True, capture_output=True, text=True, encoding="utf-8", errors="replace",
-                      env={**os.environ, "PYTHONIOENCODING":"utf-8"})
-
     try:
-        res = await asyncio.to_thread(_run)
-        out = (res.stdout or "").strip()
-        tail = "\n".join(out.splitlines()[-10:]) if out else "Done."
-        await m.reply(f"✅ Prices refreshed.\n{tail}")
-    except subprocess.CalledProcessError as e:
-        await m.reply(f"❌ Refresh failed:\n{e.stderr or e.stdout or str(e)}")
+        # in-process; the refresher does sync HTTP/DB calls so it gets its own thread + loop
+        summary = await asyncio.to_thread(price_refresher.refresh_blocking)
+        await m.reply(f"✅ Prices refreshed.\n{summary or 'Done.'}")
+    except Exception as e:
+        await m.reply(f"❌ Refresh failed:\n{type(e).__name__}: {e}")
 
 
 @dp.message(Command("rebuild"))
@@ -1807,7 +2086,7 @@ async def rebuild_cmd(m: types.Message):
     /rebuild -> ask for confirmation (dangerous op)
     """
     chat_id = str(m.chat.id)
-    PENDING_REBUILD.add(chat_id)
+    _rebuild_request(chat_id)
     await m.reply(
         "⚠️ This will WIPE `open_trades` and `trade_history`, then backfill from on-chain events.\n\n"
         "If you're sure, run:\n/rebuild_confirm"
@@ -1819,54 +2098,60 @@ async def rebuild_confirm_cmd(m: types.Message):
     /rebuild_confirm -> purge + run tron_listener3.py once
     """
     chat_id = str(m.chat.id)
-    if chat_id not in PENDING_REBUILD:
+    if not _rebuild_pending(chat_id):
         await m.reply("Nothing to confirm. Use /rebuild first."); return
 
     try:
-        await m.reply("⏳ Rebuilding tables from events… this may take a minute.")
+        status = await m.reply("⏳ Rebuilding tables from events… this may take a minute.")
 
         # 1) Purge tables
         # If your Supabase requires filters on DELETE, we pass a harmless wide-true predicate.
-        _safe_delete_all("open_trades",    filter_col="token_address")
-        _safe_delete_all("trade_history",  filter_col="event_uid")
-
-        # 2) Run listener once
-        py = _py_exe()
-        listener = _listener_path()
-
-        def _run_once():
-            env = os.environ.copy()
-            env["PYTHONIOENCODING"] = "utf-8"   # ensure UTF-8 stdout/stderr
-            return subprocess.run(
-                [py, listener, "once"],
-                check=True, capture_output=True, text=True, env=env
-            )
-
-
-        res = await asyncio.to_thread(_run_once)
+        await sb_call(_safe_delete_all, "open_trades", "token_address")
+        await sb_call(_safe_delete_all, "trade_history", "event_uid")
+
+        # 2) Run listener once, streaming its output so the user sees progress
+        proc = await asyncio.create_subprocess_exec(
+            _py_exe(), _listener_path(), "once",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            env=_SUBPROC_ENV,
+        )
+        tail = deque(maxlen=10)
+        last_edit = time.monotonic()
+        async for raw in proc.stdout:
+            line = raw.decode("utf-8", "replace").rstrip()
+            if not line:
+                continue
+            tail.append(line)
+            if time.monotonic() - last_edit >= 3:  # stay well under Telegram's edit rate limit
+                last_edit = time.monotonic()
+                try:
+                    await status.edit_text(f"⏳ Rebuilding…\n\n{line[:500]}")
+                except Exception:
+                    pass
+        rc = await proc.wait()
 
-        # 3) Report back the tail of stdout
-        out = (res.stdout or "").strip()
-        # find a friendly line (tron_listener3.py ends with a ✅ summary)
-        lines = out.splitlines()[-10:] if out else []
-        msg = "\n".join(lines) if lines else "Done."
-        await m.reply(f"✅ Rebuild complete.\n\n{msg}")
+        # 3) Report back the tail of the output (tron_listener3.py ends with a ✅ summary)
+        msg = "\n".join(tail) if tail else "Done."
+        if rc:
+            await m.reply(f"❌ Rebuild failed (exit {rc}):\n{msg}")
+        else:
+            await m.reply(f"✅ Rebuild complete.\n\n{msg}")
 
-    except subprocess.CalledProcessError as e:
-        err = (e.stderr or e.stdout or str(e)).strip()
-        await m.reply(f"❌ Rebuild failed:\n{err}")
     except APIError as e:
         await m.reply(f"❌ DB error during purge: {e}")
     except Exception as e:
         await m.reply(f"❌ Unexpected error: {type(e).__name__}: {e}")
     finally:
-        PENDING_REBUILD.discard(chat_id)
+        PENDING_REBUILD.pop(chat_id, None)
 
 
 @dp.message(Command("confirmaddr"))
 async def confirm_addr_cmd(m: Message):
+    await _confirm_addr(m, m.text or "")
+
+async def _confirm_addr(m: Message, text: str):
     try:
-        parts = (m.text or "").split()
+        parts = text.split()
         if len(parts) != 2:
             await m.reply("Usage: /confirmaddr <0x… or T…/41…>"); return
 
@@ -1881,7 +2166,7 @@ async def confirm_addr_cmd(m: Message):
 
         # fetch price + symbol from the provided address (works for 0x or TRON)
         try:
-            px, scraped_symbol, _ = fetch_onchain_price_and_meta(provided)
+            px, scraped_symbol, _ = await _onchain_price_meta(provided)
         except Exception:
             await m.reply("Couldn’t fetch market price for that address. Use @ <price> in /sell."); return
 
@@ -1915,10 +2200,12 @@ async def confirm_addr_cmd(m: Message):
             await m.reply("Sell size rounds to zero; increase percentage/amount."); return
 
         # PnL & scaling
-        realized       = (px - avg_entry) * sell_units
-        exit_price_int = scale_price(px)
-        sell_amount_int= scale_amount(sell_units, decs)
-        pnl_int        = int((realized * PRICE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
+        with localcontext() as ctx:
+            ctx.prec = DEC_PREC
+            realized       = (px - avg_entry) * sell_units
+            exit_price_int = scale_price(px)
+            sell_amount_int= scale_amount(sell_units, decs)
+            pnl_int        = int((realized * PRICE_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
 
         # Preview and emit
         await m.reply(
@@ -1929,37 +2216,24 @@ async def confirm_addr_cmd(m: Message):
             f"• Amount: {sell_units} ({sell_amount_int})\n"
         )
 
-        def _emit_close():
-            return subprocess.run(
-                [PY, EMITTER_PATH, "close",
-                 "--trade-id", str(trade_id),
-                 "--token-address", addr,
-                 "--token-symbol", staged_symbol,
-                 "--exit-price", str(exit_price_int),
-                 "--pnl", str(pnl_int),
-                 "--sell-amount", str(sell_amount_int)],
-                check=True, capture_output=True, text=True
-            )
-
-        res = await asyncio.to_thread(_emit_close)
-        txid = None
-        for tok in (res.stdout, res.stderr):
-            if tok:
-                m_ = re.search(r"\b([0-9a-f]{64})\b", tok, re.I)
-                if m_:
-                    txid = m_.group(1); break
+        txid = await asyncio.to_thread(
+            emit_close,
+            trade_id=trade_id,
+            token_address=addr,
+            token_symbol=staged_symbol,
+            exit_price=exit_price_int,
+            pnl=pnl_int,
+            sell_amount=sell_amount_int,
+        )
         await m.answer(f"✅ Submitted.\nTX: {txid or '(see logs)'}")
 
-    except subprocess.CalledProcessError as e:
-        await m.reply(f"❌ SELL error: {e.returncode}\n{e.stderr or e.stdout}")
     except Exception as e:
         await m.reply(f"❌ SELL error: {type(e).__name__}: {e}")
 
 
 @dp.message(Command("confirm0x"))
 async def confirm0x_cmd(m: Message):
-    m2 = m.model_copy(update={"text": (m.text or "").replace("/confirm0x", "/confirmaddr", 1)})
-    return await confirm_addr_cmd(m2)
+    return await _confirm_addr(m, (m.text or "").replace("/confirm0x", "/confirmaddr", 1))
 
 
 
@@ -1974,7 +2248,7 @@ async def positions_cmd(m: Message):
     if symbol:
         q = q.eq("token_symbol", symbol)
 
-    resp = q.limit(20).execute()
+    resp = await sb_execute(q.limit(20))
     rows = getattr(resp, "data", None) or []
     if not rows:
         await m.reply(f"No open position for {symbol}." if symbol else "No open positions found.")
@@ -2030,12 +2304,10 @@ async def create_rsi_sub(m: types.Message):
         "strategy": "rsi",
         "network": network,
     }
-    try:
-        sb.table("signal_subscriptions").insert(row).execute()
-    except Exception:
-        # if strategy col not yet present, try without it
+    if not await _has_column_async("signal_subscriptions", "strategy"):
         row.pop("strategy", None)
-        sb.table("signal_subscriptions").insert(row).execute()
+    await sb_execute(sb.table("signal_subscriptions").insert(row))
+    _subs_invalidate(m.chat.id)
 
     await m.reply(f"✅ Subscribed: {sym or tron_addr} RSI{period} {tf}")
 
@@ -2060,10 +2332,10 @@ async def remove_rsi_sub(m: types.Message):
                .delete()
                .eq("token_symbol", sym).eq("fast", period).eq("slow", 0).eq("timeframe", tf))
 
-    try:
-        q.eq("strategy", "rsi").execute()
-    except Exception:
-        q.execute()  # fallback if no strategy column
+    if await _has_column_async("signal_subscriptions", "strategy"):
+        q = q.eq("strategy", "rsi")
+    await sb_execute(q)
+    _subs_invalidate()  # not scoped to a chat, so drop every cached list
     await m.reply(f"🗑️ Removed: {token_like} RSI{period} {tf}")
 
 
@@ -2102,7 +2374,7 @@ async def create_signal_cmd(m: types.Message):
         ds_address = token_like
         # Optional display symbol; non-fatal
         try:
-            _, scraped_symbol, _ = fetch_onchain_price_and_meta(ds_address)
+            _, scraped_symbol, _ = await _onchain_price_meta(ds_address)
             token_symbol = (scraped_symbol or "UNKNOWN").upper()
         except Exception:
             token_symbol = "UNKNOWN"
@@ -2130,7 +2402,8 @@ async def create_signal_cmd(m: types.Message):
     }
 
     try:
-        sb.table("signal_subscriptions").upsert(row, on_conflict=on_conf).execute()
+        await sb_execute(sb.table("signal_subscriptions").upsert(row, on_conflict=on_conf))
+        _subs_invalidate(m.chat.id)
     except APIError as e:
         await m.reply("DB missing unique index for this subscription.\n"
                       "Ensure sigsubs_ds_unique_idx includes (ds_address, network, fast, slow, timeframe, tg_chat_id).\n"
@@ -2150,10 +2423,11 @@ async def create_signal_cmd(m: types.Message):
 async def list_signals_cmd(m: types.Message):
     if not sb:
         await m.reply("Supabase not configured"); return
-    resp = (sb.table("signal_subscriptions")
-              .select("token_symbol, ds_address, fast, slow, timeframe")
-              .eq("is_enabled", True)
-              .eq("tg_chat_id", str(m.chat.id)).execute())
+    resp = await sb_execute(
+        sb.table("signal_subscriptions")
+          .select("token_symbol, ds_address, fast, slow, timeframe")
+          .eq("is_enabled", True)
+          .eq("tg_chat_id", str(m.chat.id)))
     rows = getattr(resp, "data", None) or []
     if not rows:
         await m.reply("No active subscriptions."); return
@@ -2187,21 +2461,22 @@ async def remove_signal_cmd(m: types.Message):
     tf = tf.lower()
     token_like = token_like.strip()
     chat_id = str(m.chat.id)
+    _subs_invalidate(chat_id)
 
     if is_token_address(token_like):
-        (sb.table("signal_subscriptions").delete()
-           .eq("ds_address", token_like)
-           .eq("fast", fast).eq("slow", slow)
-           .eq("timeframe", tf).eq("tg_chat_id", chat_id)
-           .execute())
+        await sb_execute(
+            sb.table("signal_subscriptions").delete()
+              .eq("ds_address", token_like)
+              .eq("fast", fast).eq("slow", slow)
+              .eq("timeframe", tf).eq("tg_chat_id", chat_id))
         await m.reply(f"🗑️ Removed: {token_like} SMA{fast}/{slow} {tf}")
     else:
         sym = token_like.upper()
-        (sb.table("signal_subscriptions").delete()
-           .eq("token_symbol", sym)
-           .eq("fast", fast).eq("slow", slow)
-           .eq("timeframe", tf).eq("tg_chat_id", chat_id)
-           .execute())
+        await sb_execute(
+            sb.table("signal_subscriptions").delete()
+              .eq("token_symbol", sym)
+              .eq("fast", fast).eq("slow", slow)
+              .eq("timeframe", tf).eq("tg_chat_id", chat_id))
         await m.reply(f"🗑️ Removed: {sym} SMA{fast}/{slow} {tf}")
 
 
@@ -2216,13 +2491,14 @@ async def rm_confirm_cmd(m: types.Message):
         await m.reply("No pending remove, start with /rm …"); return
 
     addr = normalize_tron_addr(parts[1])
-    (sb.table("signal_subscriptions")
-       .delete()
-       .eq("token_address", addr)
-       .eq("fast", pend["fast"]).eq("slow", pend["slow"])
-       .eq("timeframe", pend["tf"])
-       .eq("tg_chat_id", pend["tg"])
-       .execute())
+    await sb_execute(
+        sb.table("signal_subscriptions")
+          .delete()
+          .eq("token_address", addr)
+          .eq("fast", pend["fast"]).eq("slow", pend["slow"])
+          .eq("timeframe", pend["tf"])
+          .eq("tg_chat_id", pend["tg"]))
+    _subs_invalidate(pend["tg"])
     await m.reply(f"🗑️ Removed: {addr} SMA{pend['fast']}/{pend['slow']} {pend['tf']}")
 
 
@@ -2231,8 +2507,8 @@ def _row_chat_id_tg(r) -> int | None:
     if v is None:
         return None
     try:
-        return int(str(v))
-    except Exception:
+        return v if type(v) is int else int(v)
+    except (TypeError, ValueError):
         return None
 
 # --- signals watcher (replace your existing one) ---
@@ -2242,132 +2518,282 @@ def _row_chat_id_tg(r) -> int | None:
 # ... (other code above) ...
 
 
+_SIGNALS_COLS = (
+    "id, token_symbol, token_address, ds_address, fast, slow, timeframe, "
+    "signal, price, crossed_at, dedupe_key, source"
+)
+_WATCHER_SUB_COLS = {
+    col: f"tg_chat_id, {col}, fast, slow, timeframe"
+    for col in ("ds_address", "token_address", "token_symbol")
+}
+
+def _sig_cores(sig: dict) -> tuple[str, str, str, str, str]:
+    """(key_col, core, ds, tron, sym) for a signals row; each field normalized once."""
+    ds, tron, sym = sig.get("ds_address"), sig.get("token_address"), sig.get("token_symbol")
+    ds = ds.strip() if isinstance(ds, str) else ""
+    tron = tron.strip() if isinstance(tron, str) else ""
+    sym = sym.strip().upper() if isinstance(sym, str) else ""
+    if ds:
+        return "ds_address", ds, ds, tron, sym
+    if tron:
+        return "token_address", tron, ds, tron, sym
+    return "token_symbol", sym, ds, tron, sym
+
+def _load_watcher_subs(cores: list[tuple]) -> dict[tuple, list[dict]]:
+    """
+    Enabled subscriptions for a batch of signals, keyed by
+    (key_col, core, fast, slow, timeframe). At most 3 queries, whatever the batch size.
+    `cores` are _sig_cores() results.
+    """
+    wanted: dict[str, set] = {"ds_address": set(), "token_address": set(), "token_symbol": set()}
+    for c in cores:
+        wanted[c[0]].add(c[1])
+
+    out: dict[tuple, list[dict]] = {}
+    for col, vals in wanted.items():
+        if not vals:
+            continue
+        res = (sb.table("signal_subscriptions")
+                 .select(_WATCHER_SUB_COLS[col])
+                 .in_(col, list(vals))
+                 .eq("is_enabled", True)
+                 .execute())
+        for r in getattr(res, "data", None) or []:
+            k = (col, r.get(col), r.get("fast"), r.get("slow"), r.get("timeframe"))
+            out.setdefault(k, []).append(r)
+    return out
+
+# Telegram caps bots at ~30 msg/s overall; 8 sends in flight stays well under it.
+_SEND_SEM = asyncio.Semaphore(8)
+
+async def _send_chat_batch(bot: Bot, chat_id: int, msgs: list[tuple]):
+    # one chat's alerts go out in order; different chats run concurrently
+    for txt, kb in msgs:
+        async with _SEND_SEM:
+            try:
+                await bot.send_message(chat_id, txt, reply_markup=kb)
+            except Exception as e:
+                print("[signals] send failed:", chat_id, type(e).__name__, e)
+
+def _upsert_alerts(rows: list[dict]):
+    """One upsert for the whole tick; drops `strategy` and retries if the column isn't there."""
+    if not rows:
+        return
+    if not _has_column("signal_alerts", "strategy"):
+        rows = [{k: v for k, v in r.items() if k != "strategy"} for r in rows]
+    try:
+        sb.table("signal_alerts").upsert(rows, on_conflict="tg_chat_id,sig_key").execute()
+    except APIError:
+        if "strategy" not in rows[0]:
+            raise
+        _COL_CACHE[("signal_alerts", "strategy")] = False
+        rows = [{k: v for k, v in r.items() if k != "strategy"} for r in rows]
+        sb.table("signal_alerts").upsert(rows, on_conflict="tg_chat_id,sig_key").execute()
+
+# Optional table so restarts resume where they left off instead of rescanning:
+#
+#   create table watcher_state (
+#     watcher_id text primary key,
+#     last_id    bigint not null default 0,
+#     updated_at timestamptz not null default now()
+#   );
+#
+# Without it the watcher starts from the newest signal on boot.
+WATCHER_ID = os.getenv("WATCHER_ID") or socket.gethostname()
+WATCHER_PAGE = 500
+
+def _watermark_load() -> int:
+    if _has_column("watcher_state", "last_id"):
+        try:
+            res = (sb.table("watcher_state").select("last_id")
+                     .eq("watcher_id", WATCHER_ID).limit(1).execute())
+            data = getattr(res, "data", None) or []
+            if data:
+                return int(data[0]["last_id"] or 0)
+        except Exception as e:
+            print("[signals] watermark load failed:", type(e).__name__, e)
+    # no saved state: skip history rather than re-alerting everything
+    res = sb.table("signals").select("id").order("id", desc=True).limit(1).execute()
+    data = getattr(res, "data", None) or []
+    return int(data[0]["id"]) if data else 0
+
+def _watermark_save(last_id: int):
+    if not _has_column("watcher_state", "last_id"):
+        return
+    try:
+        sb.table("watcher_state").upsert(
+            {"watcher_id": WATCHER_ID, "last_id": last_id,
+             "updated_at": datetime.now(timezone.utc).isoformat()},
+            on_conflict="watcher_id",
+        ).execute()
+    except Exception as e:
+        print("[signals] watermark save failed:", type(e).__name__, e)
+
+
+async def _process_signal_page(bot: Bot, rows: list[dict]):
+    # 2) find subscribers for the whole page: one query per key column
+    #    (priority: ds > tron > symbol), grouped locally by (core, fast, slow, tf)
+    cores = [_sig_cores(sig) for sig in rows]
+    subs_by_key = await sb_call(_load_watcher_subs, cores)
+    sent_at = datetime.now(timezone.utc).isoformat()  # one stamp per page is plenty
+    outbox: dict[int, list[tuple]] = {}
+    pending_alerts: dict[tuple, dict] = {}  # (chat_id, sig_key) -> row; dupes would fail the batch
+
+    for sig, (key_col, label, core_ds, core_tron, core_sym) in zip(rows, cores):
+        fast = sig.get("fast")
+        slow = sig.get("slow")
+        tf   = sig.get("timeframe")
+        price = sig.get("price")
+        crossed_at = sig.get("crossed_at")
+        signal_str = sig.get("signal")
+
+        src_label = "SMA" if (sig.get("source") or "sma").lower() == "sma" else "RSI"
+
+        # Build/normalize dedupe key
+        sig_key = sig.get("dedupe_key")
+        if not sig_key:
+            crossed_iso = crossed_at if isinstance(crossed_at, str) else (
+                crossed_at.isoformat() if crossed_at else ""
+            )
+            sig_key = f"{label}|{tf}|{fast}|{slow}|{crossed_iso}"
+
+        subs_rows = subs_by_key.get((key_col, label, fast, slow, tf), ())
+
+        if not subs_rows:
+            continue
+
+        # 3) compose message + button once per signal; identical for every subscriber
+        sep = f"{fast}/{slow}" if src_label == "SMA" else f"{fast}"  # RSI has no slow leg
+        txt = f"📈 {signal_str} — {label}\n{src_label}{sep} {tf} @ {price}\n{crossed_at}"
+
+        base_cmd = "/buy" if signal_str == "BUY" else "/sell"
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=("Buy $100" if signal_str == "BUY" else "Sell $100"),
+                callback_data=f"deep:{base_cmd} {label} $100"
+            )
+        ]])
+
+        # 4) queue alert row + message per subscriber
+        for s in subs_rows:
+            chat_id = _row_chat_id_tg(s)
+            if chat_id is None:
+                continue
+
+            # written once per page, keyed by chat_id + sig_key
+            alert_row = {
+                "tg_chat_id": str(chat_id),
+                "sig_key": sig_key,
+                "ds_address": core_ds or None,
+                "token_address": core_tron or None,
+                "token_symbol": core_sym or None,
+                "fast": fast, "slow": slow, "timeframe": tf,
+                "signal": signal_str, "price": price,
+                "crossed_at": crossed_at,
+                "sent_at": sent_at,
+                "strategy": src_label,  # store displayed strategy label
+            }
+            pending_alerts[(chat_id, sig_key)] = alert_row
+            outbox.setdefault(chat_id, []).append((txt, kb))
+
+    # 5) record all alerts in one round trip, then fan out sends
+    try:
+        await sb_call(_upsert_alerts, list(pending_alerts.values()))
+    except Exception as e:
+        print("[signals] alert upsert failed:", type(e).__name__, e)
+
+    if outbox:
+        await asyncio.gather(
+            *(_send_chat_batch(bot, cid, msgs) for cid, msgs in outbox.items()),
+            return_exceptions=True,
+        )
+
+
+# Realtime (optional): with SIGNALS_REALTIME=1 an INSERT on `signals` wakes the
+# watcher right away over the Supabase websocket; polling drops to a slow safety net.
+# Needs `alter publication supabase_realtime add table signals;` on the DB side.
+SIGNALS_REALTIME = os.getenv("SIGNALS_REALTIME", "0") == "1"
+SIGNALS_FALLBACK_POLL_S = int(os.getenv("SIGNALS_FALLBACK_POLL_S", "60"))
+_RT_CLIENT = None  # keep a ref so the async client (and its socket) isn't collected
+_RT_LIVE = False   # channel status is SUBSCRIBED: only then is the slow fallback poll safe
+
+async def _subscribe_signal_inserts(wake: asyncio.Event) -> bool:
+    global _RT_CLIENT
+    try:
+        from supabase import acreate_client
+        asb = await acreate_client(SB_URL, SB_KEY)
+        await asb.realtime.connect()
+        ch = asb.channel("signals-watcher")
+        ch.on_postgres_changes("INSERT", schema="public", table="signals",
+                               callback=lambda _payload: wake.set())
+
+        def _on_status(status, err=None):
+            global _RT_LIVE
+            _RT_LIVE = str(getattr(status, "value", status)) == "SUBSCRIBED"
+            if not _RT_LIVE:
+                print("[signals] realtime status:", status, err or "")
+            wake.set()  # re-evaluate the poll interval now
+
+        await ch.subscribe(_on_status)
+        _RT_CLIENT = asb
+        return True
+    except Exception as e:
+        print("[signals] realtime unavailable, polling only:", type(e).__name__, e)
+        return False
+
 async def signals_watcher(bot: Bot, interval: int = 15):
     """
     Periodically scans the `signals` table and sends alerts to subscribers.
     Supports SMA and RSI via the `source` column on `signals`.
     Dedupe per (chat_id, sig_key) using upsert into `signal_alerts`.
+    New rows are read in pages of WATCHER_PAGE past a persisted id watermark.
     """
     print(f"[signals] watcher running every {interval}s")
-    last_id = 0
+    # PostgREST builders are single-use (filters mutate them), so only the bound
+    # method and the column list are hoisted, not the builder itself.
+    table = sb.table
+    last_id = saved_id = None
+
+    # Realtime only nudges the loop; rows are still read through the watermark
+    # query below, so a dropped socket or a burst of inserts can't skip or double-send.
+    wake = asyncio.Event()
+    if SIGNALS_REALTIME and await _subscribe_signal_inserts(wake):
+        print(f"[signals] realtime requested, fallback poll every "
+              f"{max(interval, SIGNALS_FALLBACK_POLL_S)}s once subscribed")
 
     while True:
         try:
-            # 1) fetch new signals since last_id
-            q = sb.table("signals").select(
-                "id, token_symbol, token_address, ds_address, fast, slow, timeframe, "
-                "signal, price, crossed_at, dedupe_key, source"
-            )
-            if last_id:
-                q = q.gt("id", last_id)
-            res = q.order("id", desc=False).limit(200).execute()
-            rows = getattr(res, "data", None) or []
-
-            for sig in rows:
-                sid = sig["id"]
-
-                core_ds   = (sig.get("ds_address") or "").strip()
-                core_tron = (sig.get("token_address") or "").strip()
-                core_sym  = (sig.get("token_symbol") or "").strip().upper()
-
-                fast = sig.get("fast")
-                slow = sig.get("slow")
-                tf   = sig.get("timeframe")
-                price = sig.get("price")
-                crossed_at = sig.get("crossed_at")
-                signal_str = sig.get("signal")
-
-                src = (sig.get("source") or "sma").lower()
-                src_label = "SMA" if src == "sma" else "RSI"
-
-                # Build/normalize dedupe key
-                sig_key = sig.get("dedupe_key")
-                if not sig_key:
-                    core = core_ds or core_tron or core_sym
-                    crossed_iso = crossed_at if isinstance(crossed_at, str) else (
-                        crossed_at.isoformat() if crossed_at else ""
-                    )
-                    sig_key = f"{core}|{tf}|{fast}|{slow}|{crossed_iso}"
-
-                # 2) find subscribers (priority: ds > tron > symbol)
-                if core_ds:
-                    subs = (sb.table("signal_subscriptions")
-                              .select("tg_chat_id")
-                              .eq("ds_address", core_ds)
-                              .eq("fast", fast).eq("slow", slow).eq("timeframe", tf)
-                              .eq("is_enabled", True)
-                              .execute())
-                elif core_tron:
-                    subs = (sb.table("signal_subscriptions")
-                              .select("tg_chat_id")
-                              .eq("token_address", core_tron)
-                              .eq("fast", fast).eq("slow", slow).eq("timeframe", tf)
-                              .eq("is_enabled", True)
-                              .execute())
-                else:
-                    subs = (sb.table("signal_subscriptions")
-                              .select("tg_chat_id")
-                              .eq("token_symbol", core_sym)
-                              .eq("fast", fast).eq("slow", slow).eq("timeframe", tf)
-                              .eq("is_enabled", True)
-                              .execute())
-                subs_rows = getattr(subs, "data", None) or []
-
-                # 3) notify subscribers
-                label = core_ds or core_tron or core_sym
-                for s in subs_rows:
-                    chat_id = str(s["tg_chat_id"])
-
-                    # 3a) record alert once per (chat_id, sig_key)
-                    alert_row = {
-                        "tg_chat_id": chat_id,
-                        "sig_key": sig_key,
-                        "ds_address": core_ds or None,
-                        "token_address": core_tron or None,
-                        "token_symbol": core_sym or None,
-                        "fast": fast, "slow": slow, "timeframe": tf,
-                        "signal": signal_str, "price": price,
-                        "crossed_at": crossed_at,
-                        "sent_at": datetime.now(timezone.utc).isoformat(),
-                        "strategy": src_label,  # store displayed strategy label
-                    }
-                    try:
-                        (sb.table("signal_alerts")
-                           .upsert(alert_row, on_conflict="tg_chat_id,sig_key")
-                           .execute())
-                    except Exception:
-                        # If 'strategy' column does not exist yet
-                        try:
-                            alert_row.pop("strategy", None)
-                            (sb.table("signal_alerts")
-                               .upsert(alert_row, on_conflict="tg_chat_id,sig_key")
-                               .execute())
-                        except Exception:
-                            pass
-
-                    # 3b) compose message + button
-                    txt = (
-                        f"📈 {signal_str} — {label}\n"
-                        f"{src_label}{fast}/{(slow if src == 'sma' else '')} {tf} @ {price}\n"
-                        f"{crossed_at}"
-                    ).replace("//", "/").replace("  ", " ")
-
-                    base_cmd = "/buy" if signal_str == "BUY" else "/sell"
-                    kb = InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(
-                            text=("Buy $100" if signal_str == "BUY" else "Sell $100"),
-                            callback_data=f"deep:{base_cmd} {label} $100"
-                        )
-                    ]])
-
-                    await bot.send_message(int(chat_id), txt, reply_markup=kb)
-
-                last_id = max(last_id, sid)
+            if last_id is None:
+                last_id = saved_id = await sb_call(_watermark_load)
+                print(f"[signals] resuming after id {last_id}")
+
+            # 1) drain new signals past the watermark, a page at a time
+            while True:
+                res = await sb_execute(
+                    table("signals").select(_SIGNALS_COLS)
+                      .gt("id", last_id)
+                      .order("id", desc=False)
+                      .limit(WATCHER_PAGE))
+                rows = getattr(res, "data", None) or []
+                if not rows:
+                    break
+                await _process_signal_page(bot, rows)
+                last_id = max(last_id, max(r["id"] for r in rows))
+                if len(rows) < WATCHER_PAGE:
+                    break
+
+            if last_id != saved_id:
+                await sb_call(_watermark_save, last_id)
+                saved_id = last_id
 
         except Exception as e:
             print("[signals] watcher error:", type(e).__name__, e)
 
-        await asyncio.sleep(interval)
+        try:
+            await asyncio.wait_for(wake.wait(), max(interval, SIGNALS_FALLBACK_POLL_S) if _RT_LIVE else interval)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
 
 
 
@@ -2375,12 +2801,52 @@ async def signals_watcher(bot: Bot, interval: int = 15):
 
 
 # ---------- main ----------
+async def run_webhook(bot: Bot):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    print(f"Bot up (webhook {WEBHOOK_URL}{WEBHOOK_PATH} -> {WEBAPP_HOST}:{WEBAPP_PORT}). Press Ctrl+C to stop.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+class KeepAliveSession(AiohttpSession):
+    """AiohttpSession whose connector keeps idle connections alive and caches DNS, so
+    sendMessage/editMessageText reuse the same TLS connection instead of handshaking per call.
+    aiogram still builds the session (SSL context, proxy, its own connector settings);
+    this only adds two options to the connector kwargs it builds from."""
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 75, ttl_dns_cache: int = 600, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self._connector_init.update(keepalive_timeout=keepalive_timeout, ttl_dns_cache=ttl_dns_cache)
+
+
 async def main():
-    bot = Bot(BOT_TOKEN)  # default session is fine & robust in 3.21
+    bot = Bot(BOT_TOKEN, session=KeepAliveSession(limit=100))
+    await warm_schema_cache()
 
     # start the watcher once
     asyncio.create_task(signals_watcher(bot))
 
+    if WEBHOOK_URL:
+        await run_webhook(bot)
+        return
+
     print("Bot up. Press Ctrl+C to stop.")
     while True:
         try:
@@ -2394,6 +2860,12 @@ async def main():
 
 
 if __name__ == "__main__":
+    # uvloop if available (not on Windows) -- faster loop for the aiohttp I/O
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
@@ -1,8 +1,9 @@
 import os, re, json, hashlib
 from decimal import Decimal, getcontext
-from subprocess import run, PIPE
+from functools import lru_cache
 from dotenv import load_dotenv
-from supabase import create_client
+from db import get_supabase_client
+from emit_events import emit_close
 
 getcontext().prec = 50
 
@@ -16,19 +17,29 @@ ADDR_HEX = os.getenv("TOKEN_ADDR_HEX", "1") != "0"
 TOKENS = json.loads(os.getenv("TOKEN_SYMBOLS_MAP", "{}"))  # symbol -> base58 addr
 DECIMALS_MAP = json.loads(os.getenv("TOKEN_DECIMALS_MAP", "{}"))  # addr -> decimals
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY")
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_{SERVICE|ANON}_KEY")
-
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = get_supabase_client()  # raises if creds are missing
 
 # ---------- Address utils (Base58 → hex 41...) ----------
 _B58_ALPH = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+# byte -> digit table (255 = not base58), instead of an O(58) .index() per char
+_B58_MAP = bytearray(b"\xff" * 256)
+for _i, _c in enumerate(_B58_ALPH):
+    _B58_MAP[ord(_c)] = _i
+_B58_CHUNK = 10                        # 58**10 < 2**64: small-int math inside a chunk
+_B58_POW = [58 ** k for k in range(_B58_CHUNK + 1)]
+
 def _b58decode_check(s: str) -> bytes:
+    raw = s.encode("ascii")            # non-ascii -> UnicodeEncodeError (a ValueError)
     num = 0
-    for ch in s:
-        num = num * 58 + _B58_ALPH.index(ch)
+    for i in range(0, len(raw), _B58_CHUNK):
+        part = raw[i:i + _B58_CHUNK]
+        acc = 0
+        for b in part:
+            v = _B58_MAP[b]
+            if v == 255:
+                raise ValueError("bad base58")
+            acc = acc * 58 + v
+        num = num * _B58_POW[len(part)] + acc
     full = num.to_bytes((num.bit_length() + 7)//8, "big")
     n_pad = len(s) - len(s.lstrip("1"))
     full = b"\x00"*n_pad + full
@@ -40,23 +51,35 @@ def _b58decode_check(s: str) -> bytes:
         raise ValueError("bad checksum")
     return payload
 
+_HEX_RE = re.compile(r"[0-9a-fA-F]+\Z")
+
+@lru_cache(maxsize=4096)  # configured tokens repeat; skip re-decoding base58 on every lookup
 def tron_to_hex(addr: str) -> str:
     a = (addr or "").strip()
     if not a:
         return a
-    if a.startswith("0x") or all(c in "0123456789abcdefABCDEF" for c in a):
+    if a.startswith("0x") or _HEX_RE.match(a):
         return a.lower().removeprefix("0x")
     return _b58decode_check(a).hex().lower()
 
+def _hex_key(addr: str) -> str:
+    try:
+        return tron_to_hex(addr)
+    except ValueError:
+        return (addr or "").strip().lower()   # not a valid address: fall back to raw key
+
+# DECIMALS_MAP may be keyed by base58 or hex; fold it to hex once so lookups are one get()
+_DECIMALS_BY_HEX = {_hex_key(k): int(v) for k, v in DECIMALS_MAP.items()}
+
 # ---------- Helpers ----------
 def decimals_for(token_addr: str) -> int:
-    # accept both base58 and hex keys in DECIMALS_MAP
-    return int(
-        DECIMALS_MAP.get(token_addr)
-        or DECIMALS_MAP.get(token_addr.lower())
-        or DECIMALS_MAP.get(tron_to_hex(token_addr))
-        or TOKEN_DECIMALS_DEFAULT
-    )
+    return _DECIMALS_BY_HEX.get(_hex_key(token_addr), TOKEN_DECIMALS_DEFAULT)
+
+def _as_decimal(v) -> Decimal:
+    """Row value -> Decimal; numeric columns come back as str/int, only floats need the str() hop."""
+    if isinstance(v, float):
+        return Decimal(str(v))
+    return v if isinstance(v, Decimal) else Decimal(v)
 
 def to_base_units(qty_h: Decimal, decimals: int) -> int:
     return int((qty_h * (Decimal(10) ** decimals)).to_integral_value())
@@ -67,23 +90,40 @@ def price_to_int(px_h: Decimal) -> int:
 def fetch_open(token_addr_b58: str):
     # query using the same form as stored in DB
     key = tron_to_hex(token_addr_b58) if ADDR_HEX else token_addr_b58
-    resp = supabase.table("open_trades").select("*").eq("token_address", key).limit(1).execute()
+    resp = (supabase.table("open_trades")
+              .select("token_address, trade_id_onchain, avg_entry_price, amount")
+              .eq("token_address", key).limit(1).execute())
     data = getattr(resp, "data", None) or (resp.get("data") if isinstance(resp, dict) else None)
     return data[0] if isinstance(data, list) and data else None
 
 # ---------- Core: /sell parser + emitter call ----------
-SELL_RE = re.compile(r"^\s*/sell\s+([A-Za-z0-9_]+)\s+([\d.]+)\s*@\s*([\d.]+)\s*$")
+# Grammar: /sell SYMBOL QTY @ PRICE (spaces around @ optional). Parsed with
+# partition/split instead of a regex; same accepted inputs as the old SELL_RE.
+_SYM_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_")
+_NUM_CHARS = frozenset("0123456789.")
+
+def parse_sell(text: str):
+    """-> (symbol, qty_str, px_str) or None."""
+    head, at, px_s = (text or "").partition("@")
+    parts = head.split()
+    px_s = px_s.strip()
+    if not at or len(parts) != 3 or parts[0] != "/sell" or not px_s:
+        return None
+    sym, qty_s = parts[1], parts[2]
+    if not (set(sym) <= _SYM_CHARS and set(qty_s) <= _NUM_CHARS and set(px_s) <= _NUM_CHARS):
+        return None
+    return sym, qty_s, px_s
 
 def handle_sell(text: str):
     """
     Accepts: '/sell TUSDT 100 @ 0.5'
     Returns: (user_message, ok_bool)
     """
-    m = SELL_RE.match(text or "")
-    if not m:
+    parsed = parse_sell(text)
+    if not parsed:
         return "❌ Format: /sell <SYMBOL> <QTY> @ <PRICE>", False
 
-    symbol, qty_s, px_s = m.groups()
+    symbol, qty_s, px_s = parsed
     symbol = symbol.upper()
     try:
         qty_h = Decimal(qty_s)
@@ -103,9 +143,12 @@ def handle_sell(text: str):
     if not open_row:
         return f"⚠️ No open position for {symbol}. Use /buy first.", False
 
-    trade_id = int(open_row["trade_id_onchain"])
-    avg_entry_h = Decimal(str(open_row["avg_entry_price"]))
-    open_amt_h = Decimal(str(open_row["amount"]))
+    try:
+        trade_id = int(open_row["trade_id_onchain"])
+        avg_entry_h = _as_decimal(open_row["avg_entry_price"])
+        open_amt_h = _as_decimal(open_row["amount"])
+    except Exception:
+        return f"❌ Open position for {symbol} has invalid numbers; check open_trades.", False
 
     # Cap sell to available position (defensive)
     if qty_h > open_amt_h:
@@ -115,20 +158,17 @@ def handle_sell(text: str):
     realized_h = (px_h - avg_entry_h) * qty_h
     pnl_int = price_to_int(realized_h)
 
-    # Call your emitter with --sell-amount (NEW!)
-    cmd = [
-        "python", "emit_events.py", "close",
-        "--trade-id", str(trade_id),
-        "--token-address", token_addr,
-        "--exit-price", str(exit_price_int),
-        "--pnl", str(pnl_int),
-        "--sell-amount", str(sell_amount_int),
-    ]
-    proc = run(cmd, stdout=PIPE, stderr=PIPE, text=True)
-
-    if proc.returncode != 0:
-        # show concise stderr to the user
-        return f"❌ {proc.stderr.strip()}", False
-
-    tx_line = proc.stdout.strip().splitlines()[-1] if proc.stdout else ""
-    return f"✅ Submitted.\n{tx_line}", True
+    # Emit in-process: tron client + signer stay warm between sells
+    try:
+        txid = emit_close(
+            trade_id=trade_id,
+            token_address=token_addr,
+            token_symbol=symbol,
+            exit_price=exit_price_int,
+            pnl=pnl_int,
+            sell_amount=sell_amount_int,
+        )
+    except Exception as e:
+        return f"❌ {type(e).__name__}: {e}", False
+
+    return f"✅ Submitted.\nTX: {txid or '(see logs)'}", True
@@ -64,46 +64,51 @@ TRC20_ABI = json.loads("""
 
 
 
-# Loading environment variables
-load_dotenv()
+def main():
+    # Loading environment variables
+    load_dotenv()
 
-PRIVATE_KEY = os.getenv("TRON_PRIVATE_KEY")
-CONTRACT_ADDRESS = os.getenv("TRON_CONTRACT_ADDRESS")
-NETWORK = os.getenv("TRON_NETWORK", "nile")  
+    PRIVATE_KEY = os.getenv("TRON_PRIVATE_KEY")
+    CONTRACT_ADDRESS = os.getenv("TRON_CONTRACT_ADDRESS")
+    NETWORK = os.getenv("TRON_NETWORK", "nile")  
 
-print("PRIVATE_KEY from .env:", PRIVATE_KEY)
-print("Length:", len(PRIVATE_KEY))
-print("Using network:", NETWORK)
-print("Contract address:", CONTRACT_ADDRESS)
+    print("PRIVATE_KEY from .env:", PRIVATE_KEY)
+    print("Length:", len(PRIVATE_KEY))
+    print("Using network:", NETWORK)
+    print("Contract address:", CONTRACT_ADDRESS)
 
 
-# Connecting to Tron
-client = Tron(network=NETWORK)
+    # Connecting to Tron
+    client = Tron(network=NETWORK)
 
-# Loading wallet
-priv_key = PrivateKey(bytes.fromhex(PRIVATE_KEY))
-wallet_address = priv_key.public_key.to_base58check_address()
-print(f"Connected Wallet: {wallet_address}")
+    # Loading wallet
+    priv_key = PrivateKey(bytes.fromhex(PRIVATE_KEY))
+    wallet_address = priv_key.public_key.to_base58check_address()
+    print(f"Connected Wallet: {wallet_address}")
 
-# Load deployed contract
-contract = client.get_contract(CONTRACT_ADDRESS)
-contract.abi = TRC20_ABI
+    # Load deployed contract
+    contract = client.get_contract(CONTRACT_ADDRESS)
+    contract.abi = TRC20_ABI
 
-# Checking balance"
-balance = contract.functions.balanceOf(wallet_address)
-print(f"Your token balance: {balance}")
+    # Checking balance"
+    balance = contract.functions.balanceOf(wallet_address)
+    print(f"Your token balance: {balance}")
 
-# Transferring tokens to receiver as a test
-recipient = "TTpp31DebKj4KR7u5SYP1qSgHkz9d9Wd2a"
-amount = 1_000_000  # 1 token because decimals = 6
+    # Transferring tokens to receiver as a test
+    recipient = "TTpp31DebKj4KR7u5SYP1qSgHkz9d9Wd2a"
+    amount = 1_000_000  # 1 token because decimals = 6
 
-txn = (
-    contract.functions.transfer(recipient, amount)
-    .with_owner(wallet_address)
-    .fee_limit(10_000_000)
-    .build()
-    .sign(priv_key)
-    .broadcast()
-)
+    txn = (
+        contract.functions.transfer(recipient, amount)
+        .with_owner(wallet_address)
+        .fee_limit(10_000_000)
+        .build()
+        .sign(priv_key)
+        .broadcast()
+    )
 
-print(f"Transaction sent: {txn['txid']}")
+    print(f"Transaction sent: {txn['txid']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import os
 import json
+import time
+import hashlib
+from functools import lru_cache
 from decimal import Decimal, getcontext
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tronpy import Tron
 from tronpy.providers import HTTPProvider
-from supabase import create_client, Client
+from db import get_supabase_client
+from listener_common import prefetch_token_info
 
 # high precision for money math
 getcontext().prec = 40
@@ -14,13 +20,16 @@ getcontext().prec = 40
 load_dotenv()
 
 # ==== ENV ====
-SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
-SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
 DEPLOYER_ADDRESS: str = os.getenv("DEPLOYER_ADDRESS", "")     # 0x... (lowercased in code)
+_DEPLOYER_LC = DEPLOYER_ADDRESS.lower()
+# If the TradeLogger always emits amounts at a fixed scale, set this and skip the
+# per-token decimals() RPC entirely. Unset -> look decimals up per token.
+_EAD = os.getenv("EVENT_AMOUNT_DECIMALS", "").strip()
+EVENT_AMOUNT_DECIMALS: int | None = int(_EAD) if _EAD else None
 
 # ==== Clients ====
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = get_supabase_client()
 
 # ==== TRON Network Setup ====
 
@@ -41,12 +50,20 @@ tron = Tron(HTTPProvider(RPC_URL, api_key=TRON_API_KEY) if TRON_API_KEY else HTT
 # Parse ABI (prefer env JSON; or load from a file path you keep in env)
 abi = json.loads(ABI_TEXT) if ABI_TEXT else None
 contract = tron.get_contract(CONTRACT_ADDRESS, abi=abi)
+# resolve the ABI event entries once, not on every poll
+_trade_open = contract.events.TradeOpen
+_trade_closed = contract.events.TradeClosed
 
 # ==== Price helpers ====
+# one pooled session: keep-alive + TLS reuse instead of a fresh handshake per lookup
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                                    max_retries=Retry(total=2, backoff_factor=0.2)))
+
 def fetch_price_from_ave(token_hex: str) -> Decimal | None:
     url = f"https://cloud.ave.ai/api/token/{token_hex}"
     try:
-        r = requests.get(url, timeout=7)
+        r = _http.get(url, timeout=7)
         r.raise_for_status()
         data = r.json()
         val = (data.get("price") or data.get("data", {}).get("price"))
@@ -56,7 +73,7 @@ def fetch_price_from_ave(token_hex: str) -> Decimal | None:
 
 def fetch_price_from_dexscreener(token_hex: str) -> Decimal | None:
     try:
-        r = requests.get(f"https://api.dexscreener.com/latest/dex/tokens/{token_hex}", timeout=7)
+        r = _http.get(f"https://api.dexscreener.com/latest/dex/tokens/{token_hex}", timeout=7)
         r.raise_for_status()
         data = r.json()
         pairs = data.get("pairs") or []
@@ -66,23 +83,60 @@ def fetch_price_from_dexscreener(token_hex: str) -> Decimal | None:
     except Exception:
         return None
 
+# bursts of events on one token share a single fetch; misses aren't cached
+PRICE_TTL_S = 30
+_price_cache: dict[str, tuple[float, Decimal]] = {}
+
 def get_token_price_usd(token_hex: str) -> Decimal | None:
-    return fetch_price_from_ave(token_hex) or fetch_price_from_dexscreener(token_hex)
+    key = token_hex.lower()
+    hit = _price_cache.get(key)
+    now = time.monotonic()
+    if hit and now - hit[0] < PRICE_TTL_S:
+        return hit[1]
+    px = fetch_price_from_ave(token_hex) or fetch_price_from_dexscreener(token_hex)
+    if px is not None:
+        _price_cache[key] = (now, px)
+    return px
 
 # ==== Token decimals ====
+# decimals never change for a token, so one get_contract + decimals() RPC per token per run
+_token_contracts: dict = {}
+
+def _token_contract(token_hex: str):
+    c = _token_contracts.get(token_hex)
+    if c is None:
+        c = _token_contracts[token_hex] = tron.get_contract(token_hex)
+    return c
+
+@lru_cache(maxsize=1024)
+def _decimals_onchain(token_key: str) -> int:
+    # raises on RPC failure, so a transient error isn't cached as the default
+    return int(_token_contract(token_key).functions.decimals())
+
 def get_token_decimals(token_hex: str) -> int:
     try:
-        t = tron.get_contract(token_hex)
-        return int(t.functions.decimals())
+        return _decimals_onchain(token_hex.lower())
     except Exception:
         return 18  # sensible default
 
 # ==== Supabase helpers ====
+# the only open_trades columns the listener reads or writes
+_OPEN_COLS = ("token_address", "avg_entry_price", "amount", "strategy", "trader", "trade_id_onchain")
+_OPEN_SELECT = ", ".join(_OPEN_COLS)
+
 def get_open_position(token_address: str):
-    res = supabase.table("open_trades").select("*").eq("token_address", token_address).limit(1).execute()
+    res = supabase.table("open_trades").select(_OPEN_SELECT).eq("token_address", token_address).limit(1).execute()
     return res.data[0] if res.data else None
 
-def upsert_open_position(token_address: str, avg_entry_price: Decimal, amount: Decimal,
+def load_open_positions(token_addresses) -> dict[str, dict]:
+    """One in_() read for every token touched in a poll cycle -> {token_address: row}."""
+    tokens = list({t for t in token_addresses if t})
+    if not tokens:
+        return {}
+    res = supabase.table("open_trades").select(_OPEN_SELECT).in_("token_address", tokens).execute()
+    return {r["token_address"]: r for r in (res.data or [])}
+
+def upsert_open_position(token_address: str, avg_entry_price: float, amount: float,
                          strategy: str | None, trader: str, trade_id_onchain: int | None):
     payload = {
         "token_address": token_address,
@@ -95,10 +149,10 @@ def upsert_open_position(token_address: str, avg_entry_price: Decimal, amount: D
     # If strategy or trade_id_onchain missing, keep existing values (handled by code before calling)
     supabase.table("open_trades").upsert(payload).execute()
 
-def update_open_amount(token_address: str, amount: Decimal):
+def update_open_amount(token_address: str, amount: float):
     supabase.table("open_trades").update({"amount": float(amount)}).eq("token_address", token_address).execute()
 
-def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_price: Decimal, amount: Decimal,
+def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_price: float, amount: float,
                                               strategy: str | None = None):
     payload = {"avg_entry_price": float(avg_entry_price), "amount": float(amount)}
     if strategy is not None:
@@ -108,11 +162,82 @@ def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_pric
 def delete_open_position(token_address: str):
     supabase.table("open_trades").delete().eq("token_address", token_address).execute()
 
-def insert_history_row(token: str, action: str, price: Decimal,
-                       avg_entry: Decimal | None, avg_exit: Decimal | None,
-                       amount: Decimal, pnl: Decimal | None, ts: datetime,
-                       trade_id_onchain: int | None, strategy: str | None):
-    supabase.table("trade_history").insert({
+# ==== Batched writes ====
+# With an open_map (poll loop), handle_buy/handle_sell queue their writes here and
+# flush_pending() sends them once per range: one upsert, one delete, one insert.
+_pending_history: list[dict] = []
+_pending_upserts: dict[str, dict] = {}
+_pending_deletes: set[str] = set()
+
+def queue_open_position(token_key: str, row: dict | None):
+    """Final open_trades state for a token this cycle; None means the position closed."""
+    if row is None:
+        _pending_upserts.pop(token_key, None)
+        _pending_deletes.add(token_key)
+    else:
+        _pending_deletes.discard(token_key)
+        _pending_upserts[token_key] = {k: row.get(k) for k in _OPEN_COLS}
+
+class PartialFlushError(Exception):
+    """History landed but an open_trades write failed: a replay would skip these events."""
+
+# Replay safety: every history row carries an event key (trade_history.event_uid, UNIQUE)
+# and goes first, as one upsert. A range whose history write fails wrote nothing and is
+# retried as-is; a retried range skips events whose key is already in trade_history.
+# The open_trades writes that follow are absolute final rows, not deltas.
+DEAD_LETTER_PATH = os.getenv(
+    "LISTENER_DEAD_LETTER_PATH", os.path.join(os.path.expanduser("~"), ".cache", "tron_bot", "dead_letter.jsonl")
+)
+
+def flush_pending():
+    if _pending_history:
+        supabase.table("trade_history").upsert(_pending_history, on_conflict="event_uid").execute()
+        _pending_history.clear()
+    try:
+        if _pending_upserts:
+            supabase.table("open_trades").upsert(list(_pending_upserts.values()),
+                                                 on_conflict="token_address").execute()
+            _pending_upserts.clear()
+        if _pending_deletes:
+            supabase.table("open_trades").delete().in_("token_address", list(_pending_deletes)).execute()
+            _pending_deletes.clear()
+    except Exception as e:
+        raise PartialFlushError(str(e)) from e
+
+def _dead_letter(start_block: int, end_block: int, err: Exception):
+    """Keep the open_trades rows a partial flush couldn't write, for a manual re-apply."""
+    rec = {"blocks": [start_block, end_block], "error": str(err),
+           "upserts": list(_pending_upserts.values()), "deletes": sorted(_pending_deletes)}
+    try:
+        os.makedirs(os.path.dirname(DEAD_LETTER_PATH) or ".", exist_ok=True)
+        with open(DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, default=str) + "\n")
+    except OSError as e:
+        print(f"⚠ Could not write dead letter ({e}): {rec}")
+
+def event_key(action: str, event_args: dict) -> str:
+    """trade_history.event_uid for a contract event. tronpy's decoded events carry no tx id,
+    so the key is the event's own fields (a partial close differs in amount/price/timestamp)."""
+    payload = {k: str(event_args.get(k)) for k in
+               ("tradeId", "trader", "tokenAddress", "amount", "price", "strategy", "timestamp")}
+    payload["action"] = action
+    return "tl1:" + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+UID_CHUNK = 50  # keys per in_() filter; keeps the GET URL well under proxy limits
+
+def applied_event_keys(keys: list[str]) -> set[str]:
+    found = set()
+    for i in range(0, len(keys), UID_CHUNK):
+        res = supabase.table("trade_history").select("event_uid").in_("event_uid", keys[i:i + UID_CHUNK]).execute()
+        found.update(r["event_uid"] for r in res.data or [])
+    return found
+
+def insert_history_row(token: str, action: str, price: float,
+                       avg_entry: float | None, avg_exit: float | None,
+                       amount: float, pnl: float | None, ts: datetime,
+                       trade_id_onchain: int | None, strategy: str | None,
+                       batch: bool = False, event_uid: str | None = None):
+    row = {
         "token_address": token,
         "action": action,
         "price": float(price),
@@ -120,87 +245,125 @@ def insert_history_row(token: str, action: str, price: Decimal,
         "avg_exit_price": float(avg_exit) if avg_exit is not None else None,
         "amount": float(amount),
         "pnl": float(pnl) if pnl is not None else None,
-        "timestamp": ts.replace(tzinfo=timezone.utc),
+        "timestamp": ts.isoformat(),
         "trade_id_onchain": trade_id_onchain,
-        "strategy": strategy
-    }).execute()
+        "strategy": strategy,
+        "event_uid": event_uid,
+    }
+    if batch:
+        _pending_history.append(row)
+    else:
+        supabase.table("trade_history").insert(row).execute()
 
 # ==== Core aggregation ====
-def handle_buy(token_hex: str, human_amount: Decimal, price_usd: Decimal,
+# Math runs on scaled ints: amounts in token base units (10**decimals), prices as
+# PX_SCALE fixed point. DB values are floats either way, so Decimal bought nothing here.
+PX_SCALE = 10 ** 18
+
+def handle_buy(token_hex: str, amount_i: int, decimals: int, price_i: int,
                strategy_in: str | None, trader_hex: str, ts_unix: int,
-               trade_id_onchain: int | None):
-    ts = datetime.utcfromtimestamp(int(ts_unix))
+               trade_id_onchain: int | None, open_map: dict | None = None,
+               event_uid: str | None = None):
+    ts = datetime.fromtimestamp(int(ts_unix), tz=timezone.utc)
     token_key = token_hex.lower()
+    unit = 10 ** decimals
+    price_f = price_i / PX_SCALE
+    amount_f = amount_i / unit
 
-    current = get_open_position(token_key)
+    current = open_map.get(token_key) if open_map is not None else get_open_position(token_key)
     if current:
-        cur_amt = Decimal(str(current["amount"]))
-        cur_avg = Decimal(str(current["avg_entry_price"]))
+        cur_amt = round(float(current["amount"]) * unit)
+        cur_avg = round(float(current["avg_entry_price"]) * PX_SCALE)
         # Prefer existing strategy if incoming is None
         strategy = strategy_in or current.get("strategy")
 
-        new_amt = cur_amt + human_amount
-        total_cost = (cur_avg * cur_amt) + (price_usd * human_amount)
-        new_avg = total_cost / new_amt if new_amt != 0 else price_usd
-
-        update_open_avg_amount_and_maybe_strategy(token_key, new_avg, new_amt, strategy=strategy)
-        insert_history_row(token_key, "BUY", price_usd, new_avg, None, human_amount, None, ts,
+        new_amt = cur_amt + amount_i
+        new_avg = (cur_avg * cur_amt + price_i * amount_i) // new_amt if new_amt else price_i
+        new_avg_f, new_amt_f = new_avg / PX_SCALE, new_amt / unit
+
+        if open_map is not None:
+            open_map[token_key] = {**current, "avg_entry_price": new_avg_f,
+                                   "amount": new_amt_f, "strategy": strategy}
+            queue_open_position(token_key, open_map[token_key])
+        else:
+            update_open_avg_amount_and_maybe_strategy(token_key, new_avg_f, new_amt_f, strategy=strategy)
+        insert_history_row(token_key, "BUY", price_f, new_avg_f, None, amount_f, None, ts,
                            trade_id_onchain=current.get("trade_id_onchain") or trade_id_onchain,
-                           strategy=strategy)
+                           strategy=strategy, batch=open_map is not None, event_uid=event_uid)
     else:
         # New position: set strategy and onchain trade id if provided
-        upsert_open_position(token_key, price_usd, human_amount,
-                             strategy=strategy_in, trader=trader_hex.lower(),
-                             trade_id_onchain=trade_id_onchain)
-        insert_history_row(token_key, "BUY", price_usd, price_usd, None, human_amount, None, ts,
-                           trade_id_onchain=trade_id_onchain, strategy=strategy_in)
-
-def handle_sell(token_hex: str, human_amount: Decimal, price_usd: Decimal,
-                trader_hex: str, ts_unix: int, trade_id_onchain: int | None):
-    ts = datetime.utcfromtimestamp(int(ts_unix))
+        if open_map is not None:
+            open_map[token_key] = {"token_address": token_key, "avg_entry_price": price_f,
+                                   "amount": amount_f, "strategy": strategy_in,
+                                   "trader": trader_hex.lower(), "trade_id_onchain": trade_id_onchain}
+            queue_open_position(token_key, open_map[token_key])
+        else:
+            upsert_open_position(token_key, price_f, amount_f,
+                                 strategy=strategy_in, trader=trader_hex.lower(),
+                                 trade_id_onchain=trade_id_onchain)
+        insert_history_row(token_key, "BUY", price_f, price_f, None, amount_f, None, ts,
+                           trade_id_onchain=trade_id_onchain, strategy=strategy_in,
+                           batch=open_map is not None, event_uid=event_uid)
+
+def handle_sell(token_hex: str, amount_i: int, decimals: int, price_i: int,
+                trader_hex: str, ts_unix: int, trade_id_onchain: int | None,
+                open_map: dict | None = None, event_uid: str | None = None):
+    ts = datetime.fromtimestamp(int(ts_unix), tz=timezone.utc)
     token_key = token_hex.lower()
+    unit = 10 ** decimals
 
-    current = get_open_position(token_key)
+    current = open_map.get(token_key) if open_map is not None else get_open_position(token_key)
     if not current:
         print(f"⚠ SELL ignored: no open position for {token_key}")
         return
 
-    cur_amt = Decimal(str(current["amount"]))
-    cur_avg = Decimal(str(current["avg_entry_price"]))
+    cur_amt = round(float(current["amount"]) * unit)
+    cur_avg = round(float(current["avg_entry_price"]) * PX_SCALE)
     strategy = current.get("strategy")
     trade_id_keep = current.get("trade_id_onchain") or trade_id_onchain
 
-    sell_amt = min(human_amount, cur_amt)
+    sell_amt = min(amount_i, cur_amt)
     if sell_amt <= 0:
         print(f"⚠ SELL ignored: zero sell amount for {token_key}")
         return
 
-    pnl_per_unit = price_usd - cur_avg
-    pnl = pnl_per_unit * sell_amt
+    pnl = (price_i - cur_avg) * sell_amt / (PX_SCALE * unit)
     remaining = cur_amt - sell_amt
-
-    if remaining > 0:
-        update_open_amount(token_key, remaining)
+    price_f = price_i / PX_SCALE
+
+    if open_map is not None:
+        if remaining > 0:
+            open_map[token_key] = {**current, "amount": remaining / unit}
+            queue_open_position(token_key, open_map[token_key])
+        else:
+            open_map.pop(token_key, None)
+            queue_open_position(token_key, None)
+    elif remaining > 0:
+        update_open_amount(token_key, remaining / unit)
     else:
         delete_open_position(token_key)
 
-    insert_history_row(token_key, "SELL", price_usd, cur_avg, price_usd, sell_amt, pnl, ts,
-                       trade_id_onchain=trade_id_keep, strategy=strategy)
+    insert_history_row(token_key, "SELL", price_f, cur_avg / PX_SCALE, price_f, sell_amt / unit, pnl, ts,
+                       trade_id_onchain=trade_id_keep, strategy=strategy,
+                       batch=open_map is not None, event_uid=event_uid)
 
 # ==== Event processing ====
-def process_trade_event(event_args: dict, action: str):
+def process_trade_event(event_args: dict, action: str, open_map: dict | None = None):
     """
     event_args needs:
       trader, tokenAddress, amount, timestamp
       optional: price, strategy, tradeId (or trade_id)
+    open_map: prefetched open_trades rows by token (see load_open_positions);
+      kept in sync as events are applied, writes queued for flush_pending().
+      None -> read and write per event.
     """
     trader = str(event_args["trader"]).lower()
-    if DEPLOYER_ADDRESS and trader != DEPLOYER_ADDRESS.lower():
-        print(f"⚠ Ignored: trader {trader} != deployer {DEPLOYER_ADDRESS.lower()}")
+    if _DEPLOYER_LC and trader != _DEPLOYER_LC:
+        print(f"⚠ Ignored: trader {trader} != deployer {_DEPLOYER_LC}")
         return
 
     token_hex = str(event_args["tokenAddress"]).lower()
-    raw_amount = Decimal(str(event_args["amount"]))
+    raw_amount = int(event_args["amount"])
     ts_unix = int(event_args["timestamp"])
 
     # Trade ID (support a couple of key names)
@@ -210,7 +373,11 @@ def process_trade_event(event_args: dict, action: str):
 
     # Price: take from event if present; else fetch via API
     raw_price = event_args.get("price") or event_args.get("entryPrice") or event_args.get("exitPrice")
-    price_usd = Decimal(str(raw_price)) if raw_price is not None else Decimal(0)
+    # event prices are uint256 ints: Decimal(int) is exact, no str() round-trip needed
+    if raw_price is None:
+        price_usd = Decimal(0)
+    else:
+        price_usd = Decimal(str(raw_price)) if isinstance(raw_price, float) else Decimal(raw_price)
     if price_usd == 0:
         price_api = get_token_price_usd(token_hex)
         if price_api is None:
@@ -218,55 +385,116 @@ def process_trade_event(event_args: dict, action: str):
             return
         price_usd = price_api
 
-    # Amount to human units
-    decimals = get_token_decimals(token_hex)
-    human_amount = raw_amount / (Decimal(10) ** Decimal(decimals))
+    # Amount stays in base units; price -> PX_SCALE fixed point (the one Decimal op per event)
+    decimals = EVENT_AMOUNT_DECIMALS if EVENT_AMOUNT_DECIMALS is not None else get_token_decimals(token_hex)
+    price_i = int(price_usd * PX_SCALE)
 
     # Strategy: prefer event’s; if absent on BUY, we’ll set/keep it in open_trades
     strategy = event_args.get("strategy")
 
     if action == "BUY":
-        handle_buy(token_hex, human_amount, price_usd, strategy, trader, ts_unix, trade_id_onchain)
+        handle_buy(token_hex, raw_amount, decimals, price_i, strategy, trader, ts_unix, trade_id_onchain, open_map,
+                   event_uid=event_key(action, event_args))
     elif action == "SELL":
-        handle_sell(token_hex, human_amount, price_usd, trader, ts_unix, trade_id_onchain)
+        handle_sell(token_hex, raw_amount, decimals, price_i, trader, ts_unix, trade_id_onchain, open_map,
+                    event_uid=event_key(action, event_args))
+
+def _drop_pending():
+    _pending_history.clear()
+    _pending_upserts.clear()
+    _pending_deletes.clear()
 
 # ==== Poller ====
+BLOCK_TIME_S = 3.0        # TRON produces a block every ~3s; polling faster just burns RPC quota
+MAX_BACKOFF_S = 60.0
+
 def listen_for_events(poll_backfill: int = 3):
     print("🔊 Listening for TRON TradeLogger events...")
     latest = tron.get_latest_block_number()
     start_block = max(0, latest - poll_backfill)
+    backoff = BLOCK_TIME_S
 
     while True:
-        current = tron.get_latest_block_number()
-        if current > start_block:
-            # TradeOpen (BUY)
-            for ev in contract.events.TradeOpen(from_block=start_block + 1, to_block=current):
-                args = ev["args"]
-                event_args = {
-                    "tradeId":     args.get("tradeId") or args.get("trade_id"),
-                    "trader":      args.get("trader"),
-                    "tokenAddress":args.get("tokenAddress"),
-                    "amount":      args.get("amount"),
-                    "price":       args.get("entryPrice") or args.get("price"),
-                    "strategy":    args.get("strategy"),
-                    "timestamp":   args.get("timestamp"),
-                }
-                process_trade_event(event_args, "BUY")
-
-            # TradeClosed (SELL)
-            for ev in contract.events.TradeClosed(from_block=start_block + 1, to_block=current):
-                args = ev["args"]
-                event_args = {
-                    "tradeId":     args.get("tradeId") or args.get("trade_id"),
-                    "trader":      args.get("trader"),
-                    "tokenAddress":args.get("tokenAddress"),
-                    "amount":      args.get("amount") or args.get("sellAmount") or args.get("amountSold") or 0,
-                    "price":       args.get("exitPrice") or args.get("price"),
-                    "timestamp":   args.get("timestamp"),
-                }
-                process_trade_event(event_args, "SELL")
-
-            start_block = current
+        try:
+            start_block = _poll_range(start_block)
+            backoff = BLOCK_TIME_S
+        except Exception as e:
+            # nothing was written, or the replay skips what was (see flush_pending)
+            _drop_pending()
+            print(f"⚠ poll failed ({type(e).__name__}: {e}); retrying in {backoff:.0f}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+            continue
+        time.sleep(BLOCK_TIME_S)
+
+def _foreign(args) -> bool:
+    """Event from someone other than the deployer: dropped before any lookups/prefetch."""
+    return bool(_DEPLOYER_LC) and str(args.get("trader")).lower() != _DEPLOYER_LC
+
+def _poll_range(start_block: int) -> int:
+    """Process blocks (start_block, latest]; returns the new start_block."""
+    current = tron.get_latest_block_number()
+    if current <= start_block:
+        return start_block
+
+    # TradeOpen (BUY)
+    opens = []
+    for ev in _trade_open(from_block=start_block + 1, to_block=current):
+        args = ev["args"]
+        if _foreign(args):
+            continue
+        opens.append({
+            "tradeId":     args.get("tradeId") or args.get("trade_id"),
+            "trader":      args.get("trader"),
+            "tokenAddress":args.get("tokenAddress"),
+            "amount":      args.get("amount"),
+            "price":       args.get("entryPrice") or args.get("price"),
+            "strategy":    args.get("strategy"),
+            "timestamp":   args.get("timestamp"),
+        })
+
+    # TradeClosed (SELL)
+    closes = []
+    for ev in _trade_closed(from_block=start_block + 1, to_block=current):
+        args = ev["args"]
+        if _foreign(args):
+            continue
+        closes.append({
+            "tradeId":     args.get("tradeId") or args.get("trade_id"),
+            "trader":      args.get("trader"),
+            "tokenAddress":args.get("tokenAddress"),
+            "amount":      args.get("amount") or args.get("sellAmount") or args.get("amountSold") or 0,
+            "price":       args.get("exitPrice") or args.get("price"),
+            "timestamp":   args.get("timestamp"),
+        })
+
+    if not (opens or closes):
+        return current
+
+    # a retried range: drop events whose history row already landed
+    done = applied_event_keys([event_key("BUY", e) for e in opens] + [event_key("SELL", e) for e in closes])
+    if done:
+        opens = [e for e in opens if event_key("BUY", e) not in done]
+        closes = [e for e in closes if event_key("SELL", e) not in done]
+        print(f"↩ Skipping {len(done)} already-applied event(s)")
+
+    # lookups for all tokens in parallel, then one open_trades read for the whole range
+    prefetch_token_info(opens + closes, get_token_price_usd,
+                        None if EVENT_AMOUNT_DECIMALS is not None else get_token_decimals, _DEPLOYER_LC)
+    open_map = load_open_positions(str(e["tokenAddress"]).lower() for e in opens + closes)
+    for event_args in opens:
+        process_trade_event(event_args, "BUY", open_map)
+    for event_args in closes:
+        process_trade_event(event_args, "SELL", open_map)
+    try:
+        flush_pending()
+    except PartialFlushError as e:
+        # history is in, so a replay would skip these events: park the open_trades rows instead
+        _dead_letter(start_block + 1, current, e)
+        print(f"❌ open_trades write failed for blocks {start_block + 1}-{current} ({e}); "
+              f"rows saved to {DEAD_LETTER_PATH}")
+        _drop_pending()
+    return current
 
 if __name__ == "__main__":
     listen_for_events(poll_backfill=3)
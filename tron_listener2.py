@@ -1,19 +1,32 @@
 import os
 import json
-from decimal import Decimal, getcontext
+import logging
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tronpy import Tron
 from tronpy.providers import HTTPProvider
+from tronpy.keys import to_hex_address
 from supabase import create_client, Client
-
-# High precision for money math
-getcontext().prec = 40
+from listener_common import prefetch_token_info
 
 print("🔄 Loading environment variables...")
 load_dotenv()
 
+# per-event chatter goes through logging at DEBUG; %-args are only formatted if the level is on
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(levelname)s:%(name)s:%(message)s",
+)
+log = logging.getLogger("tron_listener")
+
 # ==== ENV ====
 SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
@@ -22,6 +35,7 @@ TRON_NETWORK = os.getenv("TRON_NETWORK", "nile").lower()
 CONTRACT_ADDRESS: str = os.getenv("NILE_CONTRACT_ADDRESS" if TRON_NETWORK == "nile" else "MAINNET_CONTRACT_ADDRESS", "")
 CONTRACT_ABI_JSON: str = os.getenv("NILE_CONTRACT_ABI" if TRON_NETWORK == "nile" else "MAINNET_CONTRACT_ABI", "")
 DEPLOYER_ADDRESS: str = os.getenv("DEPLOYER_ADDRESS", "")
+_DEPLOYER_LC = DEPLOYER_ADDRESS.lower()  # compared against every event's trader
 
 print(f"📜 Loaded ENV: TRON_NETWORK={TRON_NETWORK}, CONTRACT_ADDRESS={CONTRACT_ADDRESS}, "
       f"SUPABASE_URL={'set' if SUPABASE_URL else 'MISSING'}, TRON_API_KEY={'set' if TRON_API_KEY else 'not set'}")
@@ -54,79 +68,223 @@ except Exception as e:
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 print("✅ Supabase client initialized")
 
+# per-block event queries run concurrently; kept small to respect the TronGrid key quota
+FETCH_WORKERS = 8
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="events")
+
+def _fetch_block_events(event_name: str, b: int) -> list:
+    try:
+        res = tron.get_event_result(
+            contract_address=CONTRACT_ADDRESS,
+            event_name=event_name,
+            block_number=b,
+            # only_confirmed=True  # uncomment if you only want confirmed
+        )
+        if res:
+            log.debug("✅ %s @ block %d: %d", event_name, b, len(res))
+        return res or []
+    except Exception as e:
+        log.warning("⚠ fetch %s @ block %d failed: %s", event_name, b, e)
+        return []
+
+def _block_ts(n: int) -> int:
+    return int(tron.get_block(n)["block_header"]["raw_data"]["timestamp"])
+
+def _fetch_events_range(event_name: str, from_block: int, to_block: int) -> list:
+    """One paged /v1 events query over the blocks' timestamp window instead of a call per block."""
+    url = f"{RPC_URL}/v1/contracts/{CONTRACT_ADDRESS}/events"
+    params = {
+        "event_name": event_name,
+        "min_block_timestamp": _block_ts(from_block),
+        "max_block_timestamp": _block_ts(to_block),
+        "order_by": "block_timestamp,asc",
+        "limit": 200,
+    }
+    headers = {"TRON-PRO-API-KEY": TRON_API_KEY} if TRON_API_KEY else None
+    out = []
+    while True:
+        r = _http.get(url, params=params, headers=headers, timeout=10)
+        r.raise_for_status()
+        body = r.json()
+        out.extend(ev for ev in body.get("data") or []
+                   if from_block <= int(ev.get("block_number", -1)) <= to_block)
+        fp = (body.get("meta") or {}).get("fingerprint")
+        if not fp:
+            break
+        params["fingerprint"] = fp
+    if out:
+        log.debug("✅ %s @ blocks %d-%d: %d", event_name, from_block, to_block, len(out))
+    return out
+
 def fetch_events(event_name: str, from_block: int, to_block: int):
+    try:
+        return _fetch_events_range(event_name, from_block, to_block)
+    except Exception as e:
+        log.warning("⚠ range fetch %s %d-%d failed (%s); falling back to per-block",
+                    event_name, from_block, to_block, e)
+
     all_events = []
-    for b in range(from_block, to_block + 1):
-        try:
-            res = tron.get_event_result(
-                contract_address=CONTRACT_ADDRESS,
-                event_name=event_name,
-                block_number=b,
-                # only_confirmed=True  # uncomment if you only want confirmed
-            )
-            if res:
-                print(f"✅ {event_name} @ block {b}: {len(res)}")
-                all_events.extend(res)
-        except Exception as e:
-            print(f"⚠ fetch {event_name} @ block {b} failed: {e}")
+    # map() keeps block order, so BUY/SELL sequencing is the same as the serial loop
+    for res in _fetch_pool.map(lambda b: _fetch_block_events(event_name, b),
+                               range(from_block, to_block + 1)):
+        all_events.extend(res)
     return all_events
 
 
 # ==== Price helpers ====
-def fetch_price_from_ave(token_hex: str) -> Decimal | None:
-    print(f"🌍 Fetching price from Ave for {token_hex}...")
+# shared keep-alive client: Ave/DexScreener/TronGrid calls reuse the TCP+TLS connection.
+# With httpx[http2] installed, concurrent lookups to one host multiplex over a single
+# HTTP/2 connection; otherwise fall back to a pooled requests.Session.
+_UA = {"User-Agent": "tron-ai-trading-bot/listener"}
+try:
+    import httpx
+    _http = httpx.Client(headers=_UA, transport=httpx.HTTPTransport(
+        http2=True, retries=2,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+    ))
+except ImportError:  # httpx missing, or installed without the h2 extra
+    _http = requests.Session()
+    _http.headers.update(_UA)
+    _http.mount("https://", HTTPAdapter(
+        pool_connections=4, pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504]),
+    ))
+
+def fetch_price_from_ave(token_hex: str) -> float | None:
+    log.debug("🌍 Fetching price from Ave for %s...", token_hex)
     url = f"https://cloud.ave.ai/api/token/{token_hex}"
     try:
-        r = requests.get(url, timeout=7)
+        r = _http.get(url, timeout=7)
         r.raise_for_status()
         data = r.json()
         val = (data.get("price") or data.get("data", {}).get("price"))
-        print(f"💲 Ave returned price: {val}")
-        return Decimal(str(val)) if val is not None else None
+        log.debug("💲 Ave returned price: %s", val)
+        return float(val) if val is not None else None
     except Exception as e:
-        print(f"⚠ Ave fetch failed: {e}")
+        log.warning("⚠ Ave fetch failed: %s", e)
         return None
 
-def fetch_price_from_dexscreener(token_hex: str) -> Decimal | None:
-    print(f"🌍 Fetching price from DexScreener for {token_hex}...")
+def fetch_price_from_dexscreener(token_hex: str) -> float | None:
+    log.debug("🌍 Fetching price from DexScreener for %s...", token_hex)
     try:
-        r = requests.get(f"https://api.dexscreener.com/latest/dex/tokens/{token_hex}", timeout=7)
+        r = _http.get(f"https://api.dexscreener.com/latest/dex/tokens/{token_hex}", timeout=7)
         r.raise_for_status()
         data = r.json()
         pairs = data.get("pairs") or []
         if pairs:
             price = pairs[0].get("priceUsd", "0")
-            print(f"💲 DexScreener returned price: {price}")
-            return Decimal(str(price))
-        print("⚠ DexScreener returned no pairs")
+            log.debug("💲 DexScreener returned price: %s", price)
+            return float(price)
+        log.debug("⚠ DexScreener returned no pairs")
         return None
     except Exception as e:
-        print(f"⚠ DexScreener fetch failed: {e}")
+        log.warning("⚠ DexScreener fetch failed: %s", e)
         return None
 
-def get_token_price_usd(token_hex: str) -> Decimal | None:
-    return fetch_price_from_ave(token_hex) or fetch_price_from_dexscreener(token_hex)
+# short TTL so a burst of events on one token costs one Ave/DexScreener lookup
+_PRICE_TTL = 30.0
+_price_cache: dict[str, tuple[float, float]] = {}
+_price_lock = threading.Lock()
+
+# $1 by definition: skip the Ave/DexScreener round trip. Keyed by the 20-byte hex body so
+# "41…", "0x…" and bare hex forms all match. STABLECOIN_ADDRESSES adds more (base58 or hex, comma-separated).
+_DEFAULT_STABLES = {
+    "mainnet": ["TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"],  # USDT
+}
+
+def _addr_body(addr: str) -> str:
+    return addr.strip().lower()[-40:]
+
+def _load_stables() -> set[str]:
+    out = set()
+    for a in _DEFAULT_STABLES.get(TRON_NETWORK, []) + os.getenv("STABLECOIN_ADDRESSES", "").split(","):
+        if not a.strip():
+            continue
+        try:
+            out.add(_addr_body(to_hex_address(a.strip())))
+        except Exception:
+            log.warning("⚠ Ignoring bad STABLECOIN_ADDRESSES entry: %s", a)
+    return out
+
+_STABLES = _load_stables()
+
+def get_token_price_usd(token_hex: str) -> float | None:
+    if _addr_body(token_hex) in _STABLES:
+        return 1.0
+    key = token_hex.lower()
+    with _price_lock:
+        hit = _price_cache.get(key)
+    if hit and time.monotonic() - hit[0] < _PRICE_TTL:
+        log.debug("💾 Cached price for %s: %s", key, hit[1])
+        return hit[1]
+    px = fetch_price_from_ave(token_hex) or fetch_price_from_dexscreener(token_hex)
+    if px is not None:
+        with _price_lock:
+            _price_cache[key] = (time.monotonic(), px)
+    return px
 
 # ==== Token decimals ====
+# decimals() never changes for a token: keep answers in memory and on disk so
+# restarts don't re-query. New tokens are rare, so the file is rewritten per new entry.
+DECIMALS_CACHE_PATH = os.getenv(
+    "DECIMALS_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "tron_bot", "decimals.json")
+)
+
+def _load_decimals_cache() -> dict[str, int]:
+    try:
+        with open(DECIMALS_CACHE_PATH, "r", encoding="utf-8") as f:
+            return {k.lower(): int(v) for k, v in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+_decimals_lock = threading.Lock()  # lookups can run on several threads; one writer at a time
+
+def _save_decimals_cache():
+    try:
+        os.makedirs(os.path.dirname(DECIMALS_CACHE_PATH), exist_ok=True)
+        tmp = DECIMALS_CACHE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_decimals_cache, f)
+        os.replace(tmp, DECIMALS_CACHE_PATH)
+    except OSError as e:
+        log.warning("⚠ Could not write decimals cache: %s", e)
+
+_decimals_cache: dict[str, int] = _load_decimals_cache()
+
+# tronpy Contract objects by address: get_contract() fetches + parses the ABI every call
+_contract_cache: dict[str, object] = {}
+
+def _get_contract(addr: str):
+    c = _contract_cache.get(addr)
+    if c is None:
+        c = _contract_cache[addr] = tron.get_contract(addr)
+    return c
+
 def get_token_decimals(token_hex: str) -> int:
+    key = token_hex.lower()
+    if key in _decimals_cache:
+        return _decimals_cache[key]
     try:
-        t = tron.get_contract(token_hex)
-        return int(t.functions.decimals())
+        dec = int(_get_contract(key).functions.decimals())
     except Exception:
-        return 18  # sensible default
+        return 18  # sensible default (not cached, so we retry next time)
+    with _decimals_lock:
+        _decimals_cache[key] = dec
+        _save_decimals_cache()
+    return dec
 
 # ==== Supabase helpers ====
 def get_open_position(token_address: str):
-    print(f"🔍 Checking open position for {token_address}")
+    log.debug("🔍 Checking open position for %s", token_address)
     res = supabase.table("open_trades").select("*").eq("token_address", token_address).limit(1).execute()
     return res.data[0] if res.data else None
 
-def upsert_open_position(token_address: str, avg_entry_price: Decimal, amount: Decimal,
+def upsert_open_position(token_address: str, avg_entry_price: float, amount: float,
                          strategy: str | None, trader: str, trade_id_onchain: int | None):
     payload = {
         "token_address": token_address,
-        "avg_entry_price": float(avg_entry_price),
-        "amount": float(amount),
+        "avg_entry_price": avg_entry_price,
+        "amount": amount,
         "strategy": strategy,
         "trader": trader,
         "trade_id_onchain": trade_id_onchain
@@ -134,12 +292,12 @@ def upsert_open_position(token_address: str, avg_entry_price: Decimal, amount: D
     # If strategy or trade_id_onchain missing, keep existing values (handled by code before calling)
     supabase.table("open_trades").upsert(payload).execute()
 
-def update_open_amount(token_address: str, amount: Decimal):
-    supabase.table("open_trades").update({"amount": float(amount)}).eq("token_address", token_address).execute()
+def update_open_amount(token_address: str, amount: float):
+    supabase.table("open_trades").update({"amount": amount}).eq("token_address", token_address).execute()
 
-def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_price: Decimal, amount: Decimal,
+def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_price: float, amount: float,
                                               strategy: str | None = None):
-    payload = {"avg_entry_price": float(avg_entry_price), "amount": float(amount)}
+    payload = {"avg_entry_price": avg_entry_price, "amount": amount}
     if strategy is not None:
         payload["strategy"] = strategy
     supabase.table("open_trades").update(payload).eq("token_address", token_address).execute()
@@ -147,34 +305,107 @@ def update_open_avg_amount_and_maybe_strategy(token_address: str, avg_entry_pric
 def delete_open_position(token_address: str):
     supabase.table("open_trades").delete().eq("token_address", token_address).execute()
 
-def insert_history_row(token: str, action: str, price: Decimal,
-                       avg_entry: Decimal | None, avg_exit: Decimal | None,
-                       amount: Decimal, pnl: Decimal | None, ts: datetime,
-                       trade_id_onchain: int | None, strategy: str | None):
+# written right after the event's open_trades change (not buffered to the end of the
+# range), so a failure mid-range can't leave open_trades updated with its history missing
+def insert_history_row(token: str, action: str, price: float,
+                       avg_entry: float | None, avg_exit: float | None,
+                       amount: float, pnl: float | None, ts: datetime,
+                       trade_id_onchain: int | None, strategy: str | None,
+                       event_uid: str | None = None):
     supabase.table("trade_history").insert({
         "token_address": token,
         "action": action,
-        "price": float(price),
-        "avg_entry_price": float(avg_entry) if avg_entry is not None else None,
-        "avg_exit_price": float(avg_exit) if avg_exit is not None else None,
-        "amount": float(amount),
-        "pnl": float(pnl) if pnl is not None else None,
-        "timestamp": ts.replace(tzinfo=timezone.utc),
+        "price": price,
+        "avg_entry_price": avg_entry,
+        "avg_exit_price": avg_exit,
+        "amount": amount,
+        "pnl": pnl,
+        "timestamp": ts.isoformat(),
         "trade_id_onchain": trade_id_onchain,
-        "strategy": strategy
+        "strategy": strategy,
+        "event_uid": event_uid,
+    }).execute()
+
+# ==== Optional: one RPC per event ====
+# With APPLY_TRADE_RPC=1, handle_buy/handle_sell make a single call to this function
+# instead of SELECT + UPDATE/DELETE + history INSERT. The row lock also closes the
+# read/modify/write race between concurrent listeners. Create it once:
+#
+#   create or replace function apply_trade(
+#     p_token text, p_action text, p_price numeric, p_amount numeric,
+#     p_ts timestamptz, p_trade_id bigint, p_strategy text, p_trader text,
+#     p_event_uid text default null
+#   ) returns void language plpgsql as $$
+#   declare cur open_trades%rowtype; v_avg numeric; v_sell numeric;
+#   begin
+#     select * into cur from open_trades where token_address = p_token for update;
+#     if p_action = 'BUY' then
+#       if found then
+#         v_avg := case when cur.amount + p_amount <> 0
+#                       then (cur.avg_entry_price * cur.amount + p_price * p_amount) / (cur.amount + p_amount)
+#                       else p_price end;
+#         update open_trades set avg_entry_price = v_avg, amount = cur.amount + p_amount,
+#                strategy = coalesce(p_strategy, cur.strategy)
+#          where token_address = p_token;
+#         insert into trade_history (token_address, action, price, avg_entry_price, amount,
+#                                    "timestamp", trade_id_onchain, strategy, event_uid)
+#         values (p_token, 'BUY', p_price, v_avg, p_amount, p_ts,
+#                 coalesce(cur.trade_id_onchain, p_trade_id), coalesce(p_strategy, cur.strategy), p_event_uid);
+#       else
+#         insert into open_trades (token_address, avg_entry_price, amount, strategy, trader, trade_id_onchain)
+#         values (p_token, p_price, p_amount, p_strategy, p_trader, p_trade_id);
+#         insert into trade_history (token_address, action, price, avg_entry_price, amount,
+#                                    "timestamp", trade_id_onchain, strategy, event_uid)
+#         values (p_token, 'BUY', p_price, p_price, p_amount, p_ts, p_trade_id, p_strategy, p_event_uid);
+#       end if;
+#     elsif p_action = 'SELL' and found then
+#       v_sell := least(p_amount, cur.amount);
+#       if v_sell <= 0 then return; end if;
+#       if cur.amount - v_sell > 0 then
+#         update open_trades set amount = cur.amount - v_sell where token_address = p_token;
+#       else
+#         delete from open_trades where token_address = p_token;
+#       end if;
+#       insert into trade_history (token_address, action, price, avg_entry_price, avg_exit_price,
+#                                  amount, pnl, "timestamp", trade_id_onchain, strategy, event_uid)
+#       values (p_token, 'SELL', p_price, cur.avg_entry_price, p_price, v_sell,
+#               (p_price - cur.avg_entry_price) * v_sell, p_ts,
+#               coalesce(cur.trade_id_onchain, p_trade_id), cur.strategy, p_event_uid);
+#     end if;
+#   end $$;
+USE_APPLY_TRADE_RPC = os.getenv("APPLY_TRADE_RPC", "0") == "1"
+
+def apply_trade_rpc(token_key: str, action: str, price: float, amount: float, ts: datetime,
+                    trade_id_onchain: int | None, strategy: str | None, trader: str | None,
+                    event_uid: str | None = None):
+    supabase.rpc("apply_trade", {
+        "p_token": token_key,
+        "p_action": action,
+        "p_price": price,
+        "p_amount": amount,
+        "p_ts": ts.isoformat(),
+        "p_trade_id": int(trade_id_onchain) if trade_id_onchain is not None else None,
+        "p_strategy": strategy,
+        "p_trader": trader,
+        "p_event_uid": event_uid,
     }).execute()
 
 # ==== Core aggregation ====
-def handle_buy(token_hex: str, human_amount: Decimal, price_usd: Decimal,
+def handle_buy(token_hex: str, human_amount: float, price_usd: float,
                strategy_in: str | None, trader_hex: str, ts_unix: int,
-               trade_id_onchain: int | None):
-    ts = datetime.utcfromtimestamp(int(ts_unix))
+               trade_id_onchain: int | None, event_uid: str | None = None):
+    ts = datetime.fromtimestamp(int(ts_unix), tz=timezone.utc)
     token_key = token_hex.lower()
 
+    if USE_APPLY_TRADE_RPC:
+        apply_trade_rpc(token_key, "BUY", price_usd, human_amount, ts,
+                        trade_id_onchain, strategy_in, trader_hex.lower(), event_uid)
+        return
+
     current = get_open_position(token_key)
     if current:
-        cur_amt = Decimal(str(current["amount"]))
-        cur_avg = Decimal(str(current["avg_entry_price"]))
+        cur_amt = float(current["amount"])
+        cur_avg = float(current["avg_entry_price"])
         # Prefer existing strategy if incoming is None
         strategy = strategy_in or current.get("strategy")
 
@@ -185,33 +416,39 @@ def handle_buy(token_hex: str, human_amount: Decimal, price_usd: Decimal,
         update_open_avg_amount_and_maybe_strategy(token_key, new_avg, new_amt, strategy=strategy)
         insert_history_row(token_key, "BUY", price_usd, new_avg, None, human_amount, None, ts,
                            trade_id_onchain=current.get("trade_id_onchain") or trade_id_onchain,
-                           strategy=strategy)
+                           strategy=strategy, event_uid=event_uid)
     else:
         # New position: set strategy and onchain trade id if provided
         upsert_open_position(token_key, price_usd, human_amount,
                              strategy=strategy_in, trader=trader_hex.lower(),
                              trade_id_onchain=trade_id_onchain)
         insert_history_row(token_key, "BUY", price_usd, price_usd, None, human_amount, None, ts,
-                           trade_id_onchain=trade_id_onchain, strategy=strategy_in)
+                           trade_id_onchain=trade_id_onchain, strategy=strategy_in, event_uid=event_uid)
 
-def handle_sell(token_hex: str, human_amount: Decimal, price_usd: Decimal,
-                trader_hex: str, ts_unix: int, trade_id_onchain: int | None):
-    ts = datetime.utcfromtimestamp(int(ts_unix))
+def handle_sell(token_hex: str, human_amount: float, price_usd: float,
+                trader_hex: str, ts_unix: int, trade_id_onchain: int | None,
+                event_uid: str | None = None):
+    ts = datetime.fromtimestamp(int(ts_unix), tz=timezone.utc)
     token_key = token_hex.lower()
 
+    if USE_APPLY_TRADE_RPC:
+        apply_trade_rpc(token_key, "SELL", price_usd, human_amount, ts,
+                        trade_id_onchain, None, trader_hex.lower(), event_uid)
+        return
+
     current = get_open_position(token_key)
     if not current:
-        print(f"⚠ SELL ignored: no open position for {token_key}")
+        log.warning("⚠ SELL ignored: no open position for %s", token_key)
         return
 
-    cur_amt = Decimal(str(current["amount"]))
-    cur_avg = Decimal(str(current["avg_entry_price"]))
+    cur_amt = float(current["amount"])
+    cur_avg = float(current["avg_entry_price"])
     strategy = current.get("strategy")
     trade_id_keep = current.get("trade_id_onchain") or trade_id_onchain
 
     sell_amt = min(human_amount, cur_amt)
     if sell_amt <= 0:
-        print(f"⚠ SELL ignored: zero sell amount for {token_key}")
+        log.warning("⚠ SELL ignored: zero sell amount for %s", token_key)
         return
 
     pnl_per_unit = price_usd - cur_avg
@@ -224,102 +461,229 @@ def handle_sell(token_hex: str, human_amount: Decimal, price_usd: Decimal,
         delete_open_position(token_key)
 
     insert_history_row(token_key, "SELL", price_usd, cur_avg, price_usd, sell_amt, pnl, ts,
-                       trade_id_onchain=trade_id_keep, strategy=strategy)
+                       trade_id_onchain=trade_id_keep, strategy=strategy, event_uid=event_uid)
 
 # ==== Event processing ====
+_POW10_F = [10.0 ** i for i in range(31)]  # base-unit divisors; decimals is almost always 6 or 18
+
+# events already applied, keyed by on-chain identity (tx id, event index); overlapping
+# ranges / re-polls would double-count them. Not tradeId: partial closes reuse it.
+SEEN_TRADES_MAX = 10_000
+_seen_trades: OrderedDict[tuple, None] = OrderedDict()
+
+def _seen_key(event_args: dict, action: str, trade_id_onchain) -> tuple | None:
+    tx = event_args.get("txId")
+    if tx:
+        return (tx, event_args.get("eventIndex"))
+    # no tx id from the source: a TradeOpen tradeId is still unique, a TradeClosed one isn't
+    if action == "BUY" and trade_id_onchain is not None:
+        return (action, int(trade_id_onchain))
+    return None
+
+# The same identity, persisted: stored as trade_history.event_uid, so a restart that replays
+# a range from the last checkpoint skips events whose history row already landed. The
+# open_trades write still precedes its history row, so a crash between the two can repeat
+# that one event; APPLY_TRADE_RPC does both in one transaction.
+UID_CHUNK = 50  # uids per in_() filter; keeps the GET URL well under proxy limits
+
+def _event_uid(event_args: dict) -> str | None:
+    tx = event_args.get("txId")
+    return f"{tx}:{event_args.get('eventIndex')}" if tx else None
+
+def _applied_uids(uids: list[str]) -> set[str]:
+    """Which of these event uids already have a trade_history row (one select per chunk)."""
+    found = set()
+    for i in range(0, len(uids), UID_CHUNK):
+        res = supabase.table("trade_history").select("event_uid").in_("event_uid", uids[i:i + UID_CHUNK]).execute()
+        found.update(r["event_uid"] for r in res.data or [])
+    return found
+
+def _mark_seen(key: tuple | None):
+    if key is None:
+        return
+    _seen_trades[key] = None
+    if len(_seen_trades) > SEEN_TRADES_MAX:
+        _seen_trades.popitem(last=False)
+
 def process_trade_event(event_args: dict, action: str):
     """
     event_args needs:
       trader, tokenAddress, amount, timestamp
-      optional: price, strategy, tradeId (or trade_id)
+      optional: price, strategy, tradeId (or trade_id), txId + eventIndex (dedupe key)
     """
     trader = str(event_args["trader"]).lower()
-    if DEPLOYER_ADDRESS and trader != DEPLOYER_ADDRESS.lower():
-        print(f"⚠ Ignored: trader {trader} != deployer {DEPLOYER_ADDRESS.lower()}")
+    if _DEPLOYER_LC and trader != _DEPLOYER_LC:
+        log.debug("⚠ Ignored: trader %s != deployer %s", trader, _DEPLOYER_LC)
         return
 
     token_hex = str(event_args["tokenAddress"]).lower()
-    raw_amount = Decimal(str(event_args["amount"]))
+    # Decimal only to parse: raw base units can exceed 2**53 and may arrive as "1e+21"
+    raw_amount = int(Decimal(str(event_args["amount"])))
     ts_unix = int(event_args["timestamp"])
 
     # Trade ID (support a couple of key names)
     trade_id_onchain = event_args.get("tradeId")
     if trade_id_onchain is None:
         trade_id_onchain = event_args.get("trade_id")
+    seen_key = _seen_key(event_args, action, trade_id_onchain)
+    if seen_key in _seen_trades:
+        log.info("↩ Skipping duplicate %s event %s", action, seen_key)
+        return
 
     # Price: take from event if present; else fetch via API
     raw_price = event_args.get("price") or event_args.get("entryPrice") or event_args.get("exitPrice")
-    price_usd = Decimal(str(raw_price)) if raw_price is not None else Decimal(0)
+    price_usd = float(raw_price) if raw_price is not None else 0.0
     if price_usd == 0:
         price_api = get_token_price_usd(token_hex)
         if price_api is None:
-            print(f"⚠ No price for token {token_hex}, skipping.")
+            log.warning("⚠ No price for token %s, skipping.", token_hex)
             return
         price_usd = price_api
 
     # Amount to human units
     decimals = get_token_decimals(token_hex)
-    human_amount = raw_amount / (Decimal(10) ** Decimal(decimals))
+    human_amount = raw_amount / (_POW10_F[decimals] if decimals < len(_POW10_F) else 10.0 ** decimals)
 
     # Strategy: prefer event’s; if absent on BUY, we’ll set/keep it in open_trades
     strategy = event_args.get("strategy")
 
     if action == "BUY":
-        handle_buy(token_hex, human_amount, price_usd, strategy, trader, ts_unix, trade_id_onchain)
+        handle_buy(token_hex, human_amount, price_usd, strategy, trader, ts_unix, trade_id_onchain,
+                   event_uid=_event_uid(event_args))
     elif action == "SELL":
-        handle_sell(token_hex, human_amount, price_usd, trader, ts_unix, trade_id_onchain)
+        handle_sell(token_hex, human_amount, price_usd, trader, ts_unix, trade_id_onchain,
+                    event_uid=_event_uid(event_args))
+    # only once applied, so an event skipped for a missing price is retried if it shows up again
+    _mark_seen(seen_key)
 
 # ==== Poller ====
+# separate from _fetch_pool: fetch_events may fan out into _fetch_pool itself
+_type_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="evtype")
+
+# last fully processed block, so a restart resumes there instead of re-scanning / skipping;
+# events of a partly applied range are skipped on replay via trade_history.event_uid
+CHECKPOINT_PATH = os.getenv(
+    "LISTENER_CHECKPOINT_PATH", os.path.join(os.path.expanduser("~"), ".cache", "tron_bot", "checkpoint.json")
+)
+
+def _load_checkpoint() -> int | None:
+    try:
+        with open(CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+            return int(json.load(f)["start_block"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _save_checkpoint(block: int):
+    try:
+        os.makedirs(os.path.dirname(CHECKPOINT_PATH) or ".", exist_ok=True)
+        tmp = CHECKPOINT_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"start_block": block}, f)
+        os.replace(tmp, CHECKPOINT_PATH)
+    except OSError as e:
+        log.warning("⚠ Could not write checkpoint: %s", e)
+
+BLOCK_TIME_S = 3.0      # TRON produces a block every ~3s
+CATCHUP_SLEEP_S = 0.2   # still behind the head after a multi-block range
+MAX_IDLE_SLEEP_S = 10.0 # cap for repeated polls that saw no new block
+MAX_BACKOFF_S = 60      # cap for the retry delay after a failed range
+
 def listen_for_events(poll_backfill: int = 3):
     print("🔊 Listening for TRON TradeLogger events...")
     latest = tron.get_latest_block_number()
-    start_block = max(0, latest - poll_backfill)
+    saved = _load_checkpoint()
+    start_block = saved if saved is not None else max(0, latest - poll_backfill)
     print(f"📦 Latest block: {latest}")
     print(f"⏳ Starting from block: {start_block}")
 
+    idle = 0
+    backoff = BLOCK_TIME_S
     while True:
-        current = tron.get_latest_block_number()
-        if current > start_block:
-            print(f"📦 Checking blocks {start_block + 1} → {current}")
-            found_event = False
-
-            # TradeOpen (BUY)
-            opens = fetch_events("TradeOpen", start_block + 1, current)
-            for ev in opens:
-                print(f"🟢 TradeOpen raw: {ev}")
-                args = ev.get("result") or {}
-                event_args = {
-                    "tradeId":     args.get("tradeId") or args.get("trade_id"),
-                    "trader":      args.get("trader"),
-                    "tokenAddress":args.get("tokenAddress"),
-                    "amount":      args.get("amount"),
-                    "price":       args.get("entryPrice") or args.get("price"),
-                    "strategy":    args.get("strategy"),
-                    "timestamp":   args.get("timestamp"),
-                }
-                process_trade_event(event_args, "BUY")
-                found_event = True
-
-            # TradeClosed (SELL)
-            closes = fetch_events("TradeClosed", start_block + 1, current)
-            for ev in closes:
-                print(f"🔴 TradeClosed raw: {ev}")
-                args = ev.get("result") or {}
-                event_args = {
-                    "tradeId":     args.get("tradeId") or args.get("trade_id"),
-                    "trader":      args.get("trader"),
-                    "tokenAddress":args.get("tokenAddress"),
-                    "amount":      args.get("amount") or args.get("sellAmount") or args.get("amountSold") or 0,
-                    "price":       args.get("exitPrice") or args.get("price"),
-                    "timestamp":   args.get("timestamp"),
-                }
-                process_trade_event(event_args, "SELL")
-                found_event = True
-
-            if not found_event:
-                print("📭 No events found in this range")
-
-            start_block = current
+        try:
+            current = _poll_range(start_block)
+            backoff = BLOCK_TIME_S
+        except Exception as e:
+            # retried from the same start_block; events applied before the failure are in _seen_trades
+            log.warning("⚠ poll failed (%s: %s); retrying in %.0fs", type(e).__name__, e, backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_S)
+            continue
+        if current <= start_block:
+            # no new block yet: wait a block time, backing off if the head keeps not moving
+            idle += 1
+            time.sleep(min(BLOCK_TIME_S * 2 ** (idle - 1), MAX_IDLE_SLEEP_S))
+            continue
+        idle = 0
+        # a multi-block range means we were behind: poll again soon, else wait for the next block
+        time.sleep(CATCHUP_SLEEP_S if current - start_block > 1 else BLOCK_TIME_S)
+        start_block = current
+
+def _poll_range(start_block: int) -> int:
+    """Process blocks (start_block, latest]; returns the new start_block."""
+    current = tron.get_latest_block_number()
+    if current <= start_block:
+        return start_block
+    log.debug("📦 Checking blocks %d → %d", start_block + 1, current)
+    found_event = False
+
+    # both event types are independent queries: fetch them at the same time
+    f_open = _type_pool.submit(fetch_events, "TradeOpen", start_block + 1, current)
+    f_close = _type_pool.submit(fetch_events, "TradeClosed", start_block + 1, current)
+
+    # TradeOpen (BUY)
+    opens = []
+    for ev in f_open.result():
+        log.debug("🟢 TradeOpen raw: %s", ev)
+        args = ev.get("result") or {}
+        opens.append({
+            "txId":        ev.get("transaction_id"),
+            "eventIndex":  ev.get("event_index"),
+            "tradeId":     args.get("tradeId") or args.get("trade_id"),
+            "trader":      args.get("trader"),
+            "tokenAddress":args.get("tokenAddress"),
+            "amount":      args.get("amount"),
+            "price":       args.get("entryPrice") or args.get("price"),
+            "strategy":    args.get("strategy"),
+            "timestamp":   args.get("timestamp"),
+        })
+
+    # TradeClosed (SELL)
+    closes = []
+    for ev in f_close.result():
+        log.debug("🔴 TradeClosed raw: %s", ev)
+        args = ev.get("result") or {}
+        closes.append({
+            "txId":        ev.get("transaction_id"),
+            "eventIndex":  ev.get("event_index"),
+            "tradeId":     args.get("tradeId") or args.get("trade_id"),
+            "trader":      args.get("trader"),
+            "tokenAddress":args.get("tokenAddress"),
+            "amount":      args.get("amount") or args.get("sellAmount") or args.get("amountSold") or 0,
+            "price":       args.get("exitPrice") or args.get("price"),
+            "timestamp":   args.get("timestamp"),
+        })
+
+    # drop events a previous run (before a crash/restart) already applied
+    uids = [u for u in map(_event_uid, opens + closes) if u]
+    done = _applied_uids(uids) if uids else set()
+    if done:
+        log.info("↩ Skipping %d already-applied event(s)", len(done))
+        opens = [e for e in opens if _event_uid(e) not in done]
+        closes = [e for e in closes if _event_uid(e) not in done]
+
+    # writes stay in order (a SELL must see its BUY); only the lookups run in parallel
+    prefetch_token_info(opens + closes, get_token_price_usd, get_token_decimals, _DEPLOYER_LC)
+    for event_args in opens:
+        process_trade_event(event_args, "BUY")
+        found_event = True
+    for event_args in closes:
+        process_trade_event(event_args, "SELL")
+        found_event = True
+
+    if not found_event:
+        log.debug("📭 No events found in this range")
+    _save_checkpoint(current)
+    return current
 
 if __name__ == "__main__":
     listen_for_events(poll_backfill=3)
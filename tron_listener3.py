@@ -19,9 +19,14 @@
 #   TOKEN_ADDR_HEX=1   # if set to "0" stores base58 unchanged (causes problems so decided to normalise everything)
 
 from __future__ import annotations
-import os, sys, time, argparse, requests, json, hashlib
+import os, sys, time, argparse, requests, json, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from decimal import Decimal, getcontext, ROUND_HALF_UP
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from supabase import create_client
 import sys
 
@@ -32,6 +37,14 @@ getcontext().prec = 50
 EVENTS_BASE = os.getenv("TRON_EVENTS_BASE", "https://nile.trongrid.io")
 EVENTS_URL  = EVENTS_BASE + "/v1/contracts/{addr}/events"
 
+# keep-alive session: tail() polls every few seconds and run_once walks many pages,
+# so reuse the TCP+TLS connection to TronGrid instead of a handshake per call
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]),
+))
+
 def fetch_events(addr, key="", limit=200, fingerprint=None, **extra):
     # addr can be T... or 41...; TronGrid accepts both. Normalize if you prefer.
     url = EVENTS_URL.format(addr=addr)
@@ -41,7 +54,7 @@ def fetch_events(addr, key="", limit=200, fingerprint=None, **extra):
     params = {"limit": limit, "only_confirmed": "true", **extra}
     if fingerprint:
         params["fingerprint"] = fingerprint  # TronGrid uses cursor-based pagination
-    r = requests.get(url, headers=headers, params=params, timeout=20)
+    r = _SESSION.get(url, headers=headers, params=params, timeout=20)
     if r.status_code == 404:
         raise RuntimeError(
             f"404 from {url}. Check base host (should be nile.trongrid.io), "
@@ -54,6 +67,7 @@ def fetch_events(addr, key="", limit=200, fingerprint=None, **extra):
 # Address canonicalization
 
 _B58_ALPH = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_B58_IDX = {c: i for i, c in enumerate(_B58_ALPH)}   # dict hit instead of str.index scan
 
 def _safe_emoji(e: str = "✅", fallback: str = "OK") -> str:
     enc = (sys.stdout.encoding or "utf-8").lower()
@@ -67,7 +81,10 @@ def _b58decode_check(s: str) -> bytes:
     """Base58Check decode (Bitcoin/Tron). Returns payload (no 4-byte checksum)."""
     num = 0
     for ch in s:
-        num = num * 58 + _B58_ALPH.index(ch)
+        try:
+            num = num * 58 + _B58_IDX[ch]
+        except KeyError:
+            raise ValueError(f"invalid base58 character {ch!r}") from None
     # convert to bytes, add leading zeros for each leading '1'
     full = num.to_bytes((num.bit_length() + 7) // 8, "big")
     n_pad = len(s) - len(s.lstrip("1"))
@@ -80,6 +97,7 @@ def _b58decode_check(s: str) -> bytes:
         raise ValueError("invalid base58 checksum")
     return payload
 
+@lru_cache(maxsize=4096)   # a page has hundreds of events over a handful of tokens
 def tron_to_hex(addr: str) -> str:
     """
     Convert TRON base58 "T..." or hex "41..." to lowercased hex (without 0x).
@@ -120,10 +138,12 @@ def load_env():
         "supabase_url": os.getenv("SUPABASE_URL"),
         "supabase_key": os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY"),
         "trongrid_key": os.getenv("TRON_API_KEY", ""),
-        "price_scale": Decimal(os.getenv("PRICE_SCALE", "1000000")),
+        "price_scale": int(os.getenv("PRICE_SCALE", "1000000")),
         "decimals_default": int(os.getenv("TOKEN_DECIMALS_DEFAULT", "6")),
         "decimals_map": {},
         "addr_hex": os.getenv("TOKEN_ADDR_HEX", "1") != "0",
+        "trade_event_rpc": os.getenv("TRADE_EVENT_RPC", "0") == "1",   # see apply_events_rpc
+        "_decimals_cache": {},   # token_address -> resolved decimals (see token_decimals)
     }
     dm = os.getenv("TOKEN_DECIMALS_MAP")
     if dm:
@@ -131,6 +151,10 @@ def load_env():
             cfg["decimals_map"] = json.loads(dm)
         except Exception as e:
             print(f"[WARN] TOKEN_DECIMALS_MAP parse failed: {e}")
+    # per-decimals divisors / rounding units; only a few distinct values ever show up
+    cfg["_amount_scale"], cfg["_quant_unit"] = {}, {}
+    for d in {cfg["decimals_default"], *(int(v) for v in cfg["decimals_map"].values())}:
+        _scales_for(cfg, d)
     for k in ("contract", "supabase_url", "supabase_key"):
         if not cfg[k]:
             print(f"[ERR] Missing env: {k}", file=sys.stderr); sys.exit(1)
@@ -173,20 +197,47 @@ def supabase_client(cfg) -> Client:
     return create_client(cfg["supabase_url"], cfg["supabase_key"])
 
 def token_decimals(cfg, token_address: str) -> int:
-    # Lookup by both base58 and hex (lowercased)
-    m = cfg["decimals_map"]
-    return int(m.get(token_address, m.get(token_address.lower(), cfg["decimals_default"])))
-
-def to_price(cfg, raw_int: int) -> Decimal:
-    return (Decimal(int(raw_int)) / cfg["price_scale"]).quantize(Decimal("0.000000000000000001"))
-
-def to_amount(cfg, token_address: str, raw_int: int) -> Decimal:
-    dec = token_decimals(cfg, token_address)
-    scale = Decimal(10) ** dec
-    return (Decimal(int(raw_int)) / scale).quantize(Decimal("0.000000000000000001"))
+    c = cfg["_decimals_cache"]
+    dec = c.get(token_address)
+    if dec is None:
+        # Lookup by both base58 and hex (lowercased)
+        m = cfg["decimals_map"]
+        dec = c[token_address] = int(m.get(token_address, m.get(token_address.lower(), cfg["decimals_default"])))
+    return dec
+
+# Fixed point: prices and amounts are ints in units of 1e-18 (the precision the DB values
+# were quantized to). Strings only appear at the DB boundary, via fmt_fx / parse_fx.
+FX_DP = 18
+FX = 10 ** FX_DP
+
+def fmt_fx(v: int) -> str:
+    sign = "-" if v < 0 else ""
+    q, r = divmod(abs(v), FX)
+    return f"{sign}{q}.{r:0{FX_DP}d}".rstrip("0").rstrip(".") if r else f"{sign}{q}"
+
+def parse_fx(v) -> int:
+    """DB value (str / float / int) -> fixed-point int."""
+    return int((Decimal(str(v)) * FX).to_integral_value(rounding=ROUND_HALF_UP))
+
+def _scales_for(cfg, dec: int) -> tuple[int, int]:
+    """(10**dec, fixed-point rounding unit) for a decimals value; filled lazily for new ones."""
+    scale = cfg["_amount_scale"].get(dec)
+    if scale is None:
+        scale = cfg["_amount_scale"][dec] = 10 ** dec
+        cfg["_quant_unit"][dec] = 10 ** (FX_DP - dec) if dec < FX_DP else 1
+    return scale, cfg["_quant_unit"][dec]
+
+def to_price(cfg, raw_int: int) -> int:
+    return int(raw_int) * FX // cfg["price_scale"]
+
+def to_amount(cfg, token_address: str, raw_int: int) -> int:
+    scale, _ = _scales_for(cfg, token_decimals(cfg, token_address))
+    return int(raw_int) * FX // scale
 
 def event_uid(ev: dict) -> str:
     """Stable unique id per event to prevent duplicates across polls."""
+    # format is what trade_history.event_uid already holds: keep it byte-identical
+    # (stdlib json, not orjson) or replays stop matching existing rows
     payload = {
         "tx": ev.get("transaction_id"),
         "bn": ev.get("block_number"),
@@ -197,13 +248,15 @@ def event_uid(ev: dict) -> str:
     s = json.dumps(payload, sort_keys=True, separators=(",", ":"))
     return hashlib.sha1(s.encode()).hexdigest()
 
-def quant_amount(cfg, token_src: str, x: Decimal) -> Decimal:
-    dec = token_decimals(cfg, token_src)
-    q = Decimal(1) / (Decimal(10) ** dec)
-    return x.quantize(q, rounding=ROUND_HALF_UP)
-
-def is_zero_amount(cfg, token_src: str, x: Decimal) -> bool:
-    return quant_amount(cfg, token_src, x) == Decimal("0")
+def quant_amount(cfg, token_src: str, x: int) -> int:
+    """Round a fixed-point amount to the token's decimals (half up)."""
+    _, unit = _scales_for(cfg, token_decimals(cfg, token_src))
+    if unit == 1:
+        return x
+    q, r = divmod(abs(x), unit)
+    if 2 * r >= unit:
+        q += 1
+    return q * unit if x >= 0 else -q * unit
 
 def save_aliases_for_open(sup, symbol: str, token_address: str):
     """
@@ -225,49 +278,49 @@ def save_aliases_for_open(sup, symbol: str, token_address: str):
 
 # Parsers for events
 
-def parse_tradeopen(ev, cfg):
+# run on every event: bind the .get methods once, and pass uid in when the caller has it
+
+def parse_tradeopen(ev, cfg, uid: str | None = None):
     r = ev["result"]
+    rget, ev_get = r.get, ev.get
     tok = r["tokenAddress"]
-    price = to_price(cfg, r["entryPrice"])
-    amt   = to_amount(cfg, tok, r["amount"])
-    token_db = tron_to_hex(tok) if cfg["addr_hex"] else tok
+    action = rget("action") or "BUY"
+    if action != "BUY":
+        action = action.upper()
     return {
-        "uid": event_uid(ev),
-        "tx_id": ev.get("transaction_id"),
+        "uid": uid or event_uid(ev),
+        "tx_id": ev_get("transaction_id"),
         "event_name": "TradeOpen",
         "trade_id": int(r["tradeId"]),
         "trader": r["trader"],
-        "token_symbol": r.get("tokenSymbol") or "UNKNOWN",  # <-- NEW: from chain
-        "token_address": token_db,
+        "token_symbol": rget("tokenSymbol") or "UNKNOWN",  # <-- NEW: from chain
+        "token_address": tron_to_hex(tok) if cfg["addr_hex"] else tok,
         "token_src": tok,
-        "strategy": r.get("strategy"),
-        "action": (r.get("action", "BUY") or "BUY").upper(),
-        "price": price,
-        "amount": amt,
-        "block_number": ev.get("block_number"),
+        "strategy": rget("strategy"),
+        "action": action,
+        "price": to_price(cfg, r["entryPrice"]),
+        "amount": to_amount(cfg, tok, r["amount"]),
+        "block_number": ev_get("block_number"),
     }
 
-def parse_tradeclosed(ev, cfg):
+def parse_tradeclosed(ev, cfg, uid: str | None = None):
     r = ev["result"]
+    rget, ev_get = r.get, ev.get
     tok = r["tokenAddress"]
-    price = to_price(cfg, r["exitPrice"])
-    pnl = Decimal(int(r["pnl"])) / cfg["price_scale"]
-    token_db = tron_to_hex(tok) if cfg["addr_hex"] else tok
-    sell_amt_raw = r.get("sellAmount")
-    sell_amt = to_amount(cfg, tok, sell_amt_raw) if sell_amt_raw is not None else None
+    sell_amt_raw = rget("sellAmount")
     return {
-        "uid": event_uid(ev),
-        "tx_id": ev.get("transaction_id"),
+        "uid": uid or event_uid(ev),
+        "tx_id": ev_get("transaction_id"),
         "event_name": "TradeClosed",
         "trade_id": int(r["tradeId"]),
         "trader": r["trader"],
-        "token_symbol": r.get("tokenSymbol") or "UNKNOWN",  # <-- NEW: from chain
-        "token_address": token_db,
+        "token_symbol": rget("tokenSymbol") or "UNKNOWN",  # <-- NEW: from chain
+        "token_address": tron_to_hex(tok) if cfg["addr_hex"] else tok,
         "token_src": tok,
-        "price": price,
-        "pnl": pnl,
-        "sell_amount": sell_amt,                              # Decimal or None
-        "block_number": ev.get("block_number"),
+        "price": to_price(cfg, r["exitPrice"]),
+        "pnl": int(r["pnl"]) * FX // cfg["price_scale"],
+        "sell_amount": to_amount(cfg, tok, sell_amt_raw) if sell_amt_raw is not None else None,  # fixed-point int or None
+        "block_number": ev_get("block_number"),
     }
 
 
@@ -285,8 +338,31 @@ def _jsonify_decimals(obj):
         return [_jsonify_decimals(v) for v in obj]
     return obj
 
+# open_trades rows by token_address, so tail() can skip the select for tokens it just wrote.
+# Other writers exist (the other listeners, /rebuild_confirm), so entries expire after a few
+# seconds, misses (None) are never cached, and the cache is cleared when a write fails.
+OPEN_CACHE_MAX = 1024
+OPEN_CACHE_TTL_S = 10.0
+_open_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+_open_lock = threading.Lock()   # page prefetch reads from several threads
+
+def _cache_open(token_address: str, row: dict | None):
+    with _open_lock:
+        if row is None:
+            _open_cache.pop(token_address, None)
+            return
+        _open_cache[token_address] = (time.monotonic() + OPEN_CACHE_TTL_S, row)
+        _open_cache.move_to_end(token_address)
+        if len(_open_cache) > OPEN_CACHE_MAX:
+            _open_cache.popitem(last=False)
+
+def clear_open_cache():
+    with _open_lock:
+        _open_cache.clear()
+
 def upsert_open(sup, row: dict):
     sup.table("open_trades").upsert(_jsonify_decimals(row), on_conflict="token_address").execute()
+    _cache_open(row["token_address"], row)
 
 def insert_history(sup, row: dict):
     insert_history_once(sup, row)
@@ -294,8 +370,17 @@ def insert_history(sup, row: dict):
 
 def delete_open(sup: Client, token_address: str):
     sup.table("open_trades").delete().eq("token_address", token_address).execute()
+    with _open_lock:
+        _open_cache.pop(token_address, None)
 
 def get_open(sup, token_address: str):
+    with _open_lock:
+        hit = _open_cache.get(token_address)
+        if hit is not None:
+            if hit[0] > time.monotonic():
+                _open_cache.move_to_end(token_address)
+                return hit[1]
+            del _open_cache[token_address]
     try:
         q = (
             sup.table("open_trades")
@@ -319,18 +404,23 @@ def get_open(sup, token_address: str):
     if data is None and isinstance(resp, dict):
         data = resp.get("data")
 
-    # If it's a list, return first or None
+    # If it's a list, take first or None
     if isinstance(data, list):
-        return data[0] if data else None
+        data = data[0] if data else None
 
-    # If it's already a dict (single row) or None, return it
+    # dict (single row) or None; only rows are cached, failed queries above are not
+    _cache_open(token_address, data)
     return data
 
-def history_exists_by_uid(sup: Client, uid: str) -> bool:
-    if not uid:
-        return False
-    resp = sup.table("trade_history").select("id").eq("event_uid", uid).limit(1).execute()
-    return bool(resp.data)
+UID_CHUNK = 50  # uids per in_() filter; keeps the GET URL well under proxy limits
+
+def history_exists_bulk(sup: Client, uids: list[str]) -> set[str]:
+    """Which of these event_uids are already in trade_history (one select per chunk, not per uid)."""
+    found = set()
+    for i in range(0, len(uids), UID_CHUNK):
+        resp = sup.table("trade_history").select("event_uid").in_("event_uid", uids[i:i + UID_CHUNK]).execute()
+        found.update(r["event_uid"] for r in resp.data or [])
+    return found
 
 def insert_history_once(sup: Client, row: dict):
     """Insert once per event_uid. Requires event_uid column to be UNIQUE."""
@@ -340,36 +430,126 @@ def insert_history_once(sup: Client, row: dict):
     
 
 
-def get_open_any(sup: Client, token_src: str):
+# Page batching (run_once): reads see this page's pending writes, and everything is
+# written in one call per table by flush_page() instead of 1-3 round trips per event.
+
+def new_page() -> dict:
+    return {"open": {}, "dirty": set(), "history": [], "aliases": {}}
+
+def _open_lookup(sup, page, token: str):
+    if page is None:
+        return get_open(sup, token)
+    if token not in page["open"]:
+        page["open"][token] = get_open(sup, token)
+    return page["open"][token]
+
+def _write_open(sup, page, row: dict):
+    if page is None:
+        upsert_open(sup, row)
+        return
+    page["open"][row["token_address"]] = row
+    page["dirty"].add(row["token_address"])
+
+def _drop_open(sup, page, token: str):
+    if page is None:
+        delete_open(sup, token)
+        return
+    page["open"][token] = None
+    page["dirty"].add(token)
+
+def _write_history(sup, page, row: dict):
+    if page is None:
+        insert_history_once(sup, row)
+    else:
+        page["history"].append(row)
+
+def _write_aliases(sup, page, symbol: str, token_address: str):
+    if page is None:
+        save_aliases_for_open(sup, symbol, token_address)
+    elif symbol and token_address:
+        page["aliases"][symbol.strip().lower()] = token_address
+        page["aliases"][token_address.strip().lower()] = token_address
+
+# page reads/writes touch different tokens/tables, so they can be in flight together
+_DB_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase")
+
+def prefetch_open(sup, page, tokens):
+    """Load the open rows for a page's tokens concurrently before the (ordered) apply loop."""
+    todo = [t for t in set(tokens) if t not in page["open"]]
+    for t, row in zip(todo, _DB_POOL.map(lambda t: get_open(sup, t), todo)):
+        page["open"][t] = row
+
+def _upsert_aliases(sup, aliases: dict):
+    try:
+        sup.table("token_aliases").upsert(
+            [{"alias": a, "canonical_address": c} for a, c in aliases.items()],
+            on_conflict="alias",
+        ).execute()
+    except Exception as e:
+        # Non-fatal: alias seeding should never break ingestion
+        print(f"[alias] upsert failed: {e}")
+
+def flush_page(sup, page):
+    rows = [page["open"][t] for t in page["dirty"] if page["open"][t] is not None]
+    gone = [t for t in page["dirty"] if page["open"][t] is None]
+    jobs = []
+    if page["history"]:
+        jobs.append(_DB_POOL.submit(lambda: sup.table("trade_history").upsert(
+            _jsonify_decimals(page["history"]), on_conflict="event_uid").execute()))
+    if rows:
+        jobs.append(_DB_POOL.submit(lambda: sup.table("open_trades").upsert(
+            _jsonify_decimals(rows), on_conflict="token_address").execute()))
+    if gone:
+        jobs.append(_DB_POOL.submit(lambda: sup.table("open_trades").delete().in_("token_address", gone).execute()))
+    if page["aliases"]:
+        jobs.append(_DB_POOL.submit(_upsert_aliases, sup, page["aliases"]))
+    try:
+        for j in jobs:
+            j.result()  # re-raise the first failed write
+    except Exception:
+        clear_open_cache()   # some writes may have landed; re-read rather than trust the cache
+        raise
+    for t in page["dirty"]:
+        _cache_open(t, page["open"][t])
+
+def get_open_any(sup: Client, token_src: str, cfg=None):
+    # with addr_hex (the default) only the hex form is ever stored: one key, cached lookup
+    if cfg is not None and cfg["addr_hex"]:
+        return get_open(sup, tron_to_hex(token_src))
     # Try both stored forms
     possibles = {token_src, tron_to_hex(token_src)}
     resp = sup.table("open_trades").select("*").in_("token_address", list(possibles)).limit(1).execute()
     return resp.data[0] if resp.data else None
 
-def delete_open_any(sup: Client, token_src: str):
+def delete_open_any(sup: Client, token_src: str, cfg=None):
+    if cfg is not None and cfg["addr_hex"]:
+        delete_open(sup, tron_to_hex(token_src))
+        return
     possibles = {token_src, tron_to_hex(token_src)}
     sup.table("open_trades").delete().in_("token_address", list(possibles)).execute()
+    with _open_lock:
+        for t in possibles:
+            _open_cache.pop(t, None)
 
 
 # Position math 
 
-def buy_merge(avg_entry_price: Decimal, amount: Decimal, buy_price: Decimal, buy_amount: Decimal):
+# all fixed-point ints (see FX)
+
+def buy_merge(avg_entry_price: int, amount: int, buy_price: int, buy_amount: int):
     if amount <= 0:
         return (buy_price, buy_amount)
     new_amt = amount + buy_amount
-    new_avg = ((avg_entry_price * amount) + (buy_price * buy_amount)) / new_amt
+    new_avg = (avg_entry_price * amount + buy_price * buy_amount) // new_amt
     return (new_avg, new_amt)
 
-def sell_pnl(avg_entry_price: Decimal, sell_price: Decimal, sell_amount: Decimal):
-    return (sell_price - avg_entry_price) * sell_amount
+def sell_pnl(avg_entry_price: int, sell_price: int, sell_amount: int):
+    return (sell_price - avg_entry_price) * sell_amount // FX
 
 # Apply events
 
-def apply_tradeopen(sup: Client, ev: dict, cfg):
-# Idempotency: if history already has this event_uid, skip everything.
-    if history_exists_by_uid(sup, ev["uid"]):
-        return
-
+def apply_tradeopen(sup: Client, ev: dict, cfg, page=None):
+    # Idempotency: callers drop events whose event_uid is already in history (history_exists_bulk)
     token = ev["token_address"]
     symbol = ev.get("token_symbol")
     action = ev["action"]
@@ -377,15 +557,15 @@ def apply_tradeopen(sup: Client, ev: dict, cfg):
     amt    = ev["amount"]
     trade_id = ev["trade_id"]
 
-    op = get_open(sup, token)
+    op = _open_lookup(sup, page, token)
 
     hist = {
         "trade_id_onchain": trade_id,
         "token_address": token,
         "token_symbol": symbol,
         "action": action,
-        "price": price,
-        "amount": amt,
+        "price": fmt_fx(price),
+        "amount": fmt_fx(amt),
         "strategy": ev.get("strategy"),
         "avg_entry_price": None,
         "avg_exit_price": None,
@@ -393,45 +573,46 @@ def apply_tradeopen(sup: Client, ev: dict, cfg):
     }
 
     if action == "BUY":
-        if op and Decimal(str(op["amount"])) > 0:
+        op_amt = parse_fx(op["amount"]) if op else 0
+        if op_amt > 0:
             # merging without overwriting opening trade_id_onchain
             new_avg, new_amt = buy_merge(
-                Decimal(str(op["avg_entry_price"])),
-                Decimal(str(op["amount"])),
+                parse_fx(op["avg_entry_price"]),
+                op_amt,
                 price, amt
             )
-            upsert_open(sup, {
+            _write_open(sup, page, {
                 "token_address": token,
                 "token_symbol": symbol,
                 # keep the original opening trade id:
                 "trade_id_onchain": op.get("trade_id_onchain"),
-                "avg_entry_price": new_avg,
-                "amount": new_amt,
+                "avg_entry_price": fmt_fx(new_avg),
+                "amount": fmt_fx(new_amt),
                 "strategy": ev.get("strategy") or op.get("strategy"),
                 "trader": ev.get("trader"),
                 "last_tx_id": ev.get("tx_id"),
             })
-            save_aliases_for_open(sup, symbol, token)
-            hist["avg_entry_price"] = new_avg
+            _write_aliases(sup, page, symbol, token)
+            hist["avg_entry_price"] = fmt_fx(new_avg)
         else:
             # first buy: set opening trade id
-            upsert_open(sup, {
+            _write_open(sup, page, {
                 "token_address": token,
                 "token_symbol": symbol,
                 "trade_id_onchain": trade_id,   # <- only here
-                "avg_entry_price": price,
-                "amount": amt,
+                "avg_entry_price": fmt_fx(price),
+                "amount": fmt_fx(amt),
                 "strategy": ev.get("strategy"),
                 "trader": ev.get("trader"),
                 "last_tx_id": ev.get("tx_id"),
             })
-            save_aliases_for_open(sup, symbol, token)
+            _write_aliases(sup, page, symbol, token)
 
-            hist["avg_entry_price"] = price
+            hist["avg_entry_price"] = fmt_fx(price)
 
         # carry idempotency fields into history
         hist.update({"tx_id": ev.get("tx_id"), "event_uid": ev.get("uid")})
-        insert_history_once(sup, hist)
+        _write_history(sup, page, hist)
         return
 
 
@@ -439,25 +620,22 @@ def apply_tradeopen(sup: Client, ev: dict, cfg):
             # Legacy compatibility: do NOT mutate open_trades here anymore.
             # We only record to history so old 'open SELL' events won't break state.
             hist.update({"tx_id": ev.get("tx_id"), "event_uid": ev.get("uid")})
-            insert_history_once(sup, hist)
+            _write_history(sup, page, hist)
             return
 
 
     return
 
-def apply_tradeclosed(sup: Client, ev: dict, cfg):
-    # Idempotency: if history already has this event_uid, skip everything.
-    if history_exists_by_uid(sup, ev["uid"]):
-        return
-    
+def apply_tradeclosed(sup: Client, ev: dict, cfg, page=None):
+    # Idempotency: callers drop events whose event_uid is already in history (history_exists_bulk)
     token      = ev["token_address"]
     symbol     = ev.get("token_symbol")
     close_px   = ev["price"]
     trade_id   = ev["trade_id"]
     pnl_ev     = ev.get("pnl")
-    sell_amt   = ev.get("sell_amount")  # Decimal or None
+    sell_amt   = ev.get("sell_amount")  # fixed-point int or None
 
-    op = get_open(sup, token)
+    op = _open_lookup(sup, page, token)
 
     # Base history row
     hist = {
@@ -465,25 +643,25 @@ def apply_tradeclosed(sup: Client, ev: dict, cfg):
         "token_address": token,
         "token_symbol": symbol,
         "action": "SELL",
-        "price": close_px,
-        "avg_exit_price": close_px,
-        "amount": Decimal("0"),
+        "price": fmt_fx(close_px),
+        "avg_exit_price": fmt_fx(close_px),
+        "amount": "0",
         "strategy": None,
         "avg_entry_price": None,
-        "pnl": pnl_ev,
+        "pnl": fmt_fx(pnl_ev) if pnl_ev is not None else None,
         "tx_id": ev.get("tx_id"),
         "event_uid": ev.get("uid"),
     }
 
     # No open position tracked — just log with provided sell_amt (if any)
-    if not op or Decimal(str(op["amount"])) <= 0:
+    open_amt = parse_fx(op["amount"]) if op else 0
+    if open_amt <= 0:
         if sell_amt is not None:
-            hist["amount"] = sell_amt
-        insert_history_once(sup, hist)
+            hist["amount"] = fmt_fx(sell_amt)
+        _write_history(sup, page, hist)
         return
 
-    open_amt  = Decimal(str(op["amount"]))
-    avg_entry = Decimal(str(op["avg_entry_price"]))
+    avg_entry = parse_fx(op["avg_entry_price"])
 
     # Decide how much to close:
     #   - prefer on-chain sell_amt
@@ -493,7 +671,7 @@ def apply_tradeclosed(sup: Client, ev: dict, cfg):
     else:
         # hard clamp to [0, open_amt]
         if sell_amt < 0:
-            sell_amt = Decimal("0")
+            sell_amt = 0
         if sell_amt > open_amt:
             sell_amt = open_amt
 
@@ -501,27 +679,27 @@ def apply_tradeclosed(sup: Client, ev: dict, cfg):
     sell_amt  = quant_amount(cfg, ev["token_src"], sell_amt)
     remaining = quant_amount(cfg, ev["token_src"], open_amt - sell_amt)
     if remaining < 0:
-        remaining = Decimal("0")
+        remaining = 0
 
     realized = sell_pnl(avg_entry, close_px, sell_amt)
 
     hist.update({
-        "amount": sell_amt,
+        "amount": fmt_fx(sell_amt),
         "strategy": op.get("strategy"),
-        "avg_entry_price": avg_entry,
-        "pnl": pnl_ev if pnl_ev is not None else realized,
+        "avg_entry_price": fmt_fx(avg_entry),
+        "pnl": fmt_fx(pnl_ev if pnl_ev is not None else realized),
     })
-    insert_history_once(sup, hist)
+    _write_history(sup, page, hist)
 
-    if is_zero_amount(cfg, ev["token_src"], remaining):
-        delete_open(sup, token)
+    if remaining == 0:   # already quantized above, so a plain int compare
+        _drop_open(sup, page, token)
     else:
-        upsert_open(sup, {
+        _write_open(sup, page, {
             "token_address": token,
             "token_symbol": symbol,
             "trade_id_onchain": op.get("trade_id_onchain"),
-            "avg_entry_price": avg_entry,
-            "amount": remaining,
+            "avg_entry_price": fmt_fx(avg_entry),
+            "amount": fmt_fx(remaining),
             "strategy": op.get("strategy"),
             "trader": op.get("trader"),
             "last_tx_id": ev.get("tx_id"),
@@ -530,40 +708,162 @@ def apply_tradeclosed(sup: Client, ev: dict, cfg):
 
 
 
+# Server-side apply (TRADE_EVENT_RPC=1): one RPC per page/poll does the merge, PnL,
+# open_trades write and history insert in Postgres, with no read-before-write from here.
+# Create the function once (SQL editor):
+#
+#   create or replace function apply_trade_event_batch(events jsonb) returns void
+#   language plpgsql as $$
+#   declare
+#     e jsonb; op open_trades%rowtype; has_op boolean; v_tok text;
+#     v_px numeric; v_amt numeric; v_avg numeric; v_sell numeric; v_rem numeric;
+#   begin
+#     for e in select * from jsonb_array_elements(events) loop
+#       if exists (select 1 from trade_history where event_uid = e->>'uid') then continue; end if;
+#       v_tok := e->>'token_address';
+#       v_px  := (e->>'price')::numeric;
+#       select * into op from open_trades where token_address = v_tok for update;
+#       has_op := found and op.amount > 0;
+#       if e->>'kind' = 'open' then
+#         v_amt := (e->>'amount')::numeric;
+#         v_avg := null;
+#         if e->>'action' = 'BUY' then
+#           if has_op then
+#             v_avg := (op.avg_entry_price * op.amount + v_px * v_amt) / (op.amount + v_amt);
+#             update open_trades set token_symbol = e->>'token_symbol', avg_entry_price = v_avg,
+#                    amount = op.amount + v_amt, strategy = coalesce(e->>'strategy', op.strategy),
+#                    trader = e->>'trader', last_tx_id = e->>'tx_id'
+#              where token_address = v_tok;
+#           else
+#             v_avg := v_px;
+#             insert into open_trades (token_address, token_symbol, trade_id_onchain, avg_entry_price,
+#                                      amount, strategy, trader, last_tx_id)
+#             values (v_tok, e->>'token_symbol', (e->>'trade_id')::bigint, v_px, v_amt,
+#                     e->>'strategy', e->>'trader', e->>'tx_id')
+#             on conflict (token_address) do update set
+#               token_symbol = excluded.token_symbol, trade_id_onchain = excluded.trade_id_onchain,
+#               avg_entry_price = excluded.avg_entry_price, amount = excluded.amount,
+#               strategy = excluded.strategy, trader = excluded.trader, last_tx_id = excluded.last_tx_id;
+#           end if;
+#           insert into token_aliases (alias, canonical_address)
+#           values (lower(trim(e->>'token_symbol')), v_tok), (lower(v_tok), v_tok)
+#           on conflict (alias) do update set canonical_address = excluded.canonical_address;
+#         end if;
+#         insert into trade_history (trade_id_onchain, token_address, token_symbol, action, price, amount,
+#                                    strategy, avg_entry_price, tx_id, event_uid)
+#         values ((e->>'trade_id')::bigint, v_tok, e->>'token_symbol', e->>'action', v_px, v_amt,
+#                 e->>'strategy', v_avg, e->>'tx_id', e->>'uid');
+#       else
+#         v_sell := (e->>'sell_amount')::numeric;
+#         if not has_op then
+#           insert into trade_history (trade_id_onchain, token_address, token_symbol, action, price,
+#                                      avg_exit_price, amount, pnl, tx_id, event_uid)
+#           values ((e->>'trade_id')::bigint, v_tok, e->>'token_symbol', 'SELL', v_px, v_px,
+#                   coalesce(v_sell, 0), (e->>'pnl')::numeric, e->>'tx_id', e->>'uid');
+#           continue;
+#         end if;
+#         v_sell := round(greatest(0, least(coalesce(v_sell, op.amount), op.amount)), (e->>'decimals')::int);
+#         v_rem  := greatest(0, round(op.amount - v_sell, (e->>'decimals')::int));
+#         insert into trade_history (trade_id_onchain, token_address, token_symbol, action, price,
+#                                    avg_exit_price, amount, strategy, avg_entry_price, pnl, tx_id, event_uid)
+#         values ((e->>'trade_id')::bigint, v_tok, e->>'token_symbol', 'SELL', v_px, v_px, v_sell,
+#                 op.strategy, op.avg_entry_price, (e->>'pnl')::numeric, e->>'tx_id', e->>'uid');
+#         if v_rem = 0 then
+#           delete from open_trades where token_address = v_tok;
+#         else
+#           update open_trades set token_symbol = e->>'token_symbol', amount = v_rem,
+#                  last_tx_id = e->>'tx_id'
+#            where token_address = v_tok;
+#         end if;
+#       end if;
+#     end loop;
+#   end $$;
+
+def _rpc_event(p: dict, cfg) -> dict:
+    out = {k: p[k] for k in ("uid", "tx_id", "trade_id", "trader", "token_address", "token_symbol")}
+    if p["event_name"] == "TradeOpen":
+        out.update(kind="open", action=p["action"], strategy=p.get("strategy"),
+                   price=fmt_fx(p["price"]), amount=fmt_fx(p["amount"]))
+    else:
+        sell = p["sell_amount"]
+        out.update(kind="close", price=fmt_fx(p["price"]), pnl=fmt_fx(p["pnl"]),
+                   sell_amount=fmt_fx(sell) if sell is not None else None,
+                   decimals=token_decimals(cfg, p["token_src"]))
+    return out
+
+def apply_events_rpc(sup, parsed: list[dict], cfg):
+    """Apply parsed events (oldest first) in one apply_trade_event_batch call."""
+    if not parsed:
+        return
+    sup.rpc("apply_trade_event_batch", {"events": [_rpc_event(p, cfg) for p in parsed]}).execute()
+    # rows changed server-side: drop what we cached for these tokens
+    with _open_lock:
+        for p in parsed:
+            _open_cache.pop(p["token_address"], None)
+
 # Run modes
 
+TRADE_EVENTS = frozenset({"TradeOpen", "TradeClosed"})  # anything else on the contract is skipped
+
+# one page in flight ahead of the one being written; TronGrid paging is sequential anyway
+_FETCH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trongrid")
+
 def run_once(cfg):
     sup = supabase_client(cfg)
-    fingerprint = None
     total = 0
     pages = 0
 
-    while True:
-        j = fetch_events(cfg["contract"], key=cfg["trongrid_key"], limit=200, fingerprint=fingerprint)
+    nxt = _FETCH_POOL.submit(fetch_events, cfg["contract"], key=cfg["trongrid_key"], limit=200)
+    while nxt is not None:
+        j = nxt.result()
         events = j.get("data", [])
         if not events:
             break
 
-        # process oldest → newest so buys land before sells
-        events.sort(key=lambda e: (e.get("block_number", 0), e.get("event_index", 0)))
-
-        for ev in events:
-            name = ev.get("event_name")
-            if name == "TradeOpen":
-                apply_tradeopen(sup, parse_tradeopen(ev, cfg), cfg)
-            elif name == "TradeClosed":
-                apply_tradeclosed(sup, parse_tradeclosed(ev, cfg), cfg)
-            total += 1
-
         # advance the cursor so not looping page 1 forever
         fingerprint = (
             j.get("meta", {}).get("fingerprint")
             or j.get("fingerprint")
             or (j.get("meta", {}).get("links", {}).get("next") if isinstance(j.get("meta", {}).get("links"), dict) else None)
         )
-        if not fingerprint:
-            break
-        pages += 1
+        # fetch the next page while this one is applied/written
+        nxt = (_FETCH_POOL.submit(fetch_events, cfg["contract"], key=cfg["trongrid_key"], limit=200,
+                                  fingerprint=fingerprint)
+               if fingerprint else None)
+
+        # drop other event types before any sort/parse work (the raw page still drives paging)
+        events = [e for e in events if e.get("event_name") in TRADE_EVENTS]
+
+        # process oldest → newest so buys land before sells
+        events.sort(key=lambda e: (e.get("block_number", 0), e.get("event_index", 0)))
+
+        # one lookup for the whole page instead of a select per event
+        uids = [event_uid(e) for e in events]
+        done = history_exists_bulk(sup, uids)
+
+        parsed = []
+        for ev, uid in zip(events, uids):
+            if uid in done:
+                continue
+            if ev.get("event_name") == "TradeOpen":
+                parsed.append((apply_tradeopen, parse_tradeopen(ev, cfg, uid)))
+            else:
+                parsed.append((apply_tradeclosed, parse_tradeclosed(ev, cfg, uid)))
+
+        if cfg["trade_event_rpc"]:
+            apply_events_rpc(sup, [p for _, p in parsed], cfg)
+            total += len(parsed)
+        else:
+            # reads for all tokens go out together; applying stays in event order (SELL after its BUY)
+            page = new_page()
+            prefetch_open(sup, page, [p["token_address"] for _, p in parsed])
+            for apply, p in parsed:
+                apply(sup, p, cfg, page)
+                total += 1
+            flush_page(sup, page)
+
+        if nxt is not None:
+            pages += 1
 
 
     mark = _safe_emoji("✅", "OK")
@@ -571,30 +871,86 @@ def run_once(cfg):
 
 
 
+# tail() high-water mark: newest block_timestamp (ms) it has applied. Persisted so a restart
+# asks TronGrid only for newer events instead of re-reading (and re-checking) the last page.
+TAIL_STATE_PATH = os.getenv(
+    "TAIL_STATE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "tron_bot", "tail_state.json")
+)
+SEEN_MAX = 10_000  # uids kept for events that share the high-water timestamp / overlap polls
+
+def _load_tail_mark() -> int | None:
+    try:
+        with open(TAIL_STATE_PATH, "r", encoding="utf-8") as f:
+            return int(json.load(f)["block_timestamp"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _save_tail_mark(ts_ms: int):
+    try:
+        os.makedirs(os.path.dirname(TAIL_STATE_PATH) or ".", exist_ok=True)
+        tmp = TAIL_STATE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"block_timestamp": ts_ms}, f)
+        os.replace(tmp, TAIL_STATE_PATH)
+    except OSError as e:
+        print(f"[tail] could not save state: {e}")
+
 def tail(cfg, interval=5):
     sup = supabase_client(cfg)
-    seen = set()
-    print(f"[tail] polling every {interval}s...")
+    seen: OrderedDict[str, None] = OrderedDict()
+    mark = _load_tail_mark()
+    print(f"[tail] polling every {interval}s..." + (f" (resuming after {mark})" if mark else ""))
     while True:
         try:
-            j = fetch_events(cfg["contract"], key=cfg["trongrid_key"], limit=200)
-            events = j.get("data", [])
+            if mark is None:
+                j = fetch_events(cfg["contract"], key=cfg["trongrid_key"], limit=200)
+            else:
+                # oldest-first from the mark, so a burst bigger than one page is walked, not skipped
+                j = fetch_events(cfg["contract"], key=cfg["trongrid_key"], limit=200,
+                                 min_block_timestamp=mark, order_by="block_timestamp,asc")
+            raw = j.get("data", [])
+            events = [e for e in raw if e.get("event_name") in TRADE_EVENTS]
             # oldest → newest
             events.sort(key=lambda e: (e.get("block_number", 0), e.get("event_index", 0)))
+            uids = [event_uid(e) for e in events]
+            done = history_exists_bulk(sup, [u for u in uids if u not in seen])
+            def remember(u):
+                # only once the event is in trade_history: a failed poll must retry it
+                seen[u] = None
+                if len(seen) > SEEN_MAX:
+                    seen.popitem(last=False)
+
             new_count = 0
-            for ev in events:
-                uid = event_uid(ev)
-                if uid in seen: 
+            batch = []   # TRADE_EVENT_RPC: applied together after the loop
+            queued = set()
+            for ev, uid in zip(events, uids):
+                if uid in seen or uid in queued:
+                    continue
+                if uid in done:
+                    remember(uid)
                     continue
-                seen.add(uid)
                 name = ev.get("event_name")
+                if cfg["trade_event_rpc"]:
+                    batch.append((parse_tradeopen if name == "TradeOpen" else parse_tradeclosed)(ev, cfg, uid))
+                    queued.add(uid)
+                    continue
                 if name == "TradeOpen":
-                    apply_tradeopen(sup, parse_tradeopen(ev, cfg), cfg)
+                    apply_tradeopen(sup, parse_tradeopen(ev, cfg, uid), cfg)
                 elif name == "TradeClosed":
-                    apply_tradeclosed(sup, parse_tradeclosed(ev, cfg), cfg)
+                    apply_tradeclosed(sup, parse_tradeclosed(ev, cfg, uid), cfg)
+                remember(uid)
                 new_count += 1
+            apply_events_rpc(sup, batch, cfg)
+            for p in batch:
+                remember(p["uid"])
+            new_count += len(batch)
+            newest = max((int(e.get("block_timestamp") or 0) for e in raw), default=0)
+            if newest > (mark or 0):
+                mark = newest
+                _save_tail_mark(mark)
             print(f"[tail] +{new_count} new events; sleeping {interval}s")
         except Exception as e:
+            clear_open_cache()
             print("[tail] error:", e)
         time.sleep(interval)
 